@@ -5,16 +5,38 @@ import plotly.express as px
 import plotly.graph_objects as go
 from scipy import stats
 import os
+import sys
 import time
+import argparse
+import logging
+import hashlib
+import io
+import json
+import zipfile
+import sqlite3
+import datetime
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from functools import lru_cache
+
+# 可选依赖：DuckDB SQL查询引擎（未安装时相关功能不可用，其余分析仍使用pandas/numpy）
+try:
+    import duckdb
+except ImportError:
+    duckdb = None
+
+
+
+# 提高图表分辨率（作为模块导入或命令行批处理时没有Streamlit运行环境，不设置页面）
+if st.runtime.exists():
+    st.set_page_config(
+        page_title="CIE色点分析综合工具",
+        page_icon="🌈",
+        layout="wide"
+    )
 
-
-
-# 提高图表分辨率
-st.set_page_config(
-    page_title="CIE色点分析综合工具",
-    page_icon="🌈",
-    layout="wide"
-)
+# NCSP预设默认计算总占比的色区组合
+DEFAULT_TOTAL_ZONES = ['DK32', 'DK33', 'DK34', 'DK35', 'DL32', 'DL33', 'DL34', 'DL35']
 
 # 预定义色区数据（固定不变）
 COLOR_ZONE_PRESETS = {
@@ -132,59 +154,890 @@ color_scales = {
 }
 
 
-# 判断点是否在多边形内部的函数
-def point_in_polygon(point, polygon):
+# 向量化判断多个点是否在多边形内部
+def points_in_polygon(x, y, polygon):
     """
-    判断点是否在多边形内部
-    point: (x, y) 元组
+    向量化判断多个点是否在多边形内部（射线法，点在交点左侧或恰在交点上时计一次穿越）
+    x, y: 坐标数组
     polygon: 多边形顶点列表，每个顶点是(x, y)元组
     """
-    x, y = point
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    inside = np.zeros(x.shape, dtype=bool)
     n = len(polygon)
-    inside = False
 
     for i in range(n):
         j = (i + 1) % n
         xi, yi = polygon[i]
         xj, yj = polygon[j]
 
-        # 检查点是否在多边形的边上
-        if ((yi > y) != (yj > y)):
-            x_intersect = (y - yi) * (xj - xi) / (yj - yi) + xi
-            if x <= x_intersect:
-                inside = not inside
+        # 水平边不会与水平射线相交
+        if yi == yj:
+            continue
+        crossing = (yi > y) != (yj > y)
+        x_intersect = (y - yi) * (xj - xi) / (yj - yi) + xi
+        inside ^= crossing & (x <= x_intersect)
 
     return inside
 
 
-# 将数值映射到对应的Bin区
-def value_to_bin(value, bins):
-    """将数值映射到对应的Bin区"""
-    # 处理NaN值
-    if pd.isna(value):
-        return "NaN"
+# 色区几何表：由色区顶点预先计算的几何量，每个色区预设只构建一次
+class ZoneGeometry:
+    """
+    names: 色区名称（保持预设中的顺序）；vertices: 各色区顶点数组 (顶点数, 2)
+    edges: 各色区的边向量（第i条边从顶点i指向顶点i+1）；edge_slopes: 各边斜率（竖直边为inf）
+    positive_slopes: 平行四边形的正斜率（与calculate_parallelogram_positive_slopes一致，没有时为NaN）
+    bboxes: 外接矩形 (色区数, 4)，依次为x_min, x_max, y_min, y_max
+    edge_bboxes: 每条边的外接矩形 (边总数, 4)，edge_zone为每条边所属色区的序号
+    areas: 多边形面积
+    """
+
+    def __init__(self, color_zones):
+        self.names = list(color_zones.keys())
+        self.index = {name: i for i, name in enumerate(self.names)}
+        self.vertices = [np.asarray(color_zones[name], dtype=float).reshape(-1, 2) for name in self.names]
+        self.edges = [np.roll(vertices, -1, axis=0) - vertices for vertices in self.vertices]
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self.edge_slopes = [np.where(edges[:, 0] != 0, edges[:, 1] / edges[:, 0], np.inf) for edges in self.edges]
+        self.positive_slopes = np.full(len(self.names), np.nan)
+        for i, (vertices, slopes) in enumerate(zip(self.vertices, self.edge_slopes)):
+            if len(vertices) == 4:
+                # 保留6位小数去重（平行四边形对边斜率相等），取法与原有的集合去重一致
+                positive = list({round(float(slope), 6) for slope in slopes if 0 < slope < np.inf})
+                if positive:
+                    self.positive_slopes[i] = positive[0]
+
+        empty_box = [np.nan] * 4
+        self.bboxes = np.array([[v[:, 0].min(), v[:, 0].max(), v[:, 1].min(), v[:, 1].max()] if len(v) else empty_box
+                                for v in self.vertices], dtype=float).reshape(-1, 4)
+        starts = np.concatenate(self.vertices) if self.vertices else np.zeros((0, 2))
+        ends = np.concatenate([np.roll(v, -1, axis=0) for v in self.vertices]) if self.vertices else starts
+        self.edge_bboxes = np.column_stack([np.minimum(starts[:, 0], ends[:, 0]), np.maximum(starts[:, 0], ends[:, 0]),
+                                            np.minimum(starts[:, 1], ends[:, 1]), np.maximum(starts[:, 1], ends[:, 1])])
+        self.edge_zone = np.repeat(np.arange(len(self.names)), [len(v) for v in self.vertices])
+
+        # 鞋带公式计算面积
+        self.areas = np.zeros(len(self.names))
+        for i, vertices in enumerate(self.vertices):
+            if len(vertices) < 3:
+                continue
+            nxt = np.roll(vertices, -1, axis=0)
+            self.areas[i] = abs((vertices[:, 0] * nxt[:, 1] - nxt[:, 0] * vertices[:, 1]).sum()) / 2
+
+    def cell_grid(self):
+        """
+        色区空间索引：以色区外接矩形的中位宽高为单元格大小划分网格，
+        记录每个色区外接矩形覆盖的单元格范围（首次使用时构建）
+        """
+        if getattr(self, '_cell_grid', None) is None:
+            widths = self.bboxes[:, 1] - self.bboxes[:, 0]
+            heights = self.bboxes[:, 3] - self.bboxes[:, 2]
+            cell_w = np.median(widths[widths > 0]) if (widths > 0).any() else 1.0
+            cell_h = np.median(heights[heights > 0]) if (heights > 0).any() else 1.0
+            x0, y0 = self.bboxes[:, 0].min(), self.bboxes[:, 2].min()
+            nx = int(np.floor((self.bboxes[:, 1].max() - x0) / cell_w)) + 1
+            ny = int(np.floor((self.bboxes[:, 3].max() - y0) / cell_h)) + 1
+            zone_cells = np.column_stack([
+                np.floor((self.bboxes[:, 0] - x0) / cell_w), np.floor((self.bboxes[:, 1] - x0) / cell_w),
+                np.floor((self.bboxes[:, 2] - y0) / cell_h), np.floor((self.bboxes[:, 3] - y0) / cell_h)
+            ]).astype(int)
+            self._cell_grid = {'x0': x0, 'y0': y0, 'cell_w': cell_w, 'cell_h': cell_h, 'nx': nx, 'ny': ny,
+                               'zone_cells': zone_cells}
+        return self._cell_grid
+
+    def point_cells(self, x, y):
+        """点所在的网格单元编号（网格外为-1）"""
+        grid = self.cell_grid()
+        cx = np.floor((x - grid['x0']) / grid['cell_w'])
+        cy = np.floor((y - grid['y0']) / grid['cell_h'])
+        valid = (cx >= 0) & (cx < grid['nx']) & (cy >= 0) & (cy < grid['ny'])
+        return np.where(valid, cx * grid['ny'] + cy, -1).astype(np.int64)
+
+    def zone_indices(self, zone_names=None):
+        if zone_names is None:
+            return np.arange(len(self.names))
+        return np.array([self.index[name] for name in zone_names], dtype=int)
+
+    def bounds(self, zone_names=None):
+        """所选色区整体的外接矩形 (x_min, x_max, y_min, y_max)"""
+        boxes = self.bboxes[self.zone_indices(zone_names)]
+        return boxes[:, 0].min(), boxes[:, 1].max(), boxes[:, 2].min(), boxes[:, 3].max()
+
+    def vertex_array(self, zone_names=None):
+        """所选色区全部顶点组成的 (顶点数, 2) 数组"""
+        indices = self.zone_indices(zone_names)
+        if len(indices) == 0:
+            return np.zeros((0, 2))
+        return np.concatenate([self.vertices[i] for i in indices])
+
+    def closed_outline(self, zone_name):
+        """闭合多边形的x、y坐标列表（用于绘制色区）"""
+        vertices = self.vertices[self.index[zone_name]]
+        closed = np.vstack([vertices, vertices[:1]])
+        return closed[:, 0].tolist(), closed[:, 1].tolist()
+
+    def positive_slope(self, zone_name):
+        slope = self.positive_slopes[self.index[zone_name]]
+        return None if np.isnan(slope) else float(slope)
+
+
+def zone_geometry_key(color_zones):
+    return tuple((name, tuple(tuple(float(c) for c in vertex) for vertex in coords))
+                 for name, coords in color_zones.items())
+
+
+@lru_cache(maxsize=32)
+def _build_zone_geometry(key):
+    return ZoneGeometry({name: list(coords) for name, coords in key})
+
+
+# 获取色区预设对应的几何表（按色区顶点内容缓存，同一预设只构建一次）
+def get_zone_geometry(color_zones):
+    if isinstance(color_zones, ZoneGeometry):
+        return color_zones
+    return _build_zone_geometry(zone_geometry_key(color_zones))
+
+
+# --------------------------
+# 自定义色区预设导入与校验
+# --------------------------
+ZONE_PRESET_NAME_COLUMNS = ['色区', '名称', 'name', 'zone']
+ZONE_PRESET_VERTEX_COLUMNS = ['x1', 'y1', 'x2', 'y2', 'x3', 'y3', 'x4', 'y4']
+
+
+# 从表格（CSV/Excel）解析色区：每行一个色区，包含名称列和四个顶点坐标列
+def parse_zone_preset_table(df):
+    columns = {str(column).strip().lower(): column for column in df.columns}
+    name_column = next((columns[c.lower()] for c in ZONE_PRESET_NAME_COLUMNS if c.lower() in columns), None)
+    missing = [c for c in ZONE_PRESET_VERTEX_COLUMNS if c not in columns]
+    if name_column is None or missing:
+        raise ValueError(f"色区预设表需要名称列（{'/'.join(ZONE_PRESET_NAME_COLUMNS)}）及顶点列 "
+                         f"{', '.join(ZONE_PRESET_VERTEX_COLUMNS)}，缺少: {', '.join(missing) or '名称列'}")
+
+    coords = df[[columns[c] for c in ZONE_PRESET_VERTEX_COLUMNS]].apply(pd.to_numeric, errors='coerce')
+    zones = {}
+    for name, row in zip(df[name_column].astype(str).str.strip(), coords.to_numpy(dtype=float)):
+        if name in zones:
+            raise ValueError(f"色区名称重复: {name}")
+        zones[name] = [(row[i], row[i + 1]) for i in range(0, 8, 2)]
+    return zones
+
+
+# 从JSON解析色区：{色区名称: [[x, y], ...]}，可外包一层 {"name": 预设名称, "zones": {...}}，
+# zones也可以是 [{"name": 色区名称, "vertices": [[x, y], ...]}, ...] 形式的列表
+def parse_zone_preset_json(data):
+    preset_name = None
+    if isinstance(data, dict) and 'zones' in data:
+        preset_name = data.get('name')
+        data = data['zones']
+    if isinstance(data, list):
+        items = [(item['name'], item['vertices']) for item in data]
+    elif isinstance(data, dict):
+        items = list(data.items())
+    else:
+        raise ValueError("无法识别的JSON色区预设格式")
+
+    zones = {}
+    for name, vertices in items:
+        name = str(name).strip()
+        if name in zones:
+            raise ValueError(f"色区名称重复: {name}")
+        zones[name] = [(float(vertex[0]), float(vertex[1])) for vertex in vertices]
+    return preset_name, zones
+
+
+# 两个凸多边形的相交面积（Sutherland-Hodgman裁剪）
+def convex_intersection_area(subject, clip):
+    def signed_area(polygon):
+        polygon = np.asarray(polygon)
+        return 0.5 * np.sum(polygon[:, 0] * np.roll(polygon[:, 1], -1) - np.roll(polygon[:, 0], -1) * polygon[:, 1])
+
+    clip = np.asarray(clip, dtype=float)
+    if signed_area(clip) < 0:
+        clip = clip[::-1]
+    output = [tuple(p) for p in np.asarray(subject, dtype=float)]
+    for i in range(len(clip)):
+        if not output:
+            break
+        a, b = clip[i], clip[(i + 1) % len(clip)]
+
+        def side(p):
+            return (b[0] - a[0]) * (p[1] - a[1]) - (b[1] - a[1]) * (p[0] - a[0])
+
+        polygon, output = output, []
+        for k in range(len(polygon)):
+            current, previous = polygon[k], polygon[k - 1]
+            current_side, previous_side = side(current), side(previous)
+            if current_side >= 0:
+                if previous_side < 0:
+                    t = previous_side / (previous_side - current_side)
+                    output.append((previous[0] + t * (current[0] - previous[0]),
+                                   previous[1] + t * (current[1] - previous[1])))
+                output.append(current)
+            elif previous_side >= 0:
+                t = previous_side / (previous_side - current_side)
+                output.append((previous[0] + t * (current[0] - previous[0]),
+                               previous[1] + t * (current[1] - previous[1])))
+    return abs(signed_area(output)) if len(output) >= 3 else 0.0
+
+
+# 校验色区预设：顶点数与数值（错误）、凸性（错误）、色区重叠与色区之间的间隙（警告）
+def validate_color_zones(color_zones, relative_tolerance=1e-6):
+    """
+    返回 (errors, warnings) 两个消息列表。有错误的预设不能使用。
+    重叠：外接矩形相交的色区对计算相交面积，超过较小色区面积的relative_tolerance时报告；
+    间隙：从每条边的中点沿外法线方向取若干探测点，紧贴边外侧的点不属于任何色区、
+    而在半个色区尺寸以内又进入其他色区时，说明两个色区之间存在间隙（预设外边界的边不会被报告）
+    """
+    errors = []
+    warnings = []
+    if not color_zones:
+        return ["色区预设中没有任何色区"], warnings
+
+    for name, vertices in color_zones.items():
+        vertices = np.asarray(vertices, dtype=float)
+        if vertices.shape != (4, 2):
+            errors.append(f"色区 {name} 需要4个顶点，实际为 {len(vertices)} 个")
+        elif not np.isfinite(vertices).all():
+            errors.append(f"色区 {name} 的顶点坐标包含空值或非数值")
+    if errors:
+        return errors, warnings
+
+    geometry = get_zone_geometry(color_zones)
+    for name, edges in zip(geometry.names, geometry.edges):
+        turns = edges[:, 0] * np.roll(edges[:, 1], -1) - edges[:, 1] * np.roll(edges[:, 0], -1)
+        if not ((turns > 0).all() or (turns < 0).all()):
+            errors.append(f"色区 {name} 不是凸四边形（顶点顺序错误、自相交或退化）")
+    if errors:
+        return errors, warnings
+
+    # 重叠检查（只检查外接矩形相交的色区对）
+    boxes = geometry.bboxes
+    overlapping_boxes = ((boxes[:, None, 0] < boxes[None, :, 1]) & (boxes[None, :, 0] < boxes[:, None, 1]) &
+                         (boxes[:, None, 2] < boxes[None, :, 3]) & (boxes[None, :, 2] < boxes[:, None, 3]))
+    for i, j in zip(*np.nonzero(np.triu(overlapping_boxes, k=1))):
+        area = convex_intersection_area(geometry.vertices[i], geometry.vertices[j])
+        smaller = min(geometry.areas[i], geometry.areas[j])
+        if area > smaller * relative_tolerance:
+            warnings.append(f"色区 {geometry.names[i]} 与 {geometry.names[j]} 重叠"
+                            f"（重叠面积占较小色区的 {area / smaller:.2%}）")
+
+    # 间隙检查
+    scale = np.sqrt(np.median(geometry.areas))
+    distances = scale * np.array([1e-3, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5])
+    midpoints = []
+    normals = []
+    owners = []
+    for i, (vertices, edges) in enumerate(zip(geometry.vertices, geometry.edges)):
+        orientation = 1.0 if np.sum(vertices[:, 0] * np.roll(vertices[:, 1], -1) -
+                                    np.roll(vertices[:, 0], -1) * vertices[:, 1]) > 0 else -1.0
+        lengths = np.hypot(edges[:, 0], edges[:, 1])
+        midpoints.append(vertices + edges / 2)
+        normals.append(orientation * np.column_stack([edges[:, 1], -edges[:, 0]]) / lengths[:, None])
+        owners.extend((geometry.names[i], k + 1) for k in range(len(vertices)))
+    midpoints = np.concatenate(midpoints)
+    normals = np.concatenate(normals)
+
+    probes = midpoints[:, None, :] + normals[:, None, :] * distances[None, :, None]
+    covered = calculate_zone_membership(probes[..., 0].ravel(), probes[..., 1].ravel(), geometry).any(axis=1)
+    covered = covered.reshape(len(midpoints), len(distances))
+    gap_edges = ~covered[:, 0] & covered[:, 1:].any(axis=1)
+    for k in np.flatnonzero(gap_edges):
+        name, edge_number = owners[k]
+        gap_width = distances[1:][covered[k, 1:]].min()
+        warnings.append(f"色区 {name} 第{edge_number}条边外侧存在间隙（间隙宽度不超过约 {gap_width:.5f}）")
+
+    return errors, warnings
+
+
+# 读取上传的Excel文件内容；文件损坏（如截断的xlsx）或缺少读取引擎（如读取xls需要的xlrd）时抛出ValueError，
+# 由调用方和其它解析错误一样记入errors
+def read_excel_bytes(file_bytes):
+    try:
+        return pd.read_excel(io.BytesIO(file_bytes))
+    except (zipfile.BadZipFile, ImportError, OSError) as e:
+        raise ValueError(f"无法读取Excel文件: {e}") from e
+
+
+# 加载自定义色区预设文件（CSV/JSON/Excel），按文件内容缓存，并预先构建几何表与空间索引
+@st.cache_data(show_spinner=False)
+def load_zone_preset_file(file_bytes, file_name, encoding='utf-8'):
+    """
+    返回 {'name', 'hash', 'zones', 'errors', 'warnings'}；解析失败时zones为空、errors中给出原因
+    """
+    content_hash = hashlib.sha1(file_bytes).hexdigest()
+    preset_name = os.path.splitext(file_name)[0]
+    result = {'name': preset_name, 'hash': content_hash, 'zones': {}, 'errors': [], 'warnings': []}
+    try:
+        extension = os.path.splitext(file_name)[1].lower()
+        if extension == '.json':
+            json_name, zones = parse_zone_preset_json(json.loads(file_bytes.decode(encoding)))
+            preset_name = json_name or preset_name
+        elif extension in ('.xlsx', '.xls'):
+            zones = parse_zone_preset_table(read_excel_bytes(file_bytes))
+        else:
+            try:
+                table = pd.read_csv(io.BytesIO(file_bytes), encoding=encoding)
+            except UnicodeDecodeError:
+                table = pd.read_csv(io.BytesIO(file_bytes), encoding='gbk')
+            zones = parse_zone_preset_table(table)
+    except (ValueError, KeyError, TypeError, IndexError) as e:
+        result['errors'].append(f"色区预设文件解析失败: {e}")
+        return result
+
+    errors, warnings = validate_color_zones(zones)
+    result.update(name=str(preset_name), zones=zones, errors=errors, warnings=warnings)
+    if not errors:
+        # 预先构建几何表和空间索引，首次计算色区归属时无需再构建
+        get_zone_geometry(zones).cell_grid()
+    return result
+
+
+# 色区数超过该值时，先用色区空间索引查找候选点，避免每个色区都扫描全部点
+ZONE_INDEX_MIN_ZONES = 16
+
+
+# 计算所有点的色区归属矩阵
+def calculate_zone_membership(x, y, color_zones, zone_names=None):
+    """
+    返回 (点数, 色区数) 的布尔矩阵，第j列表示点是否落在 zone_names[j] 内
+    先用色区外接矩形筛选候选点，再对候选点做多边形判断；
+    色区较多时先按网格单元取出候选点，每个色区的开销只与附近的点数有关
+    """
+    geometry = get_zone_geometry(color_zones)
+    if zone_names is None:
+        zone_names = geometry.names
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    membership = np.zeros((len(x), len(zone_names)), dtype=bool)
+    zone_indices = geometry.zone_indices(zone_names)
+
+    use_cell_index = len(zone_indices) > ZONE_INDEX_MIN_ZONES and len(x) > 0
+    if use_cell_index:
+        point_cells = geometry.point_cells(x, y)
+        order = np.argsort(point_cells, kind='stable')
+        sorted_cells = point_cells[order]
+        zone_cells = geometry.cell_grid()['zone_cells']
+        ny = geometry.cell_grid()['ny']
+
+    for j, zone_index in enumerate(zone_indices):
+        x_min, x_max, y_min, y_max = geometry.bboxes[zone_index]
+        if use_cell_index:
+            cx0, cx1, cy0, cy1 = zone_cells[zone_index]
+            columns = np.arange(cx0, cx1 + 1) * ny
+            lo = np.searchsorted(sorted_cells, columns + cy0, side='left')
+            hi = np.searchsorted(sorted_cells, columns + cy1, side='right')
+            nearby = np.concatenate([order[a:b] for a, b in zip(lo, hi)])
+            candidates = nearby[(x[nearby] >= x_min) & (x[nearby] <= x_max) &
+                                (y[nearby] >= y_min) & (y[nearby] <= y_max)]
+        else:
+            candidates = np.flatnonzero((x >= x_min) & (x <= x_max) & (y >= y_min) & (y <= y_max))
+        if candidates.size:
+            membership[candidates, j] = points_in_polygon(x[candidates], y[candidates],
+                                                          geometry.vertices[zone_index])
+
+    return membership
+
+
+# 将色区归属矩阵转换为"所属色区"文本（多个色区用逗号分隔，未落入任何色区为"未命中"）
+def membership_to_labels(membership, zone_names):
+    labels = np.full(len(membership), "未命中", dtype=object)
+    hit = membership.any(axis=1) if membership.size else np.zeros(len(membership), dtype=bool)
+    if hit.any():
+        hit_rows = membership[hit]
+        if hit_rows.shape[1] <= 62:
+            # 每行的归属模式编码为一个整数，对一维整数去重比按行去重快得多
+            codes = hit_rows.astype(np.int64) @ (np.int64(1) << np.arange(hit_rows.shape[1], dtype=np.int64))
+            _, first, inverse = np.unique(codes, return_index=True, return_inverse=True)
+            patterns = hit_rows[first]
+        else:
+            patterns, inverse = np.unique(hit_rows, axis=0, return_inverse=True)
+        pattern_labels = np.array(
+            [", ".join(zone for zone, inside in zip(zone_names, pattern) if inside) for pattern in patterns],
+            dtype=object
+        )
+        labels[hit] = pattern_labels[inverse.ravel()]
+    return labels
+
+
+# 原始坐标点的空间索引（按x排序，支持矩形范围查询）
+def build_point_index(x, y):
+    """按x坐标排序建立原始坐标点的空间索引"""
+    order = np.argsort(x, kind='stable')
+    return {'order': order, 'x_sorted': x[order], 'y': y}
+
+
+def query_point_index(point_index, x_min, x_max, y_min, y_max):
+    """返回落在矩形 [x_min, x_max] × [y_min, y_max] 内的点的下标"""
+    lo = np.searchsorted(point_index['x_sorted'], x_min, side='left')
+    hi = np.searchsorted(point_index['x_sorted'], x_max, side='right')
+    candidates = point_index['order'][lo:hi]
+    y = point_index['y'][candidates]
+    return candidates[(y >= y_min) & (y <= y_max)]
+
+
+def update_zone_membership_for_offset(entry, color_zones, zone_names, new_offset):
+    """
+    中心点移动时增量更新色区归属。
+    偏移是纯平移，只有平移路径扫过色区边的点归属才可能改变，
+    因此只在原始坐标索引中查询这些点并重新判断，其余点沿用上一次的结果。
+    """
+    old_x, old_y = entry['offset']
+    new_x, new_y = new_offset
+    if (old_x, old_y) == (new_x, new_y):
+        return entry['membership']
+
+    eps = 1e-9  # 容忍浮点加法的舍入误差
+    geometry = get_zone_geometry(color_zones)
+    edge_bboxes = geometry.edge_bboxes[np.isin(geometry.edge_zone, geometry.zone_indices(zone_names))]
+    candidate_parts = []
+    for edge_x_min, edge_x_max, edge_y_min, edge_y_max in edge_bboxes:
+        # 边换算到原始坐标系后，在偏移从旧值变为新值的过程中扫过的矩形范围
+        candidate_parts.append(query_point_index(
+            entry['index'],
+            edge_x_min - max(old_x, new_x) - eps, edge_x_max - min(old_x, new_x) + eps,
+            edge_y_min - max(old_y, new_y) - eps, edge_y_max - min(old_y, new_y) + eps
+        ))
+
+    candidates = np.unique(np.concatenate(candidate_parts)) if candidate_parts else np.array([], dtype=int)
+    if candidates.size:
+        entry['membership'][candidates] = calculate_zone_membership(
+            entry['x'][candidates] + new_x, entry['y'][candidates] + new_y, color_zones, zone_names
+        )
+    entry['offset'] = (new_x, new_y)
+    return entry['membership']
+
+
+def get_cached_zone_membership(cache, file_name, x, y, color_zones, zone_names, offset=(0, 0)):
+    """
+    获取移动后坐标的色区归属，结果缓存在cache中（通常为st.session_state.membership_cache）。
+    同一文件、同一筛选条件和色区下只有偏移变化时走增量更新路径。
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    geometry = get_zone_geometry(color_zones)
+    key = (len(x), float(x.sum()), float(y.sum()),
+           tuple((zone, tuple(map(tuple, geometry.vertices[geometry.index[zone]]))) for zone in zone_names))
+    entry = cache.get((file_name, tuple(zone_names)))
+
+    if entry is None or entry['key'] != key:
+        entry = {
+            'key': key,
+            'x': x,
+            'y': y,
+            'index': build_point_index(x, y),
+            'offset': (offset[0], offset[1]),
+            'membership': calculate_zone_membership(x + offset[0], y + offset[1], color_zones, zone_names)
+        }
+        cache[(file_name, tuple(zone_names))] = entry
+        return entry['membership']
+
+    return update_zone_membership_for_offset(entry, color_zones, zone_names, offset)
+
+
+# 合并坐标完全相同的点（仪器分辨率有限，大量点坐标重复），返回去重坐标及每个坐标的点数
+def compress_points(x, y):
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    valid = ~(np.isnan(x) | np.isnan(y))
+    xy = np.ascontiguousarray(np.column_stack([x[valid], y[valid]])).view(np.complex128).ravel()
+    unique_xy, weights = np.unique(xy, return_counts=True)
+    return unique_xy.real.copy(), unique_xy.imag.copy(), weights
+
+
+# 统计在给定偏移下落入所选色区（任意一个）的点数，weights为每个坐标代表的点数
+def count_points_in_zones(x, y, color_zones, zone_names, offset=(0, 0), weights=None):
+    if not zone_names:
+        return 0
+    hit = calculate_zone_membership(x + offset[0], y + offset[1], color_zones, zone_names).any(axis=1)
+    return int(hit.sum()) if weights is None else int(weights[hit].sum())
+
+
+# 搜索使落入所选色区的比例最大的中心点偏移
+def optimize_center_offset(x, y, color_zones, zone_names, start_offset=(0, 0), search_radius=0.01,
+                           coarse_steps=21, max_coarse_points=50000, min_step=1e-5, seed=0):
+    """
+    先在 start_offset ± search_radius 的粗网格上用抽样点评估落入率，
+    再从最优的几个网格点出发用全部点做局部细化（步长逐次减半）。
+    坐标相同的点合并后带权评估，结果与逐点判断一致。
+    返回 (最优偏移, 落入点数, 总点数)
+    """
+    total_points = len(x)
+    if total_points == 0 or not zone_names:
+        return (start_offset[0], start_offset[1]), 0, total_points
+    x, y, weights = compress_points(x, y)
+
+    # 搜索范围内任何偏移都无法进入所选色区的点不参与评估
+    zone_x_min, zone_x_max, zone_y_min, zone_y_max = get_zone_geometry(color_zones).bounds(zone_names)
+    reach = search_radius + 1e-9
+    near = ((x >= zone_x_min - start_offset[0] - reach) & (x <= zone_x_max - start_offset[0] + reach) &
+            (y >= zone_y_min - start_offset[1] - reach) & (y <= zone_y_max - start_offset[1] + reach))
+    x_near, y_near, w_near = x[near], y[near], weights[near]
+    if len(x_near) == 0:
+        return (start_offset[0], start_offset[1]), 0, total_points
+
+    # 1. 粗网格搜索（按点数加权抽样）
+    if len(x_near) > max_coarse_points:
+        sample = np.random.default_rng(seed).choice(len(x_near), max_coarse_points, replace=False,
+                                                    p=w_near / w_near.sum())
+        x_coarse, y_coarse, w_coarse = x_near[sample], y_near[sample], None
+    else:
+        x_coarse, y_coarse, w_coarse = x_near, y_near, w_near
+    grid = np.linspace(-search_radius, search_radius, coarse_steps)
+    coarse_scores = []
+    for dx in grid:
+        for dy in grid:
+            offset = (start_offset[0] + dx, start_offset[1] + dy)
+            score = count_points_in_zones(x_coarse, y_coarse, color_zones, zone_names, offset, w_coarse)
+            # 得分相同时优先选择离起始偏移更近的点
+            coarse_scores.append((score, -(dx * dx + dy * dy), offset))
+    coarse_scores.sort(reverse=True)
+
+    # 2. 局部细化（全部点）
+    step = grid[1] - grid[0] if coarse_steps > 1 else search_radius
+    best_offset, best_count = None, -1
+    for _, _, offset in coarse_scores[:3]:
+        current = offset
+        current_count = count_points_in_zones(x_near, y_near, color_zones, zone_names, current, w_near)
+        current_step = step / 2
+        while current_step >= min_step:
+            moved = False
+            for dx, dy in [(1, 0), (-1, 0), (0, 1), (0, -1), (1, 1), (1, -1), (-1, 1), (-1, -1)]:
+                candidate = (current[0] + dx * current_step, current[1] + dy * current_step)
+                if (abs(candidate[0] - start_offset[0]) > search_radius or
+                        abs(candidate[1] - start_offset[1]) > search_radius):
+                    continue
+                count = count_points_in_zones(x_near, y_near, color_zones, zone_names, candidate, w_near)
+                if count > current_count:
+                    current, current_count, moved = candidate, count, True
+            if not moved:
+                current_step /= 2
+        if current_count > best_count:
+            best_offset, best_count = current, current_count
+
+    return best_offset, best_count, total_points
+
+
+# 仪器分辨率网格：覆盖所选色区的外接矩形（换算到偏移前的原始坐标，并向外扩展margin）
+def build_zone_grid(color_zones, zone_names, offset=(0, 0), resolution=0.0001, margin=0.0):
+    zone_x_min, zone_x_max, zone_y_min, zone_y_max = get_zone_geometry(color_zones).bounds(zone_names)
+    ix0 = int(np.floor((zone_x_min - offset[0] - margin) / resolution)) - 1
+    ix1 = int(np.ceil((zone_x_max - offset[0] + margin) / resolution)) + 1
+    iy0 = int(np.floor((zone_y_min - offset[1] - margin) / resolution)) - 1
+    iy1 = int(np.ceil((zone_y_max - offset[1] + margin) / resolution)) + 1
+    nx, ny = ix1 - ix0 + 1, iy1 - iy0 + 1
+    # 网格坐标取整到分辨率的小数位，使其与仪器读数的浮点值一致
+    decimals = max(int(np.ceil(-np.log10(resolution))), 0) + 2
+    return {
+        'ix0': ix0, 'iy0': iy0, 'nx': nx, 'ny': ny, 'resolution': resolution,
+        'x': np.round((ix0 + np.arange(nx)) * resolution, decimals),
+        'y': np.round((iy0 + np.arange(ny)) * resolution, decimals)
+    }
+
+
+# 返回每个点所在网格单元的一维下标（x优先），网格外或坐标缺失的点为-1
+def grid_cell_index(grid, x, y):
+    resolution = grid['resolution']
+    cell = np.full(len(x), -1, dtype=np.int64)
+    valid = ~(np.isnan(x) | np.isnan(y))
+    ia = np.rint(x[valid] / resolution).astype(np.int64) - grid['ix0']
+    ib = np.rint(y[valid] / resolution).astype(np.int64) - grid['iy0']
+    inside_grid = (ia >= 0) & (ia < grid['nx']) & (ib >= 0) & (ib < grid['ny'])
+    cell[np.flatnonzero(valid)[inside_grid]] = ia[inside_grid] * grid['ny'] + ib[inside_grid]
+    return cell
+
+
+# 色区栅格化：返回 (单元格数, 色区数) 掩膜，表示单元格中心加上偏移后是否落入各色区
+def rasterize_zones(grid, color_zones, zone_names, offset=(0, 0)):
+    mesh_x, mesh_y = np.meshgrid(grid['x'] + offset[0], grid['y'] + offset[1], indexing='ij')
+    return calculate_zone_membership(mesh_x.ravel(), mesh_y.ravel(), color_zones, zone_names)
+
+
+# 找出色区边界穿过的网格单元（单元格四角与中心的归属不一致，或单元格内含色区顶点）
+def find_boundary_cells(grid, color_zones, zone_names, offset=(0, 0), center_masks=None):
+    resolution = grid['resolution']
+    nx, ny = grid['nx'], grid['ny']
+    if center_masks is None:
+        center_masks = rasterize_zones(grid, color_zones, zone_names, offset)
+    corner_x = (grid['ix0'] + np.arange(nx + 1) - 0.5) * resolution + offset[0]
+    corner_y = (grid['iy0'] + np.arange(ny + 1) - 0.5) * resolution + offset[1]
+    mesh_x, mesh_y = np.meshgrid(corner_x, corner_y, indexing='ij')
+    corners = calculate_zone_membership(mesh_x.ravel(), mesh_y.ravel(), color_zones, zone_names)
+    corners = corners.reshape(nx + 1, ny + 1, len(zone_names))
+    centers = center_masks.reshape(nx, ny, len(zone_names))
+
+    reference = corners[:-1, :-1]
+    same = ((reference == corners[1:, :-1]) & (reference == corners[:-1, 1:]) &
+            (reference == corners[1:, 1:]) & (reference == centers)).all(axis=2)
+    boundary = ~same.ravel()
+
+    vertices = get_zone_geometry(color_zones).vertex_array(zone_names)
+    vertex_x = vertices[:, 0] - offset[0]
+    vertex_y = vertices[:, 1] - offset[1]
+    vertex_cells = grid_cell_index(grid, vertex_x, vertex_y)
+    boundary[vertex_cells[vertex_cells >= 0]] = True
+    return boundary
+
+
+# 计算落入率随中心点偏移变化的响应面
+def calculate_yield_response_surface(x, y, color_zones, zone_names, center_offset=(0, 0), search_radius=0.005,
+                                     resolution=0.0001):
+    """
+    计算 center_offset ± search_radius 范围内每个偏移（步长为resolution）下落入所选色区的比例。
+    数据点只按仪器分辨率直方图化一次，色区在同一网格上栅格化为掩膜，
+    所有偏移的落入点数由直方图与掩膜的互相关（FFT卷积）一次得到，无需逐偏移判断。
+    对4位小数的仪器数据结果与逐点判断一致，仅恰好落在色区边上的点可能因浮点舍入归属不同。
+    返回 (x偏移数组, y偏移数组, 落入率矩阵[%]，形状为(len(y偏移), len(x偏移)))
+    """
+    from scipy.signal import fftconvolve
+
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    total_points = len(x)
+    steps = int(round(search_radius / resolution))
+    offsets_x = center_offset[0] + np.arange(-steps, steps + 1) * resolution
+    offsets_y = center_offset[1] + np.arange(-steps, steps + 1) * resolution
+    if total_points == 0 or not zone_names:
+        return offsets_x, offsets_y, np.zeros((len(offsets_y), len(offsets_x)))
+
+    # 网格覆盖所有在搜索范围内可能进入色区的原始坐标（网格外的点在任何偏移下都不会落入色区）
+    grid = build_zone_grid(color_zones, zone_names, center_offset, resolution, margin=search_radius)
+    nx, ny = grid['nx'], grid['ny']
+
+    # 1. 数据点直方图
+    cell = grid_cell_index(grid, x, y)
+    histogram = np.bincount(cell[cell >= 0], minlength=nx * ny).reshape(nx, ny)
 
-    for bin_code, (min_val, max_val) in bins.items():
-        if min_val <= value < max_val:
-            return bin_code
-    return "Out of Range"
+    # 2. 色区掩膜：网格点加上基准偏移后是否落入所选色区
+    mask = rasterize_zones(grid, color_zones, zone_names, center_offset).any(axis=1).reshape(nx, ny)
+
+    # 3. 互相关：counts[i, j] = Σ histogram[a, b] * mask[a + i, b + j]
+    correlation = fftconvolve(mask.astype(float), histogram[::-1, ::-1].astype(float), mode='full')
+    counts = np.rint(correlation[nx - 1 - steps:nx + steps, ny - 1 - steps:ny + steps])
+    return offsets_x, offsets_y, (counts / total_points * 100).T
+
+
+# 对每个文件或所有文件合并搜索最优偏移
+def optimize_center_offsets(df_dict, selected_bin_codes, color_zones, zone_names, target_center,
+                            pooled=True, search_radius=0.01):
+    """
+    返回DataFrame，每行包含最优偏移、对应的目标中心点以及优化前后的落入率
+    目标中心点 = 实际平均中心点 + 最优偏移，可直接用于中心点移动设置
+    """
+    file_stats = calculate_file_center_stats(df_dict, selected_bin_codes)
+    if not file_stats:
+        return pd.DataFrame()
+
+    groups = {}
+    for file_name, df in df_dict.items():
+        if file_name not in file_stats:
+            continue
+        filtered_df = df[df['bin_code'].isin(selected_bin_codes)]
+        key = '所有文件合并' if pooled else file_name
+        groups.setdefault(key, []).append(filtered_df)
+
+    results = []
+    for group_name, frames in groups.items():
+        ciex = np.concatenate([f['ciex'].to_numpy(dtype=float) for f in frames])
+        ciey = np.concatenate([f['ciey'].to_numpy(dtype=float) for f in frames])
+        center_x, center_y = ciex.mean(), ciey.mean()
+        start_offset = (target_center[0] - center_x, target_center[1] - center_y)
+
+        start_count = count_points_in_zones(ciex, ciey, color_zones, zone_names, start_offset)
+        best_offset, best_count, total_points = optimize_center_offset(
+            ciex, ciey, color_zones, zone_names, start_offset, search_radius
+        )
+        results.append({
+            '文件': group_name,
+            '样本数': total_points,
+            '最优X偏移': best_offset[0],
+            '最优Y偏移': best_offset[1],
+            '最优目标中心点 x': center_x + best_offset[0],
+            '最优目标中心点 y': center_y + best_offset[1],
+            '当前落入率(%)': start_count / total_points * 100,
+            '最优落入率(%)': best_count / total_points * 100
+        })
+
+    return pd.DataFrame(results)
+
+
+# 校验参数Bin表：Bin区范围有效、order与bins一致、区间不重叠（错误），区间之间有间隙（警告）
+def validate_production_bins(production_bins):
+    errors = []
+    warnings = []
+    if not production_bins:
+        return ["参数Bin表中没有任何参数"], warnings
+
+    for param, config in production_bins.items():
+        missing = [key for key in ('column', 'bins') if key not in config]
+        if missing:
+            errors.append(f"参数 {param} 缺少配置项: {', '.join(missing)}")
+            continue
+        bins = config['bins']
+        if not bins:
+            errors.append(f"参数 {param} 没有任何Bin区")
+            continue
+        invalid = [code for code, (low, high) in bins.items() if not (np.isfinite(low) and np.isfinite(high) and low < high)]
+        if invalid:
+            errors.append(f"参数 {param} 的Bin区范围无效（下限需小于上限）: {', '.join(map(str, invalid))}")
+            continue
+        order = config.get('order', list(bins.keys()))
+        if sorted(map(str, order)) != sorted(map(str, bins.keys())):
+            errors.append(f"参数 {param} 的order与bins中的Bin区不一致")
+
+        ranges = sorted(bins.items(), key=lambda item: item[1][0])
+        for (code_a, (_, high_a)), (code_b, (low_b, _)) in zip(ranges, ranges[1:]):
+            if low_b < high_a:
+                errors.append(f"参数 {param} 的Bin区 {code_a} 与 {code_b} 范围重叠")
+            elif low_b > high_a:
+                warnings.append(f"参数 {param} 的Bin区 {code_a} 与 {code_b} 之间存在间隙（{high_a}-{low_b}），"
+                                f"该范围内的数据将记为Out of Range")
+    return errors, warnings
+
+
+# 将参数Bin表编译为按下限排序的边界数组，供向量化分Bin使用（Bin区为左闭右开区间）
+def compile_production_bins(production_bins):
+    compiled = {}
+    for param, config in production_bins.items():
+        ranges = sorted(config['bins'].items(), key=lambda item: item[1][0])
+        compiled[param] = {
+            'column': config['column'],
+            'codes': np.array([code for code, _ in ranges] + ["Out of Range", "NaN"], dtype=object),
+            'lower': np.array([low for _, (low, _) in ranges], dtype=float),
+            'upper': np.array([high for _, (_, high) in ranges], dtype=float)
+        }
+    return compiled
+
+
+# 一次向量化计算所有参数的Bin区，返回 {参数_Bin: Bin区数组}；数据中不存在的参数列不计算
+def assign_production_bins(df, compiled_bins):
+    result = {}
+    for param, bins in compiled_bins.items():
+        if bins['column'] not in df.columns:
+            continue
+        values = pd.to_numeric(df[bins['column']], errors='coerce').to_numpy(dtype=float)
+        n_bins = len(bins['lower'])
+        index = np.searchsorted(bins['lower'], values, side='right') - 1
+        in_range = (index >= 0) & (values < bins['upper'][np.clip(index, 0, max(n_bins - 1, 0))])
+        index = np.where(in_range, index, n_bins)  # Out of Range
+        index[np.isnan(values)] = n_bins + 1  # NaN
+        result[f"{param}_Bin"] = bins['codes'][index]
+    return result
+
+
+# 解析参数Bin表：表格每行一个Bin区，列为 参数、列名、名称、单位、Bin区、下限、上限（可选 产品类型）
+def parse_production_bins_table(df):
+    required = ['参数', '列名', 'Bin区', '下限', '上限']
+    missing = [column for column in required if column not in df.columns]
+    if missing:
+        raise ValueError(f"参数Bin表缺少列: {', '.join(missing)}")
+
+    presets = {}
+    products = df['产品类型'].fillna('*').astype(str) if '产品类型' in df.columns else pd.Series('*', index=df.index)
+    for (product, param), rows in df.groupby([products, df['参数'].astype(str)], sort=False):
+        presets.setdefault(product, {})[param] = {
+            'column': str(rows['列名'].iloc[0]),
+            # 名称、单位为空时分别使用参数名、空字符串
+            'name': str(rows['名称'].iloc[0]) if '名称' in rows.columns and pd.notna(rows['名称'].iloc[0]) else param,
+            'units': str(rows['单位'].iloc[0]) if '单位' in rows.columns and pd.notna(rows['单位'].iloc[0]) else '',
+            'bins': {str(code): (float(low), float(high))
+                     for code, low, high in zip(rows['Bin区'], rows['下限'], rows['上限'])},
+            'order': [str(code) for code in rows['Bin区']]
+        }
+    return presets
+
+
+# 解析JSON参数Bin表：{产品类型: {参数: PRODUCTION_BINS格式的配置}}，不区分产品类型时可直接给出参数配置
+def parse_production_bins_json(data):
+    if not isinstance(data, dict) or not data:
+        raise ValueError("无法识别的JSON参数Bin表格式")
+    if all(isinstance(config, dict) and 'bins' in config for config in data.values()):
+        data = {'*': data}
+
+    presets = {}
+    for product, params in data.items():
+        if not isinstance(params, dict):
+            raise ValueError(f"产品类型 {product} 的参数配置应为JSON对象")
+        for param, config in params.items():
+            if not isinstance(config, dict) or not isinstance(config.get('bins'), dict):
+                raise ValueError(f"参数 {param} 的配置应为JSON对象，且bins应为 {{Bin区: [下限, 上限]}} 形式的对象")
+        presets[str(product)] = {
+            str(param): {
+                'column': config['column'],
+                'name': config.get('name', param),
+                'units': config.get('units', ''),
+                'bins': {str(code): (float(bounds[0]), float(bounds[1])) for code, bounds in config['bins'].items()},
+                'order': [str(code) for code in config.get('order', config['bins'].keys())]
+            }
+            for param, config in params.items()
+        }
+    return presets
+
+
+# 加载参数Bin表文件（CSV/JSON/Excel），按文件内容缓存
+@st.cache_data(show_spinner=False)
+def load_production_bins_file(file_bytes, file_name, encoding='utf-8'):
+    """
+    返回 {'presets': {产品类型: 参数Bin表}, 'errors', 'warnings'}；产品类型 "*" 表示适用于所有产品
+    """
+    result = {'presets': {}, 'errors': [], 'warnings': []}
+    try:
+        extension = os.path.splitext(file_name)[1].lower()
+        if extension == '.json':
+            presets = parse_production_bins_json(json.loads(file_bytes.decode(encoding)))
+        elif extension in ('.xlsx', '.xls'):
+            presets = parse_production_bins_table(read_excel_bytes(file_bytes))
+        else:
+            try:
+                table = pd.read_csv(io.BytesIO(file_bytes), encoding=encoding)
+            except UnicodeDecodeError:
+                table = pd.read_csv(io.BytesIO(file_bytes), encoding='gbk')
+            presets = parse_production_bins_table(table)
+    except (ValueError, KeyError, TypeError, IndexError) as e:
+        result['errors'].append(f"参数Bin表解析失败: {e}")
+        return result
+
+    for product, production_bins in presets.items():
+        errors, warnings = validate_production_bins(production_bins)
+        label = "所有产品" if product == '*' else f"产品 {product}"
+        result['errors'].extend(f"{label}: {message}" for message in errors)
+        result['warnings'].extend(f"{label}: {message}" for message in warnings)
+    result['presets'] = presets
+    return result
+
+
+# 获取产品类型对应的参数Bin表：导入的通用配置（"*"）与该产品配置合并（同名参数以产品配置为准），未导入时使用内置PRODUCTION_BINS
+def get_production_bins(custom_presets, product_type):
+    if custom_presets and (product_type in custom_presets or '*' in custom_presets):
+        production_bins = dict(custom_presets.get('*', {}))
+        production_bins.update(custom_presets.get(product_type, {}))
+        return production_bins
+    return PRODUCTION_BINS
 
 
 # 缓存数据加载函数
 @st.cache_data(show_spinner=False)
 def load_data(file, product_type, encoding='gbk'):
-    file_ext = os.path.splitext(file.name)[1].lower()
+    try:
+        return read_lot_file(file, product_type, encoding)
+    except ValueError as e:
+        st.error(str(e))
+        return None
+
+
+# 读取并检查分光数据文件（不依赖界面，供网页和批处理共用）；file为上传的文件对象或文件路径，格式或列不符合时抛出ValueError
+def read_lot_file(file, product_type, encoding='gbk'):
+    file_ext = os.path.splitext(getattr(file, 'name', file))[1].lower()
     if file_ext == '.xlsx' or file_ext == '.xls':
         df = pd.read_excel(file)
     elif file_ext == '.csv':
         try:
             df = pd.read_csv(file, encoding=encoding)
         except UnicodeDecodeError:
-            st.error(f"无法使用 {encoding} 编码读取 CSV 文件")
-            return None
+            raise ValueError(f"无法使用 {encoding} 编码读取 CSV 文件")
     else:
-        st.error(f"不支持的文件格式: {file_ext}")
-        return None
+        raise ValueError(f"不支持的文件格式: {file_ext}")
 
     # 检查必要的列是否存在
     if product_type == "CSP":
@@ -197,8 +1050,7 @@ def load_data(file, product_type, encoding='gbk'):
     missing_columns = [col for col in required_columns if col not in df.columns]
 
     if missing_columns:
-        st.error(f"文件缺少必要的列: {', '.join(missing_columns)}")
-        return None
+        raise ValueError(f"文件缺少必要的列: {', '.join(missing_columns)}")
 
     # 坐标修正：仅对NCSP产品进行修正
     if product_type == "NCSP":
@@ -207,6 +1059,28 @@ def load_data(file, product_type, encoding='gbk'):
     return df
 
 
+# 加载时预计算bin号（1-80）直方图：按bin_code分行，筛选bin_code时只需对相应行求和
+def build_bin_histogram(df, max_bin=80):
+    """
+    返回 {'bin_codes': bin_code数组, 'counts': 形状为(bin_code数, max_bin+1)的计数矩阵}，
+    counts[:, b] 为bin号b的数量（第0列不使用）；数据没有bin列时返回None，超出1-max_bin或非整数的bin号不计入
+    """
+    if 'bin' not in df.columns:
+        return None
+    code_index, bin_codes = pd.factorize(df['bin_code'])
+    bin_values = pd.to_numeric(df['bin'], errors='coerce').to_numpy(dtype=float)
+    valid = (code_index >= 0) & (bin_values >= 1) & (bin_values <= max_bin) & (bin_values == np.round(bin_values))
+    flat_index = code_index[valid] * (max_bin + 1) + bin_values[valid].astype(np.int64)
+    counts = np.bincount(flat_index, minlength=len(bin_codes) * (max_bin + 1)).reshape(len(bin_codes), max_bin + 1)
+    return {'bin_codes': np.asarray(bin_codes, dtype=object), 'counts': counts}
+
+
+# 按bin_code筛选条件从预计算直方图得到bin号1-max_bin的计数（固定长度数组）
+def select_bin_histogram(histogram, selected_bin_codes):
+    selected = np.isin(histogram['bin_codes'], list(selected_bin_codes))
+    return histogram['counts'][selected].sum(axis=0)[1:]
+
+
 # 颜色转换函数：将十六进制颜色转换为RGBA格式
 def hex_to_rgba(hex_color, alpha=0.2):
     """将十六进制颜色转换为RGBA字符串"""
@@ -221,20 +1095,8 @@ def hex_to_rgba(hex_color, alpha=0.2):
 # --------------------------
 # 新增：1. 坐标轴固定比例计算函数
 # --------------------------
-def calculate_fixed_ratio_range(all_ciex, all_ciey):
-    """
-    计算固定比例的坐标轴范围：
-    - x轴：9个刻度，每个0.0055，总范围0.044
-    - y轴：6个刻度，每个0.01，总范围0.05
-    - 基于数据中心点居中显示
-    """
-    if not all_ciex or not all_ciey:
-        return [0, 0.044], [0, 0.05]  # 默认范围
-
-    # 计算数据中心点
-    x_center = np.mean(all_ciex)
-    y_center = np.mean(all_ciey)
-
+# 以给定中心点计算固定比例的坐标轴范围：x轴9个刻度、每个0.0055，y轴6个刻度、每个0.01，居中显示
+def fixed_ratio_range_around(x_center, y_center):
     # 固定总范围（刻度数-1 * 刻度单位）
     x_total_range = 0.0055 * (9 - 1)  # 9个刻度 → 8个间隔
     y_total_range = 0.01 * (6 - 1)  # 6个刻度 → 5个间隔
@@ -248,33 +1110,83 @@ def calculate_fixed_ratio_range(all_ciex, all_ciey):
     return [x_min, x_max], [y_min, y_max]
 
 
+# 合并各文件的聚合量（点数、坐标和、最小/最大值）与色区顶点，得到坐标轴范围计算所需的整体聚合量
+# 只依赖各文件的聚合结果，计算量与文件数和色区顶点数成正比，与数据点数无关
+def calculate_range_aggregates(file_stats, color_zones, move_center=False, target_center=(0.2771, 0.26)):
+    """
+    file_stats: summarize_center_stats的结果
+    move_center: 为True时每个文件按各自中心点平移到目标中心点（平移后该文件的中心点即为目标中心点）
+    返回 {'count', 'sum_x', 'sum_y', 'min_x', 'max_x', 'min_y', 'max_y'}，没有任何坐标时返回None
+    """
+    stats_list = list(file_stats.values())
+    counts = np.array([s['count'] for s in stats_list], dtype=float)
+    sum_x = np.array([s['sum_x'] for s in stats_list], dtype=float)
+    sum_y = np.array([s['sum_y'] for s in stats_list], dtype=float)
+    min_x = np.array([s['min_x'] for s in stats_list], dtype=float)
+    max_x = np.array([s['max_x'] for s in stats_list], dtype=float)
+    min_y = np.array([s['min_y'] for s in stats_list], dtype=float)
+    max_y = np.array([s['max_y'] for s in stats_list], dtype=float)
+
+    if move_center and len(stats_list):
+        shift_x = target_center[0] - sum_x / counts
+        shift_y = target_center[1] - sum_y / counts
+        min_x, max_x = min_x + shift_x, max_x + shift_x
+        min_y, max_y = min_y + shift_y, max_y + shift_y
+        sum_x = counts * target_center[0]
+        sum_y = counts * target_center[1]
+
+    vertices = get_zone_geometry(color_zones).vertex_array()
+    total_count = counts.sum() + len(vertices)
+    if total_count == 0:
+        return None
+
+    return {
+        'count': total_count,
+        'sum_x': sum_x.sum() + vertices[:, 0].sum(),
+        'sum_y': sum_y.sum() + vertices[:, 1].sum(),
+        'min_x': np.concatenate([min_x, vertices[:, 0]]).min(),
+        'max_x': np.concatenate([max_x, vertices[:, 0]]).max(),
+        'min_y': np.concatenate([min_y, vertices[:, 1]]).min(),
+        'max_y': np.concatenate([max_y, vertices[:, 1]]).max()
+    }
+
+
+# 计算CIE散点图的坐标轴范围（包含所有数据点和色区顶点），没有数据时返回None
+def calculate_axis_ranges(file_stats, color_zones, move_center=False, target_center=(0.2771, 0.26),
+                          fixed_ratio=False):
+    aggregates = calculate_range_aggregates(file_stats, color_zones, move_center, target_center)
+    if aggregates is None:
+        return None
+
+    if fixed_ratio:
+        return fixed_ratio_range_around(aggregates['sum_x'] / aggregates['count'],
+                                        aggregates['sum_y'] / aggregates['count'])
+
+    x_min, x_max = aggregates['min_x'], aggregates['max_x']
+    y_min, y_max = aggregates['min_y'], aggregates['max_y']
+    x_margin = (x_max - x_min) * 0.1
+    y_margin = (y_max - y_min) * 0.1
+    return [x_min - x_margin, x_max + x_margin], [y_min - y_margin, y_max + y_margin]
+
+
 # --------------------------
 # 新增：2. 斜率计算相关函数
 # --------------------------
 def find_zone_containing_point(target_point, color_zones):
-    """找到包含目标点的色区（平行四边形）"""
-    for zone_name, zone_coords in color_zones.items():
-        if point_in_polygon(target_point, zone_coords):
-            return zone_name, zone_coords
-    return None, None
+    """找到包含目标点的色区（平行四边形），按预设顺序返回第一个"""
+    geometry = get_zone_geometry(color_zones)
+    membership = calculate_zone_membership([target_point[0]], [target_point[1]], geometry)[0]
+    if not membership.any():
+        return None, None
+    zone_name = geometry.names[int(np.argmax(membership))]
+    return zone_name, color_zones[zone_name]
 
 
 def calculate_parallelogram_positive_slopes(zone_coords):
     """计算平行四边形的正斜率（仅返回>0的斜率，去重）"""
     if len(zone_coords) != 4:
         return None
-
-    # 计算四条边的斜率
-    slopes = []
-    for i in range(4):
-        p1 = zone_coords[i]
-        p2 = zone_coords[(i + 1) % 4]
-        slope = (p2[1] - p1[1]) / (p2[0] - p1[0]) if (p2[0] - p1[0]) != 0 else float('inf')
-        slopes.append(round(slope, 6))  # 保留6位小数去重
-
-    # 筛选正斜率，去重（平行四边形对边斜率相等）
-    positive_slopes = list({slope for slope in slopes if slope > 0 and slope != float('inf')})
-    return positive_slopes[0] if positive_slopes else None  # 返回唯一正斜率
+    return get_zone_geometry({'zone': zone_coords}).positive_slope('zone')
 
 
 def get_slope_line_params(target_point, slope):
@@ -287,40 +1199,190 @@ def get_slope_line_params(target_point, slope):
     y_line = [slope * x + b for x in x_line]
     return equation, (x_line, y_line)
 
-# 生成带色区的交互式CIE散点图（支持中心点移动，色区位置固定）
+# 按bin_code筛选每个文件的数据
+def filter_dataframes(df_dict, selected_bin_codes):
+    return {file_name: df[df['bin_code'].isin(selected_bin_codes)] for file_name, df in df_dict.items()}
+
+
+# 单遍均值/协方差累加器（Welford算法，数据块之间按Chan公式合并）
+class WelfordAccumulator:
+    """
+    按数据块更新的均值与协方差累加器。
+    count: 样本数；mean: 各维度均值；m2: 离差乘积和矩阵（对角线为各维度的平方离差和）
+    同一组数据无论一次性加入、分块加入还是分文件累加后合并，结果相同（在浮点误差范围内），
+    因此可用于流式读取和多文件合并统计。
+    """
+
+    def __init__(self, dim=1):
+        self.count = 0
+        self.mean = np.zeros(dim)
+        self.m2 = np.zeros((dim, dim))
+
+    def update(self, values):
+        """加入一个数据块，values为一维数组（dim=1）或形状为(n, dim)的数组"""
+        values = np.asarray(values, dtype=float).reshape(-1, len(self.mean))
+        if len(values) == 0:
+            return self
+        chunk = WelfordAccumulator(len(self.mean))
+        chunk.count = len(values)
+        chunk.mean = values.mean(axis=0)
+        centered = values - chunk.mean
+        chunk.m2 = centered.T @ centered
+        return self.merge(chunk)
+
+    def merge(self, other):
+        """合并另一个累加器（不修改other）"""
+        if other.count == 0:
+            return self
+        total = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean = self.mean + delta * (other.count / total)
+        self.m2 = self.m2 + other.m2 + np.outer(delta, delta) * (self.count * other.count / total)
+        self.count = total
+        return self
+
+    def copy(self):
+        return WelfordAccumulator(len(self.mean)).merge(self)
+
+    def variance(self, ddof=1):
+        if self.count <= ddof:
+            return np.full(len(self.mean), np.nan)
+        return np.diag(self.m2) / (self.count - ddof)
+
+    def std(self, ddof=1):
+        return np.sqrt(self.variance(ddof))
+
+    def covariance(self, ddof=1):
+        if self.count <= ddof:
+            return np.full(self.m2.shape, np.nan)
+        return self.m2 / (self.count - ddof)
+
+
+# 用选择算法计算截尾均值（两侧各去掉trim比例的样本），不需要完整排序
+def trimmed_mean(values, trim=0.1):
+    values = np.asarray(values, dtype=float)
+    n = len(values)
+    if n == 0:
+        return np.nan
+    k = int(n * trim)
+    if k == 0 or 2 * k >= n:
+        return values.mean()
+    partitioned = np.partition(values, (k, n - k - 1))
+    return partitioned[k:n - k].mean()
+
+
+# 计算稳健的中心点与离散度统计：中位数、MAD（换算为标准差估计）、截尾均值，以及基于中位数中心点的颜色一致性
+def calculate_robust_center_stats(ciex, ciey, trim=0.1):
+    ciex = np.asarray(ciex, dtype=float)
+    ciey = np.asarray(ciey, dtype=float)
+    if len(ciex) == 0:
+        return None
+
+    median_x = np.median(ciex)
+    median_y = np.median(ciey)
+    distances = np.sqrt((ciex - median_x) ** 2 + (ciey - median_y) ** 2)
+    mad_scale = 1.4826  # 正态分布下MAD换算为标准差的系数
+    return {
+        'median_x': median_x,
+        'median_y': median_y,
+        'mad_x': mad_scale * np.median(np.abs(ciex - median_x)),
+        'mad_y': mad_scale * np.median(np.abs(ciey - median_y)),
+        'trimmed_mean_x': trimmed_mean(ciex, trim),
+        'trimmed_mean_y': trimmed_mean(ciey, trim),
+        'robust_consistency': mad_scale * np.median(np.abs(distances - np.median(distances))),
+        'count': len(ciex)
+    }
+
 
+# 计算每个文件筛选后数据的中心点与离散度统计（与中心点偏移无关，可缓存）
 @st.cache_data(show_spinner=False)
-def generate_interactive_cie_plot_with_zones(df_dict, selected_bin_codes, colors, title, fig_width, fig_height,
-                                             point_size, alpha, x_label, y_label, show_grid, x_range, y_range,
-                                             selected_zones=None, color_zones=None, move_center=False,
-                                             target_center=(0.2771, 0.26),
-                                             # 新增：斜率直线参数
-                                             show_slope_line=False, slope_line_info=None):
+def calculate_file_center_stats(df_dict, selected_bin_codes):
+    """返回 {文件名: 统计信息}，用于中心点标记、统计表和补偿系数计算"""
+    return summarize_center_stats(filter_dataframes(df_dict, selected_bin_codes))
+
+
+def summarize_center_stats(filtered_dict):
+    file_stats = {}
+    for file_name, filtered_df in filtered_dict.items():
+        if filtered_df.empty:
+            continue
+
+        ciex = filtered_df['ciex'].to_numpy(dtype=float)
+        ciey = filtered_df['ciey'].to_numpy(dtype=float)
+        moments = WelfordAccumulator(2).update(np.column_stack([ciex, ciey]))
+        center_x, center_y = moments.mean
+        std_x, std_y = moments.std()
+        distances = np.sqrt((ciex - center_x) ** 2 + (ciey - center_y) ** 2)
+
+        file_stats[file_name] = {
+            'center_x': center_x,
+            'center_y': center_y,
+            'std_x': std_x,
+            'std_y': std_y,
+            'color_consistency': WelfordAccumulator().update(distances).std()[0],
+            'count': len(ciex),
+            'sum_x': ciex.sum(),
+            'sum_y': ciey.sum(),
+            'min_x': ciex.min(),
+            'max_x': ciex.max(),
+            'min_y': ciey.min(),
+            'max_y': ciey.max(),
+            'moments': moments
+        }
+    return file_stats
+
+
+# 合并所有文件的中心点统计：均值与标准差由各文件的累加器合并得到，
+# 颜色一致性需要到合并中心点的距离，按文件逐块累加
+def calculate_pooled_center_stats(filtered_dict, file_stats):
+    if not file_stats:
+        return None
+
+    moments = WelfordAccumulator(2)
+    for file_stat in file_stats.values():
+        moments.merge(file_stat['moments'])
+    center_x, center_y = moments.mean
+    std_x, std_y = moments.std()
+
+    distance_moments = WelfordAccumulator()
+    for file_name in file_stats:
+        filtered_df = filtered_dict[file_name]
+        distance_moments.update(np.sqrt((filtered_df['ciex'].to_numpy(dtype=float) - center_x) ** 2 +
+                                        (filtered_df['ciey'].to_numpy(dtype=float) - center_y) ** 2))
+
+    return {
+        'center_x': center_x,
+        'center_y': center_y,
+        'std_x': std_x,
+        'std_y': std_y,
+        'color_consistency': distance_moments.std()[0],
+        'count': moments.count,
+        'moments': moments
+    }
+
+
+# 计算中心点移动的补偿系数（所有选中数据的平均中心点移动到目标中心点）
+def calculate_center_offsets(file_stats, target_center):
+    total_count = sum(s['count'] for s in file_stats.values())
+    if total_count == 0:
+        return 0, 0
+    actual_center_x = sum(s['sum_x'] for s in file_stats.values()) / total_count
+    actual_center_y = sum(s['sum_y'] for s in file_stats.values()) / total_count
+    return target_center[0] - actual_center_x, target_center[1] - actual_center_y
 
 
+# 生成不含中心点移动信息的基础CIE散点图
+# 数据点使用原始坐标，色区位置固定；中心点移动时只需平移数据点，无需重新构建图表
+def build_base_cie_figure(df_dict, selected_bin_codes, colors, fig_width, fig_height, point_size, alpha,
+                          x_label, y_label, show_grid, selected_zones=None, color_zones=None):
+    """返回的图表会被多次复用，调用方不能直接修改，需先复制"""
+    if color_zones is None:
+        color_zones = COLOR_ZONE_PRESETS["NCSP"]["zones"]  # 默认使用NCSP色区
+
     # 创建基础图形
     fig = go.Figure()
 
-    # 计算补偿系数（仅当需要移动中心点时）
-    offset_x, offset_y = 0, 0
-    if move_center and df_dict and selected_bin_codes:
-        # 计算所有选中数据的平均中心点
-        all_ciex = []
-        all_ciey = []
-        for df in df_dict.values():
-            filtered_df = df[df['bin_code'].isin(selected_bin_codes)]
-            if not filtered_df.empty:
-                all_ciex.extend(filtered_df['ciex'].tolist())
-                all_ciey.extend(filtered_df['ciey'].tolist())
-
-        if all_ciex and all_ciey:
-            actual_center_x = np.mean(all_ciex)
-            actual_center_y = np.mean(all_ciey)
-            # 计算补偿系数
-            offset_x = target_center[0] - actual_center_x
-            offset_y = target_center[1] - actual_center_y
-
-    # 为每个数据源添加散点（应用移动补偿）
+    # 为每个数据源添加散点
     for file_name, df in df_dict.items():
         # 筛选bin_code
         filtered_df = df[df['bin_code'].isin(selected_bin_codes)]
@@ -328,15 +1390,11 @@ def generate_interactive_cie_plot_with_zones(df_dict, selected_bin_codes, colors
         if not filtered_df.empty:
             color = colors.get(file_name, '#1f77b4')
 
-            # 如果需要移动中心点，则应用补偿（只移动数据点，不移动色区）
-            x_values = filtered_df['ciex'] + (offset_x if move_center else 0)
-            y_values = filtered_df['ciey'] + (offset_y if move_center else 0)
-
-            # 添加散点
+            # 添加散点（meta用于在平移时识别数据点轨迹）
             fig.add_trace(
                 go.Scatter(
-                    x=x_values,
-                    y=y_values,
+                    x=filtered_df['ciex'].to_numpy(dtype=float),
+                    y=filtered_df['ciey'].to_numpy(dtype=float),
                     mode='markers',
                     marker=dict(
                         size=point_size,
@@ -345,13 +1403,14 @@ def generate_interactive_cie_plot_with_zones(df_dict, selected_bin_codes, colors
                         line=dict(width=1, color='black')
                     ),
                     name=file_name,
-                    customdata=list(zip(
-                        filtered_df.get('PosX_Map', filtered_df.get('pos_x')),
-                        filtered_df.get('PosY_Map', filtered_df.get('pos_y')),
-                        filtered_df['ciex'],
-                        filtered_df['ciey'],
-                        filtered_df['bin_code']
-                    )),
+                    meta='cie_points',
+                    customdata=np.column_stack([
+                        filtered_df.get('PosX_Map', filtered_df.get('pos_x')).to_numpy(dtype=object),
+                        filtered_df.get('PosY_Map', filtered_df.get('pos_y')).to_numpy(dtype=object),
+                        filtered_df['ciex'].to_numpy(dtype=object),
+                        filtered_df['ciey'].to_numpy(dtype=object),
+                        filtered_df['bin_code'].to_numpy(dtype=object)
+                    ]),
                     hovertemplate=(
                         f"PosX: %{{customdata[0]}}<br>"
                         f"PosY: %{{customdata[1]}}<br>"
@@ -369,12 +1428,12 @@ def generate_interactive_cie_plot_with_zones(df_dict, selected_bin_codes, colors
         selected_zones = list(color_zones.keys())
 
     zone_colors = {zone: color_list[i % len(color_list)] for i, zone in enumerate(color_zones.keys())}
+    geometry = get_zone_geometry(color_zones)
 
-    for zone_name, zone_coords in color_zones.items():
+    for zone_name in geometry.names:
         if zone_name in selected_zones:
             # 色区坐标不应用偏移，保持固定
-            x_coords = [p[0] for p in zone_coords] + [zone_coords[0][0]]  # 闭合多边形
-            y_coords = [p[1] for p in zone_coords] + [zone_coords[0][1]]
+            x_coords, y_coords = geometry.closed_outline(zone_name)  # 闭合多边形
 
             # 添加填充区域（半透明）
             rgba_color = hex_to_rgba(zone_colors[zone_name], 0.2)  # 使用0.2的透明度
@@ -395,62 +1454,77 @@ def generate_interactive_cie_plot_with_zones(df_dict, selected_bin_codes, colors
                 )
             )
 
-    # 添加中心点标记和统计信息
-    stats_data = []
-    for file_name, df in df_dict.items():
-        filtered_df = df[df['bin_code'].isin(selected_bin_codes)]
-        if not filtered_df.empty:
-            # 计算原始中心点
-            original_center_x = filtered_df['ciex'].mean()
-            original_center_y = filtered_df['ciey'].mean()
+    # 设置图表布局
+    fig.update_layout(
+        xaxis_title=x_label,
+        yaxis_title=y_label,
+        width=fig_width,
+        height=fig_height,
+        hovermode='closest',
+        dragmode='zoom',
+        showlegend=True,
+        legend=dict(
+            orientation="h",
+            yanchor="bottom",
+            y=1.02,
+            xanchor="right",
+            x=1
+        ),
+        transition_duration=200,
+        hoverlabel=dict(
+            bgcolor="white",
+            font_size=14,
+            font_family="SimHei"
+        )
+    )
 
-            # 计算移动后的中心点
-            center_x = original_center_x + (offset_x if move_center else 0)
-            center_y = original_center_y + (offset_y if move_center else 0)
+    # 添加网格线
+    if show_grid:
+        fig.update_xaxes(showgrid=True, gridwidth=1, gridcolor='lightgray')
+        fig.update_yaxes(showgrid=True, gridwidth=1, gridcolor='lightgray')
 
-            # 计算标准差
-            std_x = filtered_df['ciex'].std()
-            std_y = filtered_df['ciey'].std()
+    return fig
 
-            # 计算颜色一致性指标
-            distances = np.sqrt(
-                (filtered_df['ciex'] - original_center_x) ** 2 + (filtered_df['ciey'] - original_center_y) ** 2)
-            color_consistency = distances.std()
 
-            # 添加中心点标记
-            fig.add_trace(
-                go.Scatter(
-                    x=[center_x],
-                    y=[center_y],
-                    mode='markers+text',
-                    marker=dict(
-                        size=15,
-                        color=colors.get(file_name, '#1f77b4'),
-                        symbol='x',
-                        line=dict(width=2, color='black')
-                    ),
-                    text=[file_name],
-                    textposition='top center',
-                    showlegend=False,
-                    hovertemplate=(
-                        f"原始中心点: ({original_center_x:.4f}, {original_center_y:.4f})<br>"
-                        f"移动后中心点: ({center_x:.4f}, {center_y:.4f})<extra></extra>"
-                    )
+# 在基础图表上应用中心点偏移：平移数据点轨迹，添加中心点/目标中心点/斜率线标记
+def apply_center_offset_to_figure(base_fig, file_stats, colors, title, x_range, y_range, move_center=False,
+                                  target_center=(0.2771, 0.26), offsets=(0, 0),
+                                  show_slope_line=False, slope_line_info=None):
+    fig = go.Figure(base_fig)
+    offset_x, offset_y = offsets if move_center else (0, 0)
+
+    # 偏移是纯平移，直接在已有的坐标数组上加补偿系数
+    if offset_x or offset_y:
+        for trace in fig.select_traces(selector=dict(meta='cie_points')):
+            trace.x = np.asarray(trace.x, dtype=float) + offset_x
+            trace.y = np.asarray(trace.y, dtype=float) + offset_y
+
+    # 添加中心点标记
+    for file_name, file_stat in file_stats.items():
+        original_center_x = file_stat['center_x']
+        original_center_y = file_stat['center_y']
+        center_x = original_center_x + offset_x
+        center_y = original_center_y + offset_y
+        fig.add_trace(
+            go.Scatter(
+                x=[center_x],
+                y=[center_y],
+                mode='markers+text',
+                marker=dict(
+                    size=15,
+                    color=colors.get(file_name, '#1f77b4'),
+                    symbol='x',
+                    line=dict(width=2, color='black')
+                ),
+                text=[file_name],
+                textposition='top center',
+                showlegend=False,
+                hovertemplate=(
+                    f"原始中心点: ({original_center_x:.4f}, {original_center_y:.4f})<br>"
+                    f"移动后中心点: ({center_x:.4f}, {center_y:.4f})<extra></extra>"
                 )
             )
-
-            # 保存统计数据
-            stats_data.append({
-                '材料': file_name,
-                '原始中心点 x': original_center_x,
-                '原始中心点 y': original_center_y,
-                '移动后中心点 x': center_x if move_center else None,
-                '移动后中心点 y': center_y if move_center else None,
-                'x 标准差': std_x,
-                'y 标准差': std_y,
-                '颜色一致性': color_consistency,
-                '样本数': len(filtered_df)
-            })
+        )
 
     # 如果启用了中心点移动，添加目标中心点标记
     if move_center:
@@ -497,34 +1571,7 @@ def generate_interactive_cie_plot_with_zones(df_dict, selected_bin_codes, colors
             borderwidth=1
         )
 
-    """生成带色区显示的交互式CIE散点图，支持中心点移动功能，色区位置保持固定"""
-    if color_zones is None:
-        color_zones = COLOR_ZONE_PRESETS["NCSP"]["zones"]  # 默认使用NCSP色区
-
-    # 设置图表布局
-    fig.update_layout(
-        title=title + (" (已应用中心点移动)" if move_center else ""),
-        xaxis_title=x_label,
-        yaxis_title=y_label,
-        width=fig_width,
-        height=fig_height,
-        hovermode='closest',
-        dragmode='zoom',
-        showlegend=True,
-        legend=dict(
-            orientation="h",
-            yanchor="bottom",
-            y=1.02,
-            xanchor="right",
-            x=1
-        ),
-        transition_duration=200,
-        hoverlabel=dict(
-            bgcolor="white",
-            font_size=14,
-            font_family="SimHei"
-        )
-    )
+    fig.update_layout(title=title + (" (已应用中心点移动)" if move_center else ""))
 
     # 设置坐标轴范围
     if x_range:
@@ -532,22 +1579,74 @@ def generate_interactive_cie_plot_with_zones(df_dict, selected_bin_codes, colors
     if y_range:
         fig.update_yaxes(range=y_range)
 
-    # 添加网格线
-    if show_grid:
-        fig.update_xaxes(showgrid=True, gridwidth=1, gridcolor='lightgray')
-        fig.update_yaxes(showgrid=True, gridwidth=1, gridcolor='lightgray')
+    return fig
 
-    return fig, pd.DataFrame(stats_data), (offset_x, offset_y)
+
+# 生成各文件中心点统计表（有多个文件时追加所有文件合并后的统计行）
+def build_center_stats_table(file_stats, move_center=False, offsets=(0, 0), pooled_stats=None):
+    offset_x, offset_y = offsets
+    stats_data = []
+    rows = list(file_stats.items())
+    if pooled_stats is not None and len(file_stats) > 1:
+        rows.append(("全部文件（合并）", pooled_stats))
+    for file_name, file_stat in rows:
+        stats_data.append({
+            '材料': file_name,
+            '原始中心点 x': file_stat['center_x'],
+            '原始中心点 y': file_stat['center_y'],
+            '移动后中心点 x': file_stat['center_x'] + offset_x if move_center else None,
+            '移动后中心点 y': file_stat['center_y'] + offset_y if move_center else None,
+            'x 标准差': file_stat['std_x'],
+            'y 标准差': file_stat['std_y'],
+            '颜色一致性': file_stat['color_consistency'],
+            '样本数': file_stat['count']
+        })
+    return pd.DataFrame(stats_data)
+
+
+# 生成稳健统计表（中位数、MAD、截尾均值），有多个文件时追加合并行
+def build_robust_stats_table(filtered_dict, trim=0.1):
+    rows = []
+    pooled_x = []
+    pooled_y = []
+    for file_name, filtered_df in filtered_dict.items():
+        if filtered_df.empty:
+            continue
+        ciex = filtered_df['ciex'].to_numpy(dtype=float)
+        ciey = filtered_df['ciey'].to_numpy(dtype=float)
+        rows.append((file_name, calculate_robust_center_stats(ciex, ciey, trim)))
+        pooled_x.append(ciex)
+        pooled_y.append(ciey)
+    if len(rows) > 1:
+        rows.append(("全部文件（合并）",
+                     calculate_robust_center_stats(np.concatenate(pooled_x), np.concatenate(pooled_y), trim)))
+
+    return pd.DataFrame([{
+        '材料': file_name,
+        '中位数 x': robust['median_x'],
+        '中位数 y': robust['median_y'],
+        'x MAD标准差': robust['mad_x'],
+        'y MAD标准差': robust['mad_y'],
+        f'截尾均值 x ({trim:.0%})': robust['trimmed_mean_x'],
+        f'截尾均值 y ({trim:.0%})': robust['trimmed_mean_y'],
+        '稳健颜色一致性': robust['robust_consistency'],
+        '样本数': robust['count']
+    } for file_name, robust in rows])
 
 
 # 计算色区统计（支持选择使用原始坐标或移动后坐标）
 def calculate_zone_statistics(df_dict, selected_bin_codes, selected_zones, color_zones=None,
-                              move_center=False, offsets=(0, 0), use_original_coords=True):
-    """计算每个色区的点数和占比，支持选择使用原始坐标或移动后坐标判断点是否在色区内"""
+                              move_center=False, offsets=(0, 0), use_original_coords=True,
+                              membership_cache=None):
+    """
+    计算每个色区的点数和占比，支持选择使用原始坐标或移动后坐标判断点是否在色区内
+    membership_cache: 可选的色区归属缓存，传入后移动后坐标的判断只对靠近色区边界的点增量重算
+    """
     if color_zones is None:
         color_zones = COLOR_ZONE_PRESETS["NCSP"]["zones"]  # 默认使用NCSP色区
 
     offset_x, offset_y = offsets
+    zone_names = [zone_name for zone_name in color_zones if zone_name in selected_zones]
     stats = {}
     all_points_with_zones = []
 
@@ -562,31 +1661,28 @@ def calculate_zone_statistics(df_dict, selected_bin_codes, selected_zones, color
             'zones': {}
         }
 
-        # 为每个点添加所属色区信息
-        zone_membership = []
-        for _, row in filtered_df.iterrows():
-            # 根据选择使用原始坐标或移动后的坐标判断点是否在色区内
-            if use_original_coords:
-                point = (row['ciex'], row['ciey'])  # 使用原始坐标
-            else:
-                point = (row['ciex'] + offset_x, row['ciey'] + offset_y)  # 使用移动后坐标
-
-            in_zones = []
-            for zone_name, zone_coords in color_zones.items():
-                if zone_name in selected_zones and point_in_polygon(point, zone_coords):
-                    in_zones.append(zone_name)
-            zone_membership.append(", ".join(in_zones) if in_zones else "未命中")
+        # 根据选择使用原始坐标或移动后的坐标判断点是否在色区内
+        ciex = filtered_df['ciex'].to_numpy(dtype=float)
+        ciey = filtered_df['ciey'].to_numpy(dtype=float)
+        if use_original_coords:
+            membership = calculate_zone_membership(ciex, ciey, color_zones, zone_names)
+        elif membership_cache is not None:
+            membership = get_cached_zone_membership(membership_cache, file_name, ciex, ciey, color_zones,
+                                                    zone_names, (offset_x, offset_y))
+        else:
+            membership = calculate_zone_membership(ciex + offset_x, ciey + offset_y, color_zones, zone_names)
 
         # 创建带色区信息的临时DataFrame
         temp_df = filtered_df.copy()
-        temp_df['所属色区'] = zone_membership
+        temp_df['所属色区'] = membership_to_labels(membership, zone_names)
         temp_df['数据类型'] = '原始数据' if use_original_coords else '移动后数据'
         temp_df['文件名'] = file_name
         all_points_with_zones.append(temp_df)
 
         # 统计每个色区的点数
+        zone_counts = membership.sum(axis=0)
         for zone_name in selected_zones:
-            count = sum(1 for zones in zone_membership if zone_name in zones)
+            count = int(zone_counts[zone_names.index(zone_name)]) if zone_name in zone_names else 0
             percentage = (count / total_points) * 100 if total_points > 0 else 0
             file_stats['zones'][zone_name] = {
                 'count': count,
@@ -594,7 +1690,7 @@ def calculate_zone_statistics(df_dict, selected_bin_codes, selected_zones, color
             }
 
         # 统计未命中的点数
-        count = sum(1 for zones in zone_membership if zones == "未命中")
+        count = int((~membership.any(axis=1)).sum()) if zone_names else total_points
         percentage = (count / total_points) * 100 if total_points > 0 else 0
         file_stats['zones']['未命中'] = {
             'count': count,
@@ -611,41 +1707,136 @@ def calculate_zone_statistics(df_dict, selected_bin_codes, selected_zones, color
         return stats, pd.DataFrame()
 
 
-# 计算产出分布统计
-def calculate_production_statistics(df_dict, selected_bin_codes, color_zones, move_center=False,
-                                    offsets=(0, 0), use_original_coords=True):
-    """计算峰值波长、亮度、电压等参数的产出分布统计"""
-    offset_x, offset_y = offsets
-    all_data = []
+# 基于直方图的色区统计（适用于数百万点的大批量数据）
+def calculate_zone_statistics_histogram(df_dict, selected_bin_codes, selected_zones, color_zones=None,
+                                        offsets=(0, 0), use_original_coords=True, resolution=0.0001,
+                                        exact_boundary=True, chunk_size=1_000_000):
+    """
+    按仪器分辨率将点分箱为二维直方图，色区在同一网格上预先栅格化为掩膜，
+    各色区点数由直方图与掩膜矩阵相乘得到；网格只覆盖色区外接矩形，
+    数据分块累加，内存占用与数据行数无关。
+    exact_boundary: 对色区边界穿过的单元格中的点逐点精确判断
+    返回与calculate_zone_statistics相同结构的统计结果（不生成逐点色区数据）
+    """
+    if color_zones is None:
+        color_zones = COLOR_ZONE_PRESETS["NCSP"]["zones"]  # 默认使用NCSP色区
+
+    offset = (0, 0) if use_original_coords else offsets
+    zone_names = [zone_name for zone_name in color_zones if zone_name in selected_zones]
+    stats = {}
+    if zone_names:
+        grid = build_zone_grid(color_zones, zone_names, offset, resolution)
+        cell_masks = rasterize_zones(grid, color_zones, zone_names, offset)
+        if exact_boundary:
+            boundary_cells = find_boundary_cells(grid, color_zones, zone_names, offset, cell_masks)
+        else:
+            boundary_cells = np.zeros(len(cell_masks), dtype=bool)
+        # 多个色区重叠时一个点可能同时计入多个色区，未命中需按"任一色区"判断
+        zone_matrix = np.column_stack([cell_masks, cell_masks.any(axis=1)]).astype(np.int64)
 
     for file_name, df in df_dict.items():
-        filtered_df = df[df['bin_code'].isin(selected_bin_codes)].copy()
-        if filtered_df.empty:
+        selected = df['bin_code'].isin(selected_bin_codes).to_numpy()
+        total_points = int(selected.sum())
+        if total_points == 0:
             continue
 
-        # 为每个点添加色区信息
-        zone_membership = []
-        for _, row in filtered_df.iterrows():
-            if use_original_coords:
-                point = (row['ciex'], row['ciey'])
-            else:
-                point = (row['ciex'] + offset_x, row['ciey'] + offset_y)
-
-            in_zones = []
-            for zone_name, zone_coords in color_zones.items():
-                if point_in_polygon(point, zone_coords):
-                    in_zones.append(zone_name)
-            zone_membership.append(", ".join(in_zones) if in_zones else "未命中")
-
-        filtered_df['所属色区'] = zone_membership
-        filtered_df['文件名'] = file_name
-
-        # 将参数值映射到对应的Bin区
-        for param, config in PRODUCTION_BINS.items():
-            bin_column = f"{param}_Bin"
-            filtered_df[bin_column] = filtered_df[config['column']].apply(
-                lambda x: value_to_bin(x, config['bins'])
-            )
+        counts = np.zeros(len(zone_names) + 1, dtype=np.int64)
+        if zone_names:
+            ciex = df['ciex'].to_numpy(dtype=float)
+            ciey = df['ciey'].to_numpy(dtype=float)
+            histogram = np.zeros(len(cell_masks), dtype=np.int64)
+            for start in range(0, len(df), chunk_size):
+                chunk_selected = selected[start:start + chunk_size]
+                x = ciex[start:start + chunk_size][chunk_selected]
+                y = ciey[start:start + chunk_size][chunk_selected]
+                cell = grid_cell_index(grid, x, y)
+                in_grid = cell >= 0
+                exact = np.zeros(len(cell), dtype=bool)
+                exact[in_grid] = boundary_cells[cell[in_grid]]
+                if exact.any():
+                    membership = calculate_zone_membership(x[exact] + offset[0], y[exact] + offset[1],
+                                                           color_zones, zone_names)
+                    counts[:-1] += membership.sum(axis=0)
+                    counts[-1] += membership.any(axis=1).sum()
+                histogram += np.bincount(cell[in_grid & ~exact], minlength=len(histogram))
+            counts += histogram @ zone_matrix
+
+        file_stats = {
+            'total_points': total_points,
+            'zones': {}
+        }
+        for zone_name in selected_zones:
+            count = int(counts[zone_names.index(zone_name)]) if zone_name in zone_names else 0
+            file_stats['zones'][zone_name] = {
+                'count': count,
+                'percentage': count / total_points * 100
+            }
+        count = total_points - int(counts[-1])
+        file_stats['zones']['未命中'] = {
+            'count': count,
+            'percentage': count / total_points * 100
+        }
+        stats[file_name] = file_stats
+
+    return stats
+
+
+# 将各文件的色区统计整理为一张长表（文件名, 色区, 点数, 占比(%)），表格和图表都由它生成
+def build_zone_summary_table(zone_stats):
+    rows = [
+        {'文件名': file_name, '色区': zone_name, '点数': zone_stats['count'],
+         '占比(%)': round(zone_stats['percentage'], 2)}
+        for file_name, stats in zone_stats.items()
+        for zone_name, zone_stats in stats['zones'].items()
+    ]
+    return pd.DataFrame(rows, columns=['文件名', '色区', '点数', '占比(%)'])
+
+
+# 计算各文件所选色区组合的总点数与总占比
+def build_zone_total_table(zone_stats, selected_total_zones):
+    rows = []
+    for file_name, file_stats in zone_stats.items():
+        total_count = sum(file_stats['zones'][zone]['count'] for zone in selected_total_zones
+                          if zone in file_stats['zones'])
+        total_percentage = (round(total_count / file_stats['total_points'] * 100, 2)
+                            if file_stats['total_points'] > 0 else 0.0)
+        rows.append({'文件名': file_name, '所选色区': ', '.join(selected_total_zones), '总点数': total_count,
+                     '总占比(%)': total_percentage})
+    return pd.DataFrame(rows, columns=['文件名', '所选色区', '总点数', '总占比(%)'])
+
+
+# 计算产出分布统计
+def calculate_production_statistics(df_dict, selected_bin_codes, color_zones, move_center=False,
+                                    offsets=(0, 0), use_original_coords=True, membership_cache=None,
+                                    production_bins=None):
+    """计算峰值波长、亮度、电压等参数的产出分布统计（production_bins为参数Bin表，默认使用PRODUCTION_BINS）"""
+    offset_x, offset_y = offsets
+    zone_names = list(color_zones.keys())
+    compiled_bins = compile_production_bins(production_bins or PRODUCTION_BINS)
+    all_data = []
+
+    for file_name, df in df_dict.items():
+        filtered_df = df[df['bin_code'].isin(selected_bin_codes)].copy()
+        if filtered_df.empty:
+            continue
+
+        # 为每个点添加色区信息
+        ciex = filtered_df['ciex'].to_numpy(dtype=float)
+        ciey = filtered_df['ciey'].to_numpy(dtype=float)
+        if use_original_coords:
+            membership = calculate_zone_membership(ciex, ciey, color_zones, zone_names)
+        elif membership_cache is not None:
+            membership = get_cached_zone_membership(membership_cache, file_name, ciex, ciey, color_zones,
+                                                    zone_names, (offset_x, offset_y))
+        else:
+            membership = calculate_zone_membership(ciex + offset_x, ciey + offset_y, color_zones, zone_names)
+
+        filtered_df['所属色区'] = membership_to_labels(membership, zone_names)
+        filtered_df['文件名'] = file_name
+
+        # 将参数值映射到对应的Bin区（所有参数一次向量化计算）
+        for bin_column, bin_values in assign_production_bins(filtered_df, compiled_bins).items():
+            filtered_df[bin_column] = bin_values
 
         all_data.append(filtered_df)
 
@@ -656,42 +1847,616 @@ def calculate_production_statistics(df_dict, selected_bin_codes, color_zones, mo
         return pd.DataFrame()
 
 
+# 产出分布联合计数立方体（色区 × 各参数Bin区）
+class ProductionCube:
+    """
+    counts[i, j, k, ...]：色区i、第一个参数Bin区j、第二个参数Bin区k……的样本数。
+    axes为 [(维度名称, 该维度的取值列表), ...]，第0维为"所属色区"，其余维度为参数名，
+    参数维度的取值为order中的Bin区再加上 "Out of Range" 和 "NaN"。
+    单参数分布、色区交叉表、主要Bin区等都由立方体切片/求和得到，不再重新扫描数据行。
+    """
+
+    def __init__(self, axes, counts):
+        self.axes = axes
+        self.counts = counts
+        self.axis_index = {name: i for i, (name, _) in enumerate(axes)}
+        self.total = int(counts.sum())
+
+    def labels(self, name):
+        return self.axes[self.axis_index[name]][1]
+
+    def marginal(self, name):
+        """某一维度的边缘分布（其余维度求和）"""
+        axis = self.axis_index[name]
+        other_axes = tuple(i for i in range(self.counts.ndim) if i != axis)
+        return pd.Series(self.counts.sum(axis=other_axes), index=self.labels(name))
+
+    def crosstab(self, row_name, column_name):
+        """两个维度的交叉表（其余维度求和），行列顺序与立方体维度一致"""
+        row_axis = self.axis_index[row_name]
+        column_axis = self.axis_index[column_name]
+        other_axes = tuple(i for i in range(self.counts.ndim) if i not in (row_axis, column_axis))
+        table = self.counts.sum(axis=other_axes)
+        if row_axis > column_axis:
+            table = table.T
+        return pd.DataFrame(table, index=self.labels(row_name), columns=self.labels(column_name))
+
+
+# 由产出分布数据构建各文件的联合计数立方体：各维度整数编码后组合为一个平铺索引，一次bincount完成计数
+def calculate_production_cubes(production_data, production_bins=None):
+    production_bins = production_bins or PRODUCTION_BINS
+    cubes = {}
+    if production_data.empty:
+        return cubes
+    params = [param for param in production_bins if f"{param}_Bin" in production_data.columns]
+
+    for file_name, file_data in production_data.groupby('文件名', sort=False):
+        zone_codes, zone_labels = pd.factorize(file_data['所属色区'], sort=True)
+        axes = [('所属色区', list(zone_labels))]
+        flat_index = zone_codes.astype(np.int64)
+        for param in params:
+            codes = list(dict.fromkeys(list(production_bins[param]['order']) + ["Out of Range", "NaN"]))
+            param_codes = pd.Categorical(file_data[f"{param}_Bin"], categories=codes).codes
+            # order之外的Bin区（如配置变更前的旧结果）计入Out of Range
+            param_codes = np.where(param_codes < 0, codes.index("Out of Range"), param_codes)
+            flat_index = flat_index * len(codes) + param_codes
+            axes.append((param, codes))
+
+        shape = tuple(len(labels) for _, labels in axes)
+        counts = np.bincount(flat_index, minlength=int(np.prod(shape))).reshape(shape)
+        cubes[file_name] = ProductionCube(axes, counts)
+    return cubes
+
+
+# DuckDB查询层：已加载的数据表注册为DuckDB表/视图，SQL结果按 (查询文本, 数据集指纹) 缓存
+class DuckDBQueryLayer:
+    """
+    tables: {表名: 数据指纹}；同名表指纹不变时不重新注册。
+    注册的DataFrame不复制（DuckDB直接扫描pandas内存）。
+    查询使用DuckDB多线程执行，结果缓存最多max_cached条，任一注册表变化后相关缓存自然失效。
+    """
+
+    def __init__(self, threads=None, max_cached=64):
+        self.connection = duckdb.connect(database=':memory:')
+        self.connection.execute(f"SET threads TO {int(threads or os.cpu_count() or 1)}")
+        self.tables = {}
+        self.cache = OrderedDict()
+        self.max_cached = max_cached
+
+    def register(self, name, df, fingerprint):
+        """注册DataFrame为表，fingerprint为数据指纹"""
+        if self.tables.get(name) == fingerprint:
+            return
+        self._drop(name)
+        self.connection.register(name, df)
+        self.tables[name] = fingerprint
+
+    def register_union(self, name, table_names, label_column='文件名', labels=None):
+        """将多张已注册的表合并为一个视图（按列名对齐），并添加来源标签列"""
+        labels = labels or table_names
+        fingerprint = repr([(table, self.tables.get(table), label) for table, label in zip(table_names, labels)])
+        if self.tables.get(name) == fingerprint:
+            return
+        self._drop(name)
+        selects = [f"SELECT {quote_sql_literal(label)} AS {quote_sql_identifier(label_column)}, * "
+                   f"FROM {quote_sql_identifier(table)}" for table, label in zip(table_names, labels)]
+        self.connection.execute(f"CREATE VIEW {quote_sql_identifier(name)} AS " + " UNION ALL BY NAME ".join(selects))
+        self.tables[name] = fingerprint
+
+    def _drop(self, name):
+        if name not in self.tables:
+            return
+        try:
+            self.connection.unregister(name)
+        except duckdb.Error:
+            pass
+        self.connection.execute(f"DROP VIEW IF EXISTS {quote_sql_identifier(name)}")
+        del self.tables[name]
+
+    def query(self, sql):
+        """执行SQL并返回DataFrame；查询文本与所有注册表的指纹都不变时直接返回缓存结果"""
+        key = (" ".join(sql.split()), tuple(sorted(self.tables.items())))
+        if key in self.cache:
+            self.cache.move_to_end(key)
+            return self.cache[key]
+        result = self.connection.execute(sql).df()
+        self.cache[key] = result
+        if len(self.cache) > self.max_cached:
+            self.cache.popitem(last=False)
+        return result
+
+
+def quote_sql_identifier(name):
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+def quote_sql_literal(value):
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+# 预定义的产出分布SQL聚合（表 production 为带色区与参数Bin区的产出分布数据，raw_data 为全部原始数据）
+def build_production_sql_queries(production_bins=None):
+    production_bins = production_bins or PRODUCTION_BINS
+    queries = {
+        "各文件色区落入率": """
+            SELECT 文件名, 所属色区, COUNT(*) AS 点数,
+                   ROUND(100.0 * COUNT(*) / SUM(COUNT(*)) OVER (PARTITION BY 文件名), 2) AS "占比(%)"
+            FROM production
+            GROUP BY 文件名, 所属色区
+            ORDER BY 文件名, 点数 DESC""",
+        "各文件bin号分布(1-80)": """
+            SELECT 文件名, CAST(bin AS INTEGER) AS bin号, COUNT(*) AS 计数,
+                   ROUND(100.0 * COUNT(*) / SUM(COUNT(*)) OVER (PARTITION BY 文件名), 2) AS "占比(%)"
+            FROM production
+            WHERE bin BETWEEN 1 AND 80
+            GROUP BY 文件名, bin号
+            ORDER BY 文件名, bin号""",
+        "各文件bin_code中心点": """
+            SELECT 文件名, bin_code, COUNT(*) AS 点数,
+                   ROUND(AVG(ciex), 4) AS "ciex均值", ROUND(AVG(ciey), 4) AS "ciey均值",
+                   ROUND(STDDEV_SAMP(ciex), 5) AS "ciex标准差", ROUND(STDDEV_SAMP(ciey), 5) AS "ciey标准差"
+            FROM production
+            GROUP BY 文件名, bin_code
+            ORDER BY 文件名, bin_code""",
+    }
+    for param, config in production_bins.items():
+        bin_column = quote_sql_identifier(f"{param}_Bin")
+        queries[f"各文件{config['name']}Bin区分布"] = f"""
+            SELECT 文件名, {bin_column} AS Bin区, COUNT(*) AS 数量,
+                   ROUND(100.0 * COUNT(*) / SUM(COUNT(*)) OVER (PARTITION BY 文件名), 2) AS "占比(%)"
+            FROM production
+            GROUP BY 文件名, Bin区
+            ORDER BY 文件名, Bin区"""
+        queries[f"色区×{config['name']}交叉表"] = f"""
+            PIVOT (SELECT 所属色区, {bin_column} AS Bin区 FROM production)
+            ON Bin区 USING COUNT(*) GROUP BY 所属色区 ORDER BY 所属色区"""
+    return queries
+
+
+# 历史批次库位置：默认放在用户数据目录（Windows为%LOCALAPPDATA%，其它系统为$XDG_DATA_HOME或~/.local/share），
+# 不写入程序目录；可用环境变量CIE_HISTORY_DB指定
+HISTORY_DB_PATH = os.environ.get('CIE_HISTORY_DB') or os.path.join(
+    os.environ.get('LOCALAPPDATA') or os.environ.get('XDG_DATA_HOME') or os.path.expanduser(
+        os.path.join('~', '.local', 'share')),
+    'cie-analysis', 'cie_lot_history.db'
+)
+
+
+# 本地持久化的历史批次库（SQLite）：每个批次按文件内容哈希只写入一次，保存逐点的色区与参数Bin区结果
+class LotHistoryStore:
+    """
+    表 lots：每个批次一行（lot_id为文件内容的sha1，材料、产品类型、色区预设、批次日期、写入时间、点数）
+    表 lot_points：逐点数据（lot_id、bin_code、色坐标、参数值、所属色区、各参数Bin区），
+    参数Bin表新增参数时自动增加对应列。
+    表 lot_rollups：写入时计算的批次汇总（有效点数、中心点、方差/协方差、色区计数、参数Bin计数、bin号直方图），
+    趋势分析只读取汇总表，不重新扫描逐点数据，也无需重新解析原始Excel文件。
+    """
+
+    POINT_COLUMNS = ['bin_code', 'bin', 'ciex', 'ciey', 'peak_wavelength1_nm', 'LuminousFlux_lm',
+                     'forward_voltage1_V', '所属色区']
+
+    # 单条INSERT语句的参数个数上限（兼容旧版SQLite的默认限制）与每次转换的行数
+    MAX_VARIABLES = 999
+    INSERT_CHUNK_ROWS = 100_000
+
+    def __init__(self, path=HISTORY_DB_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self.connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS lots (
+                    lot_id TEXT PRIMARY KEY, 材料 TEXT, 产品类型 TEXT, 色区预设 TEXT,
+                    批次日期 TEXT, 写入时间 TEXT, 点数 INTEGER
+                )""")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS lot_points (
+                    lot_id TEXT, bin_code TEXT, bin REAL, ciex REAL, ciey REAL, peak_wavelength1_nm REAL,
+                    LuminousFlux_lm REAL, forward_voltage1_V REAL, 所属色区 TEXT
+                )""")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS lot_rollups (
+                    lot_id TEXT PRIMARY KEY, 点数 INTEGER, 有效点数 INTEGER, ciex均值 REAL, ciey均值 REAL,
+                    ciex方差 REAL, ciey方差 REAL, 协方差 REAL, 色区计数 TEXT, 参数Bin计数 TEXT, bin直方图 TEXT
+                )""")
+            # 早期的汇总表没有有效点数列：补充该列，相应批次的汇总由rebuild_missing_rollups重新计算
+            if '有效点数' not in {row[1] for row in conn.execute("PRAGMA table_info(lot_rollups)")}:
+                conn.execute("ALTER TABLE lot_rollups ADD COLUMN 有效点数 INTEGER")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_lot_points_lot ON lot_points (lot_id)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_lots_date ON lots (批次日期)")
+
+    def connect(self):
+        return sqlite3.connect(self.path)
+
+    def has_lot(self, lot_id):
+        with self.connect() as conn:
+            return conn.execute("SELECT 1 FROM lots WHERE lot_id = ?", (lot_id,)).fetchone() is not None
+
+    def append_lot(self, lot_id, lot_info, points):
+        """
+        写入一个批次（同一事务内写入lots与lot_points）；lot_id已存在时不重复写入，返回False
+        lot_info: {'材料', '产品类型', '色区预设', '批次日期'}；points: 含所属色区与 *_Bin 列的逐点数据
+        同时写入该批次的汇总（lot_rollups）
+        """
+        bin_columns = [column for column in points.columns if column.endswith('_Bin')]
+        columns = [column for column in self.POINT_COLUMNS if column in points.columns] + bin_columns
+        rows = points[columns].copy()
+        rows.insert(0, 'lot_id', lot_id)
+        rollup = calculate_lot_rollup(points)
+
+        conn = self.connect()
+        try:
+            with conn:
+                if conn.execute("SELECT 1 FROM lots WHERE lot_id = ?", (lot_id,)).fetchone() is not None:
+                    return False
+                existing = {row[1] for row in conn.execute("PRAGMA table_info(lot_points)")}
+                for column in bin_columns:
+                    if column not in existing:
+                        conn.execute(f"ALTER TABLE lot_points ADD COLUMN {quote_sql_identifier(column)} TEXT")
+                conn.execute(
+                    "INSERT INTO lots (lot_id, 材料, 产品类型, 色区预设, 批次日期, 写入时间, 点数) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (lot_id, lot_info.get('材料'), lot_info.get('产品类型'), lot_info.get('色区预设'),
+                     str(lot_info.get('批次日期')), datetime.datetime.now().isoformat(timespec='seconds'), len(rows))
+                )
+                self._insert_rows(conn, 'lot_points', rows)
+                self._insert_rollup(conn, lot_id, rollup)
+            return True
+        finally:
+            conn.close()
+
+    @classmethod
+    def _insert_rows(cls, conn, table, rows):
+        """分块写入逐点数据：按列转换为Python对象（NaN转为NULL），每条INSERT语句写入多行"""
+        n_columns = len(rows.columns)
+        rows_per_statement = max(1, cls.MAX_VARIABLES // n_columns)
+        column_list = ", ".join(quote_sql_identifier(column) for column in rows.columns)
+        row_placeholders = "(" + ", ".join("?" * n_columns) + ")"
+        multi_row_sql = (f"INSERT INTO {quote_sql_identifier(table)} ({column_list}) VALUES "
+                         + ", ".join([row_placeholders] * rows_per_statement))
+        single_row_sql = f"INSERT INTO {quote_sql_identifier(table)} ({column_list}) VALUES {row_placeholders}"
+        for start in range(0, len(rows), cls.INSERT_CHUNK_ROWS):
+            chunk = rows.iloc[start:start + cls.INSERT_CHUNK_ROWS]
+            values = np.empty(chunk.shape, dtype=object)
+            for i, column in enumerate(chunk.columns):
+                values[:, i] = chunk[column].astype(object).where(chunk[column].notna(), None).to_numpy()
+            n_multi = len(values) // rows_per_statement * rows_per_statement
+            if n_multi:
+                conn.executemany(multi_row_sql,
+                                 values[:n_multi].reshape(-1, rows_per_statement * n_columns).tolist())
+            if n_multi < len(values):
+                conn.executemany(single_row_sql, values[n_multi:].tolist())
+
+    @staticmethod
+    def _insert_rollup(conn, lot_id, rollup):
+        conn.execute(
+            "INSERT OR REPLACE INTO lot_rollups (lot_id, 点数, 有效点数, ciex均值, ciey均值, ciex方差, ciey方差, 协方差, "
+            "色区计数, 参数Bin计数, bin直方图) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (lot_id, rollup['点数'], rollup['有效点数'], rollup['ciex均值'], rollup['ciey均值'], rollup['ciex方差'], rollup['ciey方差'],
+             rollup['协方差'], json.dumps(rollup['色区计数'], ensure_ascii=False),
+             json.dumps(rollup['参数Bin计数'], ensure_ascii=False), json.dumps(rollup['bin直方图']))
+        )
+
+    def rebuild_missing_rollups(self):
+        """
+        为缺少汇总或汇总缺少有效点数的批次（如早期写入的批次）从逐点数据补算汇总，
+        每个批次只需补算一次；返回补算的批次数
+        """
+        missing = self.query("SELECT lot_id FROM lots WHERE lot_id NOT IN "
+                             "(SELECT lot_id FROM lot_rollups WHERE 有效点数 IS NOT NULL)")
+        conn = self.connect()
+        try:
+            for lot_id in missing['lot_id']:
+                points = pd.read_sql_query("SELECT * FROM lot_points WHERE lot_id = ?", conn, params=(lot_id,))
+                with conn:
+                    self._insert_rollup(conn, lot_id, calculate_lot_rollup(points))
+        finally:
+            conn.close()
+        return len(missing)
+
+    def rollups(self):
+        """读取所有批次汇总（含批次信息），JSON列解析为dict/数组"""
+        rollups = self.query("""
+            SELECT l.lot_id, l.材料, l.产品类型, l.色区预设, l.批次日期, r.点数, r.有效点数, r.ciex均值, r.ciey均值,
+                   r.ciex方差, r.ciey方差, r.协方差, r.色区计数, r.参数Bin计数, r.bin直方图
+            FROM lot_rollups r JOIN lots l ON r.lot_id = l.lot_id
+            ORDER BY l.批次日期, l.材料""")
+        for column in ('色区计数', '参数Bin计数', 'bin直方图'):
+            rollups[column] = rollups[column].map(json.loads)
+        rollups['批次日期'] = pd.to_datetime(rollups['批次日期'], errors='coerce')
+        return rollups
+
+    def delete_lot(self, lot_id):
+        conn = self.connect()
+        try:
+            with conn:
+                conn.execute("DELETE FROM lot_rollups WHERE lot_id = ?", (lot_id,))
+                conn.execute("DELETE FROM lot_points WHERE lot_id = ?", (lot_id,))
+                conn.execute("DELETE FROM lots WHERE lot_id = ?", (lot_id,))
+        finally:
+            conn.close()
+
+    def lots(self):
+        return self.query("SELECT * FROM lots ORDER BY 批次日期, 材料")
+
+    def query(self, sql, params=()):
+        conn = self.connect()
+        try:
+            return pd.read_sql_query(sql, conn, params=params)
+        finally:
+            conn.close()
+
+
+# 计算一个批次的汇总：点数、中心点、方差/协方差、色区计数、各参数Bin计数、bin号(1-80)直方图
+# 中心点与方差只使用坐标有效的点，其点数记为有效点数（点数仍为全部点数，用作落入率的分母）
+def calculate_lot_rollup(points):
+    coordinates = points[['ciex', 'ciey']].to_numpy(dtype=float)
+    accumulator = WelfordAccumulator(2).update(coordinates[np.isfinite(coordinates).all(axis=1)])
+    covariance = accumulator.covariance()
+    bin_columns = [column for column in points.columns if column.endswith('_Bin')]
+    bin_histogram = build_bin_histogram(points) if 'bin' in points.columns else None
+    return {
+        '点数': int(len(points)),
+        '有效点数': int(accumulator.count),
+        'ciex均值': float(accumulator.mean[0]) if accumulator.count else None,
+        'ciey均值': float(accumulator.mean[1]) if accumulator.count else None,
+        'ciex方差': None if np.isnan(covariance[0, 0]) else float(covariance[0, 0]),
+        'ciey方差': None if np.isnan(covariance[1, 1]) else float(covariance[1, 1]),
+        '协方差': None if np.isnan(covariance[0, 1]) else float(covariance[0, 1]),
+        '色区计数': {str(zone): int(count) for zone, count in points['所属色区'].value_counts().items()},
+        '参数Bin计数': {
+            column[:-len('_Bin')]: {str(code): int(count) for code, count in points[column].value_counts().items()}
+            for column in bin_columns
+        },
+        'bin直方图': (bin_histogram['counts'].sum(axis=0)[1:].tolist() if bin_histogram is not None
+                   else [0] * 80)
+    }
+
+
+# 汇总行还原为累加器（用于按周/月等周期合并中心点与标准差）
+def rollup_accumulator(rollup):
+    accumulator = WelfordAccumulator(2)
+    if not rollup['有效点数'] or pd.isna(rollup['ciex均值']):
+        return accumulator
+    accumulator.count = int(rollup['有效点数'])
+    accumulator.mean = np.array([rollup['ciex均值'], rollup['ciey均值']], dtype=float)
+    covariance = np.array([[rollup['ciex方差'], rollup['协方差']], [rollup['协方差'], rollup['ciey方差']]], dtype=float)
+    accumulator.m2 = np.nan_to_num(covariance) * (accumulator.count - 1)
+    return accumulator
+
+
+# 所选色区组合的落入点数：色区标签可能为多个色区（点位于重叠区域），任一色区被选中即计入
+def rollup_zone_count(zone_counts, zones):
+    zones = set(zones)
+    return sum(count for label, count in zone_counts.items() if zones.intersection(label.split(', ')))
+
+
+# 按周期汇总批次趋势：中心点/标准差由各批次累加器精确合并，落入率按点数加权，全部只使用汇总表
+def summarize_lot_trends(rollups, zones, period=None, group_by_material=False):
+    """
+    period: None-按批次，'W'-按周，'M'-按月；group_by_material为True时各材料分别汇总
+    返回列：时间, [材料], 批次数, 点数, ciex均值, ciey均值, ciex标准差, ciey标准差, 落入率(%)
+    """
+    if rollups.empty:
+        return pd.DataFrame()
+    rollups = rollups.copy()
+    rollups['落入点数'] = [rollup_zone_count(zone_counts, zones) for zone_counts in rollups['色区计数']]
+    if period is None:
+        rollups['时间'] = rollups['批次日期']
+        keys = ['时间', 'lot_id']
+    else:
+        rollups['时间'] = rollups['批次日期'].dt.to_period(period).dt.start_time
+        keys = ['时间']
+    if group_by_material:
+        keys = keys + ['材料']
+
+    rows = []
+    for key, group in rollups.groupby(keys, sort=True):
+        accumulator = WelfordAccumulator(2)
+        for _, rollup in group.iterrows():
+            accumulator.merge(rollup_accumulator(rollup))
+        std = accumulator.std()
+        total_points = int(group['点数'].sum())
+        row = dict(zip(keys, key if isinstance(key, tuple) else (key,)))
+        row.update({
+            '批次数': len(group),
+            '点数': total_points,
+            'ciex均值': accumulator.mean[0] if accumulator.count else np.nan,
+            'ciey均值': accumulator.mean[1] if accumulator.count else np.nan,
+            'ciex标准差': std[0],
+            'ciey标准差': std[1],
+            '落入率(%)': round(group['落入点数'].sum() / total_points * 100, 2) if total_points else np.nan
+        })
+        rows.append(row)
+    return pd.DataFrame(rows).drop(columns='lot_id', errors='ignore')
+
+
+# 计算待写入历史批次库的逐点数据：使用原始坐标与全部bin_code，记录所属色区与各参数Bin区
+def prepare_lot_points(df, color_zones, production_bins=None):
+    points = calculate_production_statistics({'lot': df}, df['bin_code'].unique(), color_zones,
+                                             production_bins=production_bins)
+    return points.drop(columns='文件名', errors='ignore')
+
+
 # 计算线性回归分析（基于移动后的坐标）
-def calculate_linear_regression(df_dict, selected_bin_codes, move_center=False, offsets=(0, 0)):
+def calculate_linear_regression(df_dict, selected_bin_codes, move_center=False, offsets=(0, 0), method="ols"):
     """计算CIE色坐标的线性回归分析，基于移动后的坐标"""
-    offset_x, offset_y = offsets
-    regression_results = {}
+    regression_df = calculate_batched_regression(df_dict, selected_bin_codes, move_center, offsets, method=method)
+    return {
+        row['文件名']: row.drop(['文件名', '样本数']).to_dict()
+        for _, row in regression_df.iterrows()
+    }
 
-    for file_name, df in df_dict.items():
-        filtered_df = df[df['bin_code'].isin(selected_bin_codes)]
-        if len(filtered_df) < 2:  # 至少需要两个点进行线性回归
-            continue
 
-        # 如果启用了中心点移动，使用移动后的坐标计算
-        if move_center:
-            x = filtered_df['ciex'] + offset_x
-            y = filtered_df['ciey'] + offset_y
+# 按分组累加回归所需的充分统计量（n, Σx, Σy, Σxy, Σx², Σy²），一次bincount完成所有分组
+def grouped_regression_sums(x, y, group_index, n_groups):
+    """
+    x, y: 坐标数组；group_index: 每个点的分组编号（0..n_groups-1）
+    为减小大数相减的舍入误差，累加前先减去全体均值，返回的sums中记录该平移量
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    shift_x = x.mean() if len(x) else 0.0
+    shift_y = y.mean() if len(y) else 0.0
+    dx = x - shift_x
+    dy = y - shift_y
+    return {
+        'n': np.bincount(group_index, minlength=n_groups).astype(float),
+        'sx': np.bincount(group_index, weights=dx, minlength=n_groups),
+        'sy': np.bincount(group_index, weights=dy, minlength=n_groups),
+        'sxy': np.bincount(group_index, weights=dx * dy, minlength=n_groups),
+        'sxx': np.bincount(group_index, weights=dx * dx, minlength=n_groups),
+        'syy': np.bincount(group_index, weights=dy * dy, minlength=n_groups),
+        'shift': (shift_x, shift_y)
+    }
+
+
+# 由充分统计量计算各分组的回归结果
+def regression_from_sums(sums, method="ols"):
+    """
+    method: "ols" 普通最小二乘（y对x回归，结果与scipy.stats.linregress一致）；
+            "tls" 正交回归（总体最小二乘，使点到直线的垂直距离平方和最小，x、y误差同等看待，适合CIE漂移方向）
+    返回DataFrame，行顺序与分组编号一致；点数不足2的分组结果为NaN
+    """
+    n = sums['n']
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean_x = sums['sx'] / n
+        mean_y = sums['sy'] / n
+        # 离差平方和与离差乘积和
+        ssx = np.maximum(sums['sxx'] - sums['sx'] * mean_x, 0)
+        ssy = np.maximum(sums['syy'] - sums['sy'] * mean_y, 0)
+        sxy = sums['sxy'] - sums['sx'] * mean_y
+        r = np.where((ssx > 0) & (ssy > 0), sxy / np.sqrt(ssx * ssy), 0.0)
+        r = np.clip(r, -1.0, 1.0)
+
+        if method == "tls":
+            # 协方差矩阵主轴方向即为正交回归直线方向
+            theta = 0.5 * np.arctan2(2 * sxy, ssx - ssy)
+            slope = np.tan(theta)
+            orthogonal_rss = np.maximum((ssx + ssy - np.sqrt((ssx - ssy) ** 2 + 4 * sxy ** 2)) / 2, 0)
+            result = {'斜率': slope, '截距': None, 'R² 值': r ** 2, '方向角(°)': np.degrees(theta),
+                      '正交残差平方和': orthogonal_rss}
         else:
-            x = filtered_df['ciex']
-            y = filtered_df['ciey']
-
-        # 执行线性回归
-        slope, intercept, r_value, p_value, std_err = stats.linregress(x, y)
-
-        # 计算残差平方和
-        residuals = y - (slope * x + intercept)
-        rss = np.sum(residuals ** 2)
-
-        regression_results[file_name] = {
-            '斜率': slope,
-            '截距': intercept,
-            'R² 值': r_value ** 2,
-            'p 值': p_value,
-            '标准误差': std_err,
-            '残差平方和': rss
-        }
+            slope = np.where(ssx > 0, sxy / ssx, np.nan)
+            rss = np.maximum(ssy - slope * sxy, 0)
+            df = n - 2
+            std_err = np.where(df > 0, np.sqrt(rss / np.where(df > 0, df, 1) / ssx), 0.0)
+            t_value = r * np.sqrt(df / ((1.0 - r) * (1.0 + r)))
+            p_value = np.where(df > 0, 2 * stats.t.sf(np.abs(t_value), np.where(df > 0, df, 1)),
+                               np.where(ssy > 0, 0.0, 1.0))
+            result = {'斜率': slope, '截距': None, 'R² 值': r ** 2, 'p 值': p_value, '标准误差': std_err,
+                      '残差平方和': rss}
+
+        shift_x, shift_y = sums['shift']
+        result['截距'] = (mean_y + shift_y) - slope * (mean_x + shift_x)
+
+    regression_df = pd.DataFrame(result)
+    regression_df.loc[n < 2, :] = np.nan
+    regression_df.insert(0, '样本数', n.astype(int))
+    return regression_df
+
+
+# 批量回归：所有文件（可按bin_code或色区进一步分组）一次分组累加后计算
+def calculate_batched_regression(df_dict, selected_bin_codes, move_center=False, offsets=(0, 0),
+                                 group_by=None, method="ols", color_zones=None, zone_names=None,
+                                 per_file=True):
+    """
+    group_by: None 仅按文件分组；"bin_code" 按bin_code分组；"zone" 按色区分组（点落在多个重叠色区时计入每个色区）
+    per_file: 为False时所有文件合并，只按group_by分组
+    color_zones/zone_names: 按色区分组时使用；色区判断基于回归所用的坐标
+    返回DataFrame，包含分组列（文件名、bin_code/色区）、样本数及回归结果，点数不足2的分组不输出
+    """
+    offset_x, offset_y = offsets if move_center else (0, 0)
+    frames = {file_name: df[df['bin_code'].isin(selected_bin_codes)] for file_name, df in df_dict.items()}
+    frames = {file_name: df for file_name, df in frames.items() if not df.empty}
+    if not frames:
+        return pd.DataFrame()
+
+    file_names = list(frames.keys())
+    x = np.concatenate([df['ciex'].to_numpy(dtype=float) for df in frames.values()]) + offset_x
+    y = np.concatenate([df['ciey'].to_numpy(dtype=float) for df in frames.values()]) + offset_y
+    file_index = np.repeat(np.arange(len(file_names)), [len(df) for df in frames.values()])
+    if not per_file:
+        file_index = np.zeros(len(x), dtype=int)
+        file_names = ["全部文件（合并）"]
+
+    # 组合分组编号 = 文件编号 * 子分组数 + 子分组编号
+    if group_by == "bin_code":
+        bin_codes = np.concatenate([df['bin_code'].to_numpy() for df in frames.values()])
+        sub_index, sub_labels = pd.factorize(bin_codes, sort=True)
+        sub_column = 'bin_code'
+    elif group_by == "zone":
+        zone_names = list(zone_names if zone_names is not None else color_zones.keys())
+        membership = calculate_zone_membership(x, y, color_zones, zone_names)
+        point_index, sub_index = np.nonzero(membership)
+        x, y, file_index = x[point_index], y[point_index], file_index[point_index]
+        sub_labels = zone_names
+        sub_column = '色区'
+    else:
+        sub_index = np.zeros(len(x), dtype=int)
+        sub_labels = [None]
+        sub_column = None
+
+    n_sub = len(sub_labels)
+    group_index = file_index * n_sub + sub_index
+    sums = grouped_regression_sums(x, y, group_index, len(file_names) * n_sub)
+    regression_df = regression_from_sums(sums, method)
+
+    group_ids = np.arange(len(file_names) * n_sub)
+    regression_df.insert(0, '文件名', [file_names[g // n_sub] for g in group_ids])
+    if sub_column is not None:
+        regression_df.insert(1, sub_column, [sub_labels[g % n_sub] for g in group_ids])
+    return regression_df[regression_df['样本数'] >= 2].reset_index(drop=True)
+
+
+# 按色区和bin_code分组拟合ciex-ciey斜率，并与色区平行四边形的正斜率边比较
+def calculate_grouped_slope_table(df_dict, selected_bin_codes, color_zones, zone_names=None, move_center=False,
+                                  offsets=(0, 0), method="tls", min_points=3, angle_tolerance=5.0):
+    """
+    所有文件合并，一次分组累加同时得到每个色区（全部bin_code）以及每个色区内每个bin_code的拟合斜率。
+    点落在多个重叠色区时计入每个色区。
+    角度偏差 = 拟合直线方向角 - 色区正斜率边方向角（度），绝对值超过angle_tolerance时标记为偏离
+    返回DataFrame，点数不足min_points的分组不输出
+    """
+    zone_names = list(zone_names if zone_names is not None else color_zones.keys())
+    offset_x, offset_y = offsets if move_center else (0, 0)
+    frames = [df[df['bin_code'].isin(selected_bin_codes)] for df in df_dict.values()]
+    frames = [df for df in frames if not df.empty]
+    if not frames or not zone_names:
+        return pd.DataFrame()
+
+    x = np.concatenate([df['ciex'].to_numpy(dtype=float) for df in frames]) + offset_x
+    y = np.concatenate([df['ciey'].to_numpy(dtype=float) for df in frames]) + offset_y
+    bin_index, bin_labels = pd.factorize(np.concatenate([df['bin_code'].to_numpy() for df in frames]), sort=True)
+
+    membership = calculate_zone_membership(x, y, color_zones, zone_names)
+    point_index, zone_index = np.nonzero(membership)
+
+    # 每个(点, 色区)对同时计入(色区, bin_code)分组和(色区, 全部)分组，最后一个槽位表示全部bin_code
+    n_slots = len(bin_labels) + 1
+    group_index = np.concatenate([zone_index * n_slots + bin_index[point_index],
+                                  zone_index * n_slots + len(bin_labels)])
+    pair_x = np.tile(x[point_index], 2)
+    pair_y = np.tile(y[point_index], 2)
+    regression_df = regression_from_sums(
+        grouped_regression_sums(pair_x, pair_y, group_index, len(zone_names) * n_slots), method
+    )
+
+    group_ids = np.arange(len(zone_names) * n_slots)
+    regression_df.insert(0, '色区', [zone_names[g // n_slots] for g in group_ids])
+    regression_df.insert(1, 'bin_code', ['全部' if g % n_slots == len(bin_labels) else bin_labels[g % n_slots]
+                                         for g in group_ids])
+
+    geometry = get_zone_geometry(color_zones)
+    edge_slopes = {zone: geometry.positive_slope(zone) for zone in zone_names}
+    regression_df['色区边斜率'] = regression_df['色区'].map(edge_slopes).astype(float)
+    fitted_angle = np.degrees(np.arctan(regression_df['斜率']))
+    edge_angle = np.degrees(np.arctan(regression_df['色区边斜率']))
+    # 直线方向角以180°为周期，偏差归一化到[-90°, 90°)
+    regression_df['角度偏差(°)'] = (fitted_angle - edge_angle + 90) % 180 - 90
+    regression_df['偏离色区边方向'] = regression_df['角度偏差(°)'].abs() > angle_tolerance
 
-    return regression_results
+    regression_df = regression_df[regression_df['样本数'] >= max(min_points, 2)]
+    columns = ['色区', 'bin_code', '样本数', '斜率', '色区边斜率', '角度偏差(°)', '偏离色区边方向', '截距', 'R² 值']
+    return regression_df[columns].rename(columns={'斜率': '拟合斜率'}).reset_index(drop=True)
 
 
 # 计算CIE色坐标差异
@@ -1071,6 +2836,487 @@ def generate_interactive_mapping_plot(df, value_col, title, fig_width=1000, fig_
     return fig
 
 
+# 数据流图：命名节点 + 声明的输入，节点结果按输入指纹缓存
+class DataflowGraph:
+    """
+    轻量级数据流图。
+    源（source）是界面参数或上传数据，节点（node）由输入和计算函数组成。
+    节点的指纹只由输入的指纹推导，不需要计算结果；请求节点时仅当指纹变化才重新计算，
+    未被请求的节点（例如不可见选项卡需要的图表）不会计算。
+    cache: 持久化的结果缓存（通常为st.session_state中的字典），每个节点只保留最新一份结果
+    """
+
+    def __init__(self, cache):
+        self.cache = cache
+        self.sources = {}
+        self.nodes = {}
+        self.recomputed = []  # 本次运行中重新计算的节点
+        self._fingerprints = {}
+
+    def set_source(self, name, value, fingerprint=None):
+        """设置源的值；未提供指纹时使用值的repr"""
+        if fingerprint is None:
+            fingerprint = repr(value)
+        self.sources[name] = (fingerprint, value)
+        self._fingerprints.clear()
+
+    def add_node(self, name, inputs, func):
+        self.nodes[name] = (list(inputs), func)
+        self._fingerprints.clear()
+
+    def fingerprint(self, name):
+        if name in self.sources:
+            return self.sources[name][0]
+        if name not in self._fingerprints:
+            inputs, _ = self.nodes[name]
+            payload = repr((name, [self.fingerprint(input_name) for input_name in inputs]))
+            self._fingerprints[name] = hashlib.sha1(payload.encode('utf-8')).hexdigest()
+        return self._fingerprints[name]
+
+    def get(self, name):
+        if name in self.sources:
+            return self.sources[name][1]
+        fingerprint = self.fingerprint(name)
+        cached = self.cache.get(name)
+        if cached is not None and cached[0] == fingerprint:
+            return cached[1]
+
+        inputs, func = self.nodes[name]
+        value = func(*[self.get(input_name) for input_name in inputs])
+        self.cache[name] = (fingerprint, value)
+        self.recomputed.append(name)
+        return value
+
+
+# 构建分析用的数据流图（节点定义）
+def build_analysis_graph(cache, membership_cache):
+    graph = DataflowGraph(cache)
+    graph.add_node('filtered_data', ['dataframes', 'selected_bin_codes'], filter_dataframes)
+    graph.add_node('center_stats', ['filtered_data'], summarize_center_stats)
+    graph.add_node(
+        'offsets', ['center_stats', 'move_center', 'target_center'],
+        lambda file_stats, move_center, target_center:
+        calculate_center_offsets(file_stats, target_center) if move_center else (0, 0)
+    )
+    graph.add_node('pooled_center_stats', ['filtered_data', 'center_stats'], calculate_pooled_center_stats)
+    graph.add_node('center_stats_table', ['center_stats', 'move_center', 'offsets', 'pooled_center_stats'],
+                   build_center_stats_table)
+    graph.add_node('robust_stats_table', ['filtered_data', 'robust_trim'], build_robust_stats_table)
+    graph.add_node(
+        'axis_ranges', ['center_stats', 'color_zones', 'move_center', 'target_center', 'fixed_ratio_axis'],
+        calculate_axis_ranges
+    )
+    graph.add_node(
+        'base_figure', ['dataframes', 'selected_bin_codes', 'colors', 'figure_settings', 'selected_zones',
+                        'color_zones'],
+        lambda df_dict, selected_bin_codes, colors, settings, selected_zones, color_zones: build_base_cie_figure(
+            df_dict, list(selected_bin_codes), colors, settings['width'], settings['height'],
+            settings['point_size'], settings['alpha'], settings['x_label'], settings['y_label'],
+            settings['show_grid'], selected_zones, color_zones
+        )
+    )
+    graph.add_node(
+        'cie_figure', ['base_figure', 'center_stats', 'colors', 'figure_title', 'plot_ranges', 'move_center',
+                       'target_center', 'offsets', 'slope_line'],
+        lambda base_fig, file_stats, colors, title, plot_ranges, move_center, target_center, offsets, slope_line:
+        apply_center_offset_to_figure(base_fig, file_stats, colors, title, plot_ranges[0], plot_ranges[1],
+                                      move_center, target_center, offsets, slope_line is not None, slope_line)
+    )
+    graph.add_node(
+        'grouped_slope_table', ['dataframes', 'selected_bin_codes', 'color_zones', 'selected_zones', 'move_center',
+                                'offsets', 'grouped_slope_settings'],
+        lambda df_dict, selected_bin_codes, color_zones, selected_zones, move_center, offsets, settings:
+        calculate_grouped_slope_table(df_dict, list(selected_bin_codes), color_zones, selected_zones, move_center,
+                                      offsets, settings['method'], angle_tolerance=settings['angle_tolerance'])
+    )
+    graph.add_node(
+        'zone_statistics', ['dataframes', 'selected_bin_codes', 'selected_zones', 'color_zones', 'move_center',
+                            'offsets', 'statistic_basis', 'histogram_mode'],
+        lambda df_dict, selected_bin_codes, selected_zones, color_zones, move_center, offsets, basis, histogram_mode:
+        (calculate_zone_statistics_histogram(df_dict, list(selected_bin_codes), selected_zones, color_zones, offsets,
+                                             basis == "original", exact_boundary=histogram_mode['exact_boundary']),
+         pd.DataFrame())
+        if histogram_mode['enabled'] else
+        calculate_zone_statistics(df_dict, list(selected_bin_codes), selected_zones, color_zones, move_center,
+                                  offsets, basis == "original", membership_cache)
+    )
+    graph.add_node(
+        'production_data', ['dataframes', 'selected_bin_codes', 'color_zones', 'move_center', 'offsets',
+                            'statistic_basis', 'production_bins'],
+        lambda df_dict, selected_bin_codes, color_zones, move_center, offsets, basis, production_bins:
+        calculate_production_statistics(
+            df_dict, list(selected_bin_codes), color_zones, move_center, offsets, basis == "original",
+            membership_cache, production_bins
+        )
+    )
+    graph.add_node(
+        'production_cubes', ['production_data', 'production_bins'],
+        lambda production_data, production_bins: calculate_production_cubes(production_data, production_bins)
+    )
+    return graph
+
+
+# --------------------------
+# 批处理（命令行，不依赖Streamlit界面）
+# --------------------------
+BATCH_FILE_EXTENSIONS = ('.csv', '.xlsx', '.xls')
+
+# 批处理默认参数（与网页默认设置一致）
+BATCH_DEFAULT_OPTIONS = {
+    'product_type': "NCSP",
+    'encoding': 'gbk',
+    'zone_preset': "NCSP",  # NCSP / CSP-M / CSP-C / 色区预设文件路径
+    'production_bins_file': None,  # 参数Bin表文件路径，为空时使用内置PRODUCTION_BINS
+    'bin_codes': None,  # 为空时包含全部bin_code
+    'move_center': False,
+    'target_center': (0.2771, 0.26),
+    'statistic_basis': "original",  # original-原始数据，moved-移动后数据
+    'total_zones': None,  # 总占比色区组合，为空时使用预设的默认组合
+    'regression_group': "file",  # file / bin_code / zone
+    'regression_method': "ols",
+    'write_figures': True,
+    'figure_settings': {'width': 1200, 'height': 800, 'point_size': 6, 'alpha': 0.8,
+                        'x_label': 'ciex', 'y_label': 'ciey', 'show_grid': True}
+}
+
+
+# 解析批处理使用的色区预设，返回 (色区, 预设名称)
+def resolve_batch_color_zones(zone_preset):
+    if zone_preset == "NCSP":
+        return COLOR_ZONE_PRESETS["NCSP"]["zones"], COLOR_ZONE_PRESETS["NCSP"]["name"]
+    if zone_preset in ("CSP-M", "CSP-C"):
+        sub_type = COLOR_ZONE_PRESETS["CSP"]["sub_types"][zone_preset[-1]]
+        return sub_type["zones"], f"CSP色区 ({sub_type['name']})"
+    with open(zone_preset, 'rb') as f:
+        preset = load_zone_preset_file(f.read(), os.path.basename(zone_preset))
+    if preset['errors']:
+        raise ValueError(f"色区预设文件 {zone_preset} 无效: {'; '.join(preset['errors'])}")
+    return preset['zones'], f"自定义色区 ({preset['name']})"
+
+
+# 解析批处理使用的参数Bin表
+def resolve_batch_production_bins(production_bins_file, product_type):
+    if not production_bins_file:
+        return PRODUCTION_BINS
+    with open(production_bins_file, 'rb') as f:
+        loaded = load_production_bins_file(f.read(), os.path.basename(production_bins_file))
+    if loaded['errors']:
+        raise ValueError(f"参数Bin表 {production_bins_file} 无效: {'; '.join(loaded['errors'])}")
+    return get_production_bins(loaded['presets'], product_type)
+
+
+# 分析单个批次文件并把统计表（CSV）和图表（HTML）写入output_dir/<文件名>/，返回该文件的汇总信息
+def analyze_lot_file(path, output_dir, options=None):
+    options = {**BATCH_DEFAULT_OPTIONS, **(options or {})}
+    file_name = os.path.basename(path)
+    summary = {'文件名': file_name, '状态': '成功', '错误': '', '点数': 0}
+    start_time = time.time()
+    try:
+        df = read_lot_file(path, options['product_type'], options['encoding'])
+        color_zones, preset_name = resolve_batch_color_zones(options['zone_preset'])
+        production_bins = resolve_batch_production_bins(options['production_bins_file'], options['product_type'])
+        bin_codes = sorted(options['bin_codes'] or df['bin_code'].dropna().unique())
+        zone_names = list(color_zones.keys())
+        lot_dir = os.path.join(output_dir, os.path.splitext(file_name)[0])
+        os.makedirs(lot_dir, exist_ok=True)
+
+        # 与网页相同的数据流图，源数据来自文件而不是界面控件
+        stat = os.stat(path)
+        graph = build_analysis_graph({}, {})
+        graph.set_source('dataframes', {file_name: df}, repr((path, stat.st_size, stat.st_mtime)))
+        graph.set_source('selected_bin_codes', tuple(bin_codes))
+        graph.set_source('colors', {file_name: color_list[0]})
+        graph.set_source('color_zones', color_zones)
+        graph.set_source('move_center', options['move_center'])
+        graph.set_source('target_center', tuple(options['target_center']))
+        graph.set_source('selected_zones', zone_names)
+        graph.set_source('statistic_basis', options['statistic_basis'])
+        graph.set_source('production_bins', production_bins)
+        graph.set_source('histogram_mode', {'enabled': False, 'exact_boundary': False})
+
+        # 中心点统计
+        graph.get('center_stats_table').to_csv(os.path.join(lot_dir, '中心点统计.csv'), index=False,
+                                               encoding='utf-8-sig')
+        file_stats = graph.get('center_stats').get(file_name)
+        offsets = graph.get('offsets')
+
+        # 色区统计与所选色区总占比
+        zone_stats, _ = graph.get('zone_statistics')
+        build_zone_summary_table(zone_stats).to_csv(os.path.join(lot_dir, '色区统计.csv'), index=False,
+                                                    encoding='utf-8-sig')
+        if options['zone_preset'] in ("NCSP", "CSP-M", "CSP-C"):
+            preset_type = options['zone_preset'][:-2] if options['zone_preset'] != "NCSP" else "NCSP"
+        else:
+            preset_type = "自定义"
+        total_zones = options['total_zones'] or get_default_total_zones(
+            color_zones, preset_type, options['zone_preset'][-1], DEFAULT_TOTAL_ZONES)
+        zone_totals = build_zone_total_table(zone_stats, total_zones)
+        zone_totals.to_csv(os.path.join(lot_dir, '所选色区总占比.csv'), index=False, encoding='utf-8-sig')
+
+        # 产出分布（联合计数立方体的各参数边缘分布）与bin号分布
+        cube = graph.get('production_cubes').get(file_name)
+        if cube is not None:
+            for param, config in production_bins.items():
+                if param not in cube.axis_index:
+                    continue
+                counts = cube.marginal(param).reindex(config['order'], fill_value=0)
+                pd.DataFrame({
+                    'Bin区': counts.index,
+                    f'范围({config["units"]})': [f"{config['bins'][code][0]}-{config['bins'][code][1]}"
+                                               for code in counts.index],
+                    '数量': counts.values,
+                    '占比(%)': np.round(counts.values / cube.total * 100, 2)
+                }).to_csv(os.path.join(lot_dir, f"产出分布_{config['name']}.csv"), index=False, encoding='utf-8-sig')
+        bin_histogram = build_bin_histogram(df)
+        if bin_histogram is not None:
+            bin_counts = select_bin_histogram(bin_histogram, bin_codes)
+            pd.DataFrame({
+                'bin号': np.arange(1, 81),
+                '计数': bin_counts,
+                '占比(%)': np.round(bin_counts / max(bin_counts.sum(), 1) * 100, 2)
+            }).to_csv(os.path.join(lot_dir, 'bin分布.csv'), index=False, encoding='utf-8-sig')
+
+        # 线性回归
+        calculate_batched_regression(
+            {file_name: df}, bin_codes, options['move_center'], offsets,
+            group_by=None if options['regression_group'] == "file" else options['regression_group'],
+            method=options['regression_method'], color_zones=color_zones, zone_names=zone_names
+        ).to_csv(os.path.join(lot_dir, '线性回归.csv'), index=False, encoding='utf-8-sig')
+
+        # CIE色区分布图
+        if options['write_figures'] and file_stats is not None:
+            graph.set_source('fixed_ratio_axis', False)
+            x_range, y_range = graph.get('axis_ranges')
+            graph.set_source('figure_settings', options['figure_settings'])
+            graph.set_source('figure_title', f"{file_name} {preset_name} CIE色区分布图")
+            graph.set_source('plot_ranges', (tuple(x_range), tuple(y_range)))
+            graph.set_source('slope_line', None)
+            graph.get('cie_figure').write_html(os.path.join(lot_dir, 'CIE色区分布图.html'), include_plotlyjs='cdn')
+
+        summary.update({
+            '点数': int(file_stats['count']) if file_stats else 0,
+            '中心点 x': file_stats['center_x'] if file_stats else np.nan,
+            '中心点 y': file_stats['center_y'] if file_stats else np.nan,
+            '所选色区总占比(%)': zone_totals['总占比(%)'].iloc[0] if not zone_totals.empty else np.nan
+        })
+    except Exception as e:
+        summary.update({'状态': '失败', '错误': f"{type(e).__name__}: {e}"})
+    elapsed = time.time() - start_time
+    summary['耗时(秒)'] = round(elapsed, 3)
+    summary['点数/秒'] = round(summary['点数'] / elapsed, 1) if elapsed > 0 else np.nan
+    return summary
+
+
+# 并行分析目录下的所有批次文件，写入各文件的结果与批处理汇总表，返回汇总表
+def run_batch_analysis(input_dir, output_dir, options=None, workers=None, logger=None):
+    logger = logger or logging.getLogger(__name__)
+    paths = sorted(
+        os.path.join(input_dir, name) for name in os.listdir(input_dir)
+        if name.lower().endswith(BATCH_FILE_EXTENSIONS) and not name.startswith('~$')
+    )
+    os.makedirs(output_dir, exist_ok=True)
+    if not paths:
+        logger.warning("目录 %s 中没有可分析的文件", input_dir)
+        return pd.DataFrame()
+
+    start_time = time.time()
+    summaries = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(analyze_lot_file, path, output_dir, options): path for path in paths}
+        for future in as_completed(futures):
+            summary = future.result()
+            summaries.append(summary)
+            if summary['状态'] == '成功':
+                logger.info("%s: %d 点，%.2f 秒（%.0f 点/秒）", summary['文件名'], summary['点数'],
+                            summary['耗时(秒)'], summary['点数/秒'])
+            else:
+                logger.error("%s: 分析失败 - %s", summary['文件名'], summary['错误'])
+
+    summary_df = pd.DataFrame(summaries).sort_values('文件名').reset_index(drop=True)
+    summary_df.to_csv(os.path.join(output_dir, '批处理汇总.csv'), index=False, encoding='utf-8-sig')
+    elapsed = time.time() - start_time
+    logger.info("共 %d 个文件（失败 %d 个），%d 点，总耗时 %.2f 秒（%.0f 点/秒）", len(summary_df),
+                int((summary_df['状态'] != '成功').sum()), int(summary_df['点数'].sum()), elapsed,
+                summary_df['点数'].sum() / elapsed if elapsed > 0 else 0)
+    return summary_df
+
+
+# 命令行入口：python "CIE色点分析综合工具2.0.py" 输入目录 -o 输出目录 [选项]
+def batch_main(argv=None):
+    parser = argparse.ArgumentParser(description="CIE色点批处理分析：并行分析目录下的所有批次文件，输出统计表和图表")
+    parser.add_argument('input_dir', help="批次文件目录（CSV/XLSX/XLS）")
+    parser.add_argument('-o', '--output-dir', default='cie_batch_output', help="输出目录")
+    parser.add_argument('-j', '--workers', type=int, default=None, help="并行进程数（默认为CPU核数）")
+    parser.add_argument('--product-type', choices=["NCSP", "CSP"], default=BATCH_DEFAULT_OPTIONS['product_type'])
+    parser.add_argument('--encoding', default=BATCH_DEFAULT_OPTIONS['encoding'], help="CSV文件编码")
+    parser.add_argument('--zone-preset', default=BATCH_DEFAULT_OPTIONS['zone_preset'],
+                        help="色区预设：NCSP、CSP-M、CSP-C 或色区预设文件路径")
+    parser.add_argument('--production-bins', default=None, help="参数Bin表文件路径")
+    parser.add_argument('--bin-codes', nargs='*', default=None, help="要包含的bin_code（默认全部）")
+    parser.add_argument('--target-center', nargs=2, type=float, default=None, metavar=('X', 'Y'),
+                        help="将中心点移动到目标中心点")
+    parser.add_argument('--moved-basis', action='store_true', help="色区与产出统计使用移动后的坐标")
+    parser.add_argument('--total-zones', nargs='*', default=None, help="计算总占比的色区组合")
+    parser.add_argument('--regression-group', choices=["file", "bin_code", "zone"],
+                        default=BATCH_DEFAULT_OPTIONS['regression_group'])
+    parser.add_argument('--regression-method', choices=["ols", "tls"], default=BATCH_DEFAULT_OPTIONS['regression_method'])
+    parser.add_argument('--no-figures', action='store_true', help="不输出图表")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    options = {
+        'product_type': args.product_type,
+        'encoding': args.encoding,
+        'zone_preset': args.zone_preset,
+        'production_bins_file': args.production_bins,
+        'bin_codes': args.bin_codes,
+        'move_center': args.target_center is not None,
+        'target_center': tuple(args.target_center) if args.target_center else BATCH_DEFAULT_OPTIONS['target_center'],
+        'statistic_basis': "moved" if args.moved_basis else "original",
+        'total_zones': args.total_zones,
+        'regression_group': args.regression_group,
+        'regression_method': args.regression_method,
+        'write_figures': not args.no_figures
+    }
+    summary = run_batch_analysis(args.input_dir, args.output_dir, options, args.workers,
+                                 logging.getLogger("cie_batch"))
+    return 1 if summary.empty or (summary['状态'] != '成功').any() else 0
+
+
+# 分页数据表的控件（实际key为 "{表格key}_{名称}"）
+TABLE_VIEW_WIDGETS = ('filter_column', 'filter_text', 'filter_low', 'filter_high', 'sort_column', 'sort_order',
+                      'page_size', 'page')
+
+# 各选项卡中需要保持状态的控件键。选项卡未显示时其控件不会渲染，Streamlit会清除这些键的状态，
+# 因此对未显示的选项卡重新赋值这些键，使切换选项卡后设置保持不变
+TAB_WIDGET_KEYS = {
+    'tab1': ('scatter_width', 'scatter_height', 'scatter_point_size', 'scatter_alpha', 'scatter_title',
+             'scatter_x_label', 'scatter_y_label', 'scatter_grid', 'axis_scale_option', 'manual_range_checkbox',
+             'scatter_x_min', 'scatter_x_max', 'scatter_y_min', 'scatter_y_max', 'show_slope_analysis',
+             'slope_center_x', 'slope_center_y', 'show_robust_stats', 'robust_trim_ratio', 'show_grouped_slopes',
+             'grouped_slope_method', 'grouped_slope_tolerance'),
+    'tab2': ('statistic_method_radio', 'histogram_exact_boundary', 'optimizer_zones_selector', 'optimizer_mode',
+             'optimizer_search_radius', 'surface_zones_selector', 'surface_radius', 'surface_resolution',
+             'total_zones_selector', 'regression_group_radio', 'regression_method_radio', 'zone_stats_layout')
+            + tuple(f"zone_sample_view_{name}" for name in TABLE_VIEW_WIDGETS),
+    'tab3': tuple(f"production_sample_view_{name}" for name in TABLE_VIEW_WIDGETS),
+    'tab5': ('history_lot_date', 'history_product_filter', 'history_trend_period', 'history_by_material',
+             'history_zones_selector')
+            + tuple(f"history_lots_view_{name}" for name in TABLE_VIEW_WIDGETS),
+    'tab4': ('mapping_material_selector', 'mapping_product_type', 'color_scale_name_mapping', 'map_width',
+             'map_height', 'filter_outliers', 'ciex_min', 'ciex_max', 'ciey_min', 'ciey_max', 'custom_color_range',
+             'ciex_color_min', 'ciex_color_max', 'ciey_color_min', 'ciey_color_max', 'cluster_density',
+             'show_grid_subdivisions', 'ncsp_region_selector', 'value_column'),
+}
+
+
+def persist_tab_widget_state(tab_name):
+    for key in TAB_WIDGET_KEYS.get(tab_name, ()):
+        if key in st.session_state:
+            st.session_state[key] = st.session_state[key]
+
+
+# 创建按需执行的选项卡：支持时只运行当前选中选项卡的内容，旧版本Streamlit回退为普通选项卡
+def create_lazy_tabs(labels, key):
+    try:
+        return st.tabs(labels, on_change="rerun", key=key)
+    except TypeError:
+        return st.tabs(labels)
+
+
+def tab_is_open(tab):
+    # 普通选项卡的open属性为None（无法得知是否可见），视为可见
+    return getattr(tab, 'open', None) is not False
+
+
+# 分页数据表的行选择：筛选和排序都在行号数组上向量化完成，不复制整张表
+def table_view_rows(df, filter_column=None, filter_value=None, sort_column=None, ascending=True):
+    """
+    filter_value: 数值列为 (下限, 上限)，其他列为包含的文本；返回满足条件的行位置数组（已按sort_column排序）
+    """
+    rows = np.arange(len(df))
+    if filter_column is not None and filter_value not in (None, ""):
+        values = df[filter_column]
+        if pd.api.types.is_numeric_dtype(values):
+            low, high = filter_value
+            mask = (values >= low) & (values <= high)
+        else:
+            mask = values.astype(str).str.contains(str(filter_value), regex=False)
+        rows = np.flatnonzero(mask.to_numpy())
+
+    if sort_column is not None:
+        values = df[sort_column]
+        if pd.api.types.is_numeric_dtype(values):
+            keys = values.to_numpy()[rows]
+        else:
+            keys = pd.factorize(values, sort=True)[0][rows]
+        order = np.argsort(keys, kind='stable')
+        rows = rows[order if ascending else order[::-1]]
+    return rows
+
+
+# 切换筛选列时清除数值范围，使下限/上限重新取新列的最小/最大值
+def reset_table_view_range(key):
+    st.session_state.pop(f"{key}_filter_low", None)
+    st.session_state.pop(f"{key}_filter_high", None)
+
+
+# 服务端分页数据表：筛选、排序在服务端完成，只把当前页发送到浏览器
+def render_paginated_table(df, key, columns=None):
+    columns = [column for column in (columns or df.columns) if column in df.columns]
+    no_selection = "（无）"
+
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        filter_column = st.selectbox("筛选列", [no_selection] + columns, key=f"{key}_filter_column",
+                                     on_change=reset_table_view_range, args=(key,))
+    filter_column = None if filter_column == no_selection else filter_column
+    filter_value = None
+    with col2:
+        if filter_column is not None and pd.api.types.is_numeric_dtype(df[filter_column]):
+            column_min = float(df[filter_column].min()) if len(df) else 0.0
+            column_max = float(df[filter_column].max()) if len(df) else 0.0
+            low = st.number_input("下限", value=column_min, format="%.6g", key=f"{key}_filter_low")
+            high = st.number_input("上限", value=column_max, format="%.6g", key=f"{key}_filter_high")
+            filter_value = (low, high)
+        elif filter_column is not None:
+            filter_value = st.text_input("包含文本", key=f"{key}_filter_text")
+    with col3:
+        sort_column = st.selectbox("排序列", [no_selection] + columns, key=f"{key}_sort_column")
+        sort_column = None if sort_column == no_selection else sort_column
+        ascending = st.radio("排序方式", ["升序", "降序"], key=f"{key}_sort_order", horizontal=True) == "升序"
+    with col4:
+        page_size = st.selectbox("每页行数", [50, 100, 500, 1000], index=1, key=f"{key}_page_size")
+
+    # 筛选/排序条件与数据不变时复用行号数组，翻页只做切片
+    view_cache = st.session_state.setdefault('table_view_cache', {})
+    spec = (filter_column, filter_value, sort_column, ascending)
+    cached = view_cache.get(key)
+    if cached is not None and cached['data'] is df and cached['spec'] == spec:
+        rows = cached['rows']
+    else:
+        rows = table_view_rows(df, filter_column, filter_value, sort_column, ascending)
+        view_cache[key] = {'data': df, 'spec': spec, 'rows': rows}
+
+    n_pages = max(1, -(-len(rows) // page_size))
+    page_key = f"{key}_page"
+    if st.session_state.get(page_key, 1) > n_pages:
+        st.session_state[page_key] = n_pages
+    page = st.number_input(f"页码（共 {n_pages} 页，{len(rows)} / {len(df)} 行）", min_value=1,
+                           max_value=n_pages, value=1, step=1, key=page_key)
+    start = (page - 1) * page_size
+    st.dataframe(df[columns].iloc[rows[start:start + page_size]])
+
+
+# 获取当前会话的DuckDB查询层（每个会话一个内存数据库，已注册的表与查询缓存在会话内复用）
+def get_query_layer():
+    if duckdb is None:
+        return None
+    if st.session_state.get('query_layer') is None:
+        st.session_state.query_layer = DuckDBQueryLayer()
+    return st.session_state.query_layer
+
+
 # 更新图表的回调函数
 def update_chart():
     st.session_state.chart_updated = True
@@ -1085,6 +3331,33 @@ def update_target_y():
     st.session_state.target_center_y = st.session_state.target_y_input
 
 
+# 将最优偏移搜索得到的目标中心点应用到中心点移动设置
+def apply_optimized_center():
+    result = st.session_state.get('offset_optimization')
+    if result is None or result.empty:
+        return
+    best = result.iloc[0]
+    st.session_state.target_center_x = float(best['最优目标中心点 x'])
+    st.session_state.target_center_y = float(best['最优目标中心点 y'])
+    st.session_state.target_x_input = st.session_state.target_center_x
+    st.session_state.target_y_input = st.session_state.target_center_y
+    st.session_state.move_center = True
+    st.session_state.move_center_checkbox = True
+
+
+# 获取总占比统计的默认色区组合
+def get_default_total_zones(color_zones, preset_type, csp_sub_type, selected_total_zones):
+    if preset_type == "CSP":
+        # CSP类型：根据子类型自动选择默认色区（一次模压为_M后缀，无水切割为_C后缀）
+        suffix = "_M" if csp_sub_type == "M" else "_C"
+        return [zone for zone in color_zones.keys() if zone.endswith(suffix)]
+    if preset_type == "自定义":
+        # 自定义预设：沿用已选且存在于预设中的色区，没有时选择全部色区
+        return [zone for zone in selected_total_zones if zone in color_zones] or list(color_zones.keys())
+    # NCSP类型：保持原有逻辑
+    return [zone for zone in selected_total_zones if zone in color_zones]
+
+
 # 添加回调函数来更新cell_size
 def update_cell_size():
     st.session_state.cell_size = st.session_state.cell_size_slider
@@ -1108,7 +3381,7 @@ def main():
         st.session_state.move_center = False  # 中心点移动选项
         st.session_state.target_center_x = 0.2771  # 目标中心点X
         st.session_state.target_center_y = 0.26  # 目标中心点Y
-        st.session_state.selected_total_zones = ['DK32', 'DK33', 'DK34', 'DK35', 'DL32', 'DL33', 'DL34', 'DL35']
+        st.session_state.selected_total_zones = list(DEFAULT_TOTAL_ZONES)
         st.session_state.statistic_basis = "original"  # 统计依据：original-原始数据，moved-移动后数据
         st.session_state.production_data = None  # 存储产出分布数据，避免重复计算
         st.session_state.production_calculated = False  # 标记产出数据是否已计算
@@ -1119,15 +3392,44 @@ def main():
         st.session_state.cell_size = 0.8  # 单元格大小
         st.session_state.show_slope_analysis = False  # 斜率分析开关
         st.session_state.slope_center = (0.2771, 0.26)  # 理想中心点默认值
+        st.session_state.membership_cache = {}  # 移动后坐标的色区归属缓存（中心点移动时增量更新）
+        st.session_state.offset_optimization = None  # 最优偏移搜索结果
+        st.session_state.dataflow_cache = {}  # 数据流图各节点的计算结果（按输入指纹失效）
+        st.session_state.data_fingerprint = None  # 已加载数据的指纹
+        st.session_state.custom_zone_presets = {}  # 导入的自定义色区预设 {预设名称: 色区}
+        st.session_state.production_bins_config = {}  # 导入的参数Bin表 {产品类型: 参数Bin表}
 
     # 色区预设选择
     st.header("1. 色区预设与产品类型选择")
+
+    # 导入自定义色区预设
+    with st.expander("导入自定义色区预设（CSV / JSON / Excel）", expanded=False):
+        st.markdown("表格格式：每行一个色区，包含名称列（色区/名称/name）和按顺序排列的四个顶点 "
+                    "x1, y1, x2, y2, x3, y3, x4, y4；JSON格式：{色区名称: [[x, y], ...]}，"
+                    "可外包一层 {\"name\": 预设名称, \"zones\": {...}}")
+        preset_file = st.file_uploader("上传色区预设文件", type=["csv", "json", "xlsx", "xls"],
+                                       key="zone_preset_uploader")
+        if preset_file is not None:
+            preset = load_zone_preset_file(preset_file.getvalue(), preset_file.name)
+            for error in preset['errors']:
+                st.error(error)
+            for warning in preset['warnings'][:20]:
+                st.warning(warning)
+            if len(preset['warnings']) > 20:
+                st.warning(f"另有 {len(preset['warnings']) - 20} 条警告未显示")
+            if not preset['errors']:
+                st.session_state.custom_zone_presets[preset['name']] = preset['zones']
+                st.success(f"已导入色区预设 {preset['name']}：{len(preset['zones'])} 个色区"
+                           f"（内容校验码 {preset['hash'][:8]}）")
+
+    preset_options = ["NCSP", "CSP"] + (["自定义"] if st.session_state.custom_zone_presets else [])
     col1, col2 = st.columns(2)
     with col1:
         preset_type = st.radio(
             "选择色区预设类型:",
-            ["NCSP", "CSP"],
-            index=0 if st.session_state.color_zone_preset == "NCSP" else 1,
+            preset_options,
+            index=preset_options.index(st.session_state.color_zone_preset)
+            if st.session_state.color_zone_preset in preset_options else 0,
             on_change=update_chart
         )
         st.session_state.color_zone_preset = preset_type
@@ -1152,7 +3454,12 @@ def main():
         st.session_state.csp_sub_type = csp_sub_type.split()[0]  # 提取"M"或"C"
 
     # 根据选择的预设获取色区数据
-    if preset_type == "NCSP":
+    if preset_type == "自定义":
+        custom_preset_name = st.selectbox("选择自定义色区预设:", list(st.session_state.custom_zone_presets.keys()),
+                                          key="custom_preset_selector", on_change=update_chart)
+        color_zones = st.session_state.custom_zone_presets[custom_preset_name]
+        preset_name = f"自定义色区 ({custom_preset_name})"
+    elif preset_type == "NCSP":
         color_zones = COLOR_ZONE_PRESETS["NCSP"]["zones"]
         preset_name = COLOR_ZONE_PRESETS["NCSP"]["name"]
     else:  # CSP
@@ -1189,6 +3496,21 @@ def main():
                 df = load_data(file, st.session_state.product_type, encoding)
                 if df is not None:
                     st.session_state.dataframes[file.name] = df
+            # 数据指纹：文件标识不变时，数据流图中依赖原始数据的节点无需重新计算
+            data_fingerprint = repr([
+                (file.name, file.size, getattr(file, 'file_id', None), st.session_state.product_type, encoding)
+                for file in uploaded_files
+            ])
+            # 新数据加载时预计算各文件的bin号直方图和批次标识（文件内容哈希，用于历史批次库去重）
+            if data_fingerprint != st.session_state.data_fingerprint or 'bin_histograms' not in st.session_state:
+                st.session_state.bin_histograms = {
+                    file_name: build_bin_histogram(df) for file_name, df in st.session_state.dataframes.items()
+                }
+                st.session_state.lot_ids = {
+                    file.name: hashlib.sha1(file.getvalue()).hexdigest()
+                    for file in uploaded_files if file.name in st.session_state.dataframes
+                }
+            st.session_state.data_fingerprint = data_fingerprint
             load_time = time.time() - start_time
             st.success(f"成功加载 {len(st.session_state.dataframes)} 个文件，耗时 {load_time:.2f} 秒")
 
@@ -1233,1178 +3555,1324 @@ def main():
                 )
                 st.session_state.colors[file_name] = color
 
-            # 使用选项卡组织不同的分析功能
-            tab1, tab2, tab3, tab4 = st.tabs(["CIE色区统计", "色区详细统计", "产出分布统计", "Mapping图分析"])
+            # 跨选项卡共享的设置（选项卡按需执行，不能依赖其他选项卡中定义的变量）
+            selected_zones = [zone for zone in st.session_state.selected_zones if zone in color_zones]
+            if not selected_zones:
+                selected_zones = list(color_zones.keys())
+            statistic_basis = "原始数据" if st.session_state.statistic_basis == "original" else "移动后数据"
+
+            # 数据流图：各选项卡只请求自己需要的节点，节点在输入未变化时直接复用上次结果
+            graph = build_analysis_graph(st.session_state.dataflow_cache, st.session_state.membership_cache)
+            graph.set_source('dataframes', st.session_state.dataframes, st.session_state.data_fingerprint)
+            graph.set_source('selected_bin_codes', tuple(selected_bin_codes))
+            graph.set_source('colors', dict(st.session_state.colors))
+            graph.set_source('color_zones', color_zones)
+            graph.set_source('move_center', st.session_state.move_center)
+            graph.set_source('target_center', (st.session_state.target_center_x, st.session_state.target_center_y))
+            graph.set_source('selected_zones', selected_zones)
+            graph.set_source('statistic_basis', st.session_state.statistic_basis)
+            active_bins = get_production_bins(st.session_state.get('production_bins_config'),
+                                              st.session_state.product_type)
+            graph.set_source('production_bins', active_bins)
+
+            # 使用选项卡组织不同的分析功能（只执行当前选中的选项卡）
+            tab1, tab2, tab3, tab4, tab5 = create_lazy_tabs(
+                ["CIE色区统计", "色区详细统计", "产出分布统计", "Mapping图分析", "历史批次"], key="main_tabs"
+            )
+            for tab_name, tab in (('tab1', tab1), ('tab2', tab2), ('tab3', tab3), ('tab4', tab4), ('tab5', tab5)):
+                if not tab_is_open(tab):
+                    persist_tab_widget_state(tab_name)
 
             # 1. CIE色区统计选项卡
-            with tab1:
-                st.header("CIE色区分布图")
-
-                # 图表设置
-                st.subheader("图表设置")
-                col1, col2 = st.columns(2)
-                with col1:
-                    fig_width = st.slider("图表宽度 (像素)", 800, 2000, 1200, on_change=update_chart,
-                                          key="scatter_width")
-                    fig_height = st.slider("图表高度 (像素)", 600, 1500, 800, on_change=update_chart,
-                                           key="scatter_height")
-                    point_size = st.slider("点大小", 1, 50, 6, on_change=update_chart, key="scatter_point_size")
-                    alpha = st.slider("点透明度", 0.1, 1.0, 0.8, on_change=update_chart, key="scatter_alpha")
-
-                with col2:
-                    title = st.text_input("图表标题", f"{preset_name} CIE色区分布图", on_change=update_chart,
-                                          key="scatter_title")
-                    x_label = st.text_input("X轴标签", "ciex", on_change=update_chart, key="scatter_x_label")
-                    y_label = st.text_input("Y轴标签", "ciey", on_change=update_chart, key="scatter_y_label")
-                    show_grid = st.checkbox("显示网格", True, on_change=update_chart, key="scatter_grid")
-
-                # 中心点移动设置
-                st.subheader("中心点移动设置")
-                move_center = st.checkbox(
-                    "启用中心点移动",
-                    value=st.session_state.move_center,
-                    on_change=update_chart,
-                    key="move_center_checkbox"
-                )
-                st.session_state.move_center = move_center
+            if tab_is_open(tab1):
+                with tab1:
+                    st.header("CIE色区分布图")
 
-                target_center = (st.session_state.target_center_x, st.session_state.target_center_y)
-                if move_center:
+                    # 图表设置
+                    st.subheader("图表设置")
                     col1, col2 = st.columns(2)
                     with col1:
-                        st.number_input(
-                            "目标中心点 X",
-                            value=st.session_state.target_center_x,
-                            step=0.0001,
-                            format="%.4f",
-                            on_change=update_target_x,
-                            key="target_x_input"
-                        )
+                        fig_width = st.slider("图表宽度 (像素)", 800, 2000, 1200, on_change=update_chart,
+                                              key="scatter_width")
+                        fig_height = st.slider("图表高度 (像素)", 600, 1500, 800, on_change=update_chart,
+                                               key="scatter_height")
+                        point_size = st.slider("点大小", 1, 50, 6, on_change=update_chart, key="scatter_point_size")
+                        alpha = st.slider("点透明度", 0.1, 1.0, 0.8, on_change=update_chart, key="scatter_alpha")
+
                     with col2:
-                        st.number_input(
-                            "目标中心点 Y",
-                            value=st.session_state.target_center_y,
-                            step=0.0001,
-                            format="%.4f",
-                            on_change=update_target_y,
-                            key="target_y_input"
-                        )
-                    target_center = (st.session_state.target_center_x, st.session_state.target_center_y)
-                    st.info(
-                        f"将根据目标中心点 ({target_center[0]:.4f}, {target_center[1]:.4f}) 计算补偿系数并移动数据点")
-                    st.info("注意：启用中心点移动后，仅数据点会移动，色区位置保持固定不变")
-                # 1. 坐标轴范围设置（修改：新增固定比例选项）
-                st.subheader("坐标轴范围设置")
-                # 新增：比例选择器
-                axis_scale_option = st.radio(
-                    "选择坐标轴比例",
-                    ["自动范围", "固定比例（x:0.0055/格, y:0.01/格）"],
-                    key="axis_scale_option",
-                    on_change=update_chart
-                )
+                        title = st.text_input("图表标题", f"{preset_name} CIE色区分布图", on_change=update_chart,
+                                              key="scatter_title")
+                        x_label = st.text_input("X轴标签", "ciex", on_change=update_chart, key="scatter_x_label")
+                        y_label = st.text_input("Y轴标签", "ciey", on_change=update_chart, key="scatter_y_label")
+                        show_grid = st.checkbox("显示网格", True, on_change=update_chart, key="scatter_grid")
+
+                    # 中心点移动设置
+                    st.subheader("中心点移动设置")
+                    move_center = st.checkbox(
+                        "启用中心点移动",
+                        value=st.session_state.move_center,
+                        on_change=update_chart,
+                        key="move_center_checkbox"
+                    )
+                    st.session_state.move_center = move_center
 
-                # 计算所有数据的范围（原有逻辑保留，新增比例判断）
-                all_ciex = []
-                all_ciey = []
-                for df in st.session_state.dataframes.values():
-                    filtered_df = df[df['bin_code'].isin(selected_bin_codes)]
-                    if not filtered_df.empty:
-                        if move_center:
-                            all_ciex.extend(
-                                (filtered_df['ciex'] + (target_center[0] - filtered_df['ciex'].mean())).tolist())
-                            all_ciey.extend(
-                                (filtered_df['ciey'] + (target_center[1] - filtered_df['ciey'].mean())).tolist())
-                        else:
-                            all_ciex.extend(filtered_df['ciex'].tolist())
-                            all_ciey.extend(filtered_df['ciey'].tolist())
-                for zone_coords in color_zones.values():
-                    for x, y in zone_coords:
-                        all_ciex.append(x)
-                        all_ciey.append(y)
-
-                if all_ciex and all_ciey:
-                    # 新增：根据比例选项计算范围
-                    if axis_scale_option == "固定比例（x:0.0055/格, y:0.01/格）":
-                        x_range, y_range = calculate_fixed_ratio_range(all_ciex, all_ciey)
-                    else:  # 自动范围（原有逻辑）
-                        x_min, x_max = min(all_ciex), max(all_ciex)
-                        y_min, y_max = min(all_ciey), max(all_ciey)
-                        x_margin = (x_max - x_min) * 0.1
-                        y_margin = (y_max - y_min) * 0.1
-                        x_range = [x_min - x_margin, x_max + x_margin]
-                        y_range = [y_min - y_margin, y_max + y_margin]
-
-                    # 手动调整（原有逻辑保留）
-                    if st.checkbox("手动调整范围", value=False, key="manual_range_checkbox", on_change=update_chart):
+                    target_center = (st.session_state.target_center_x, st.session_state.target_center_y)
+                    if move_center:
                         col1, col2 = st.columns(2)
                         with col1:
-                            x_min_custom = st.number_input("X轴最小值", value=round(x_range[0], 4), step=0.0001,
-                                                           format="%.4f", key="scatter_x_min")
-                            x_max_custom = st.number_input("X轴最大值", value=round(x_range[1], 4), step=0.0001,
-                                                           format="%.4f", key="scatter_x_max")
+                            st.number_input(
+                                "目标中心点 X",
+                                value=st.session_state.target_center_x,
+                                step=0.0001,
+                                format="%.4f",
+                                on_change=update_target_x,
+                                key="target_x_input"
+                            )
                         with col2:
-                            y_min_custom = st.number_input("Y轴最小值", value=round(y_range[0], 4), step=0.0001,
-                                                           format="%.4f", key="scatter_y_min")
-                            y_max_custom = st.number_input("Y轴最大值", value=round(y_range[1], 4), step=0.0001,
-                                                           format="%.4f", key="scatter_y_max")
-                        x_range = [x_min_custom, x_max_custom]
-                        y_range = [y_min_custom, y_max_custom]
-                else:
-                    st.warning("没有足够的数据来计算坐标轴范围")
-                    x_range = [0, 0.044]  # 固定比例默认范围
-                    y_range = [0, 0.05]
-
-                # 2. 新增：斜率分析设置（在“色区选择”前插入）
-                st.subheader("斜率分析设置")
-                show_slope_analysis = st.checkbox("显示理想斜率线", value=False, key="show_slope_analysis",
-                                                  on_change=update_chart)
-                slope_line_info = None  # 存储斜率线信息（方程+坐标）
-
-                if show_slope_analysis:
-                    # 理想中心点设置（默认0.2771, 0.26）
-                    st.markdown("#### 理想中心点")
-                    col1, col2 = st.columns(2)
-                    with col1:
-                        slope_center_x = st.number_input(
-                            "X坐标", value=0.2771, step=0.0001, format="%.4f", key="slope_center_x"
-                        )
-                    with col2:
-                        slope_center_y = st.number_input(
-                            "Y坐标", value=0.26, step=0.0001, format="%.4f", key="slope_center_y"
-                        )
-                    slope_center = (slope_center_x, slope_center_y)
-
-                    # 找到包含中心点的色区
-                    zone_name, zone_coords = find_zone_containing_point(slope_center, color_zones)
-                    if zone_name and zone_coords:
-                        st.success(f"找到包含中心点的色区：{zone_name}")
-                        # 计算色区的正斜率
-                        positive_slope = calculate_parallelogram_positive_slopes(zone_coords)
-                        if positive_slope:
-                            st.info(f"色区正斜率：{positive_slope:.4f}")
-                            # 计算直线方程和坐标
-                            slope_line_info = get_slope_line_params(slope_center, positive_slope)
-                        else:
-                            st.warning("该色区无正斜率边，请选择其他包含中心点的色区")
-                    else:
-                        st.warning("理想中心点不在任何色区内，请调整中心点坐标")
-
-
-                # 色区选择
-                st.subheader("色区选择")
-                # 确保选中的色区存在于当前预设中
-                valid_selected_zones = []
-                if st.session_state.selected_zones:
-                    for zone in st.session_state.selected_zones:
-                        if zone in color_zones:
-                            valid_selected_zones.append(zone)
-
-                # 如果没有有效选项，则默认选择所有色区
-                if not valid_selected_zones:
-                    valid_selected_zones = list(color_zones.keys())
-
-                selected_zones = st.multiselect(
-                    "选择要显示的色区:",
-                    list(color_zones.keys()),
-                    default=valid_selected_zones,
-                    on_change=update_chart
-                )
-                st.session_state.selected_zones = selected_zones
-
-                # 绘制CIE散点图
-                st.subheader("CIE色区分布图")
-                with st.spinner("正在生成图表..."):
-                    start_time = time.time()
-                    fig, stats_df, offsets = generate_interactive_cie_plot_with_zones(
-                        st.session_state.dataframes,
-                        selected_bin_codes,
-                        st.session_state.colors,
-                        title,
-                        fig_width,
-                        fig_height,
-                        point_size,
-                        alpha,
-                        x_label,
-                        y_label,
-                        show_grid,
-                        x_range,
-                        y_range,
-                        selected_zones,
-                        color_zones,
-                        move_center,
-                        target_center,
-                        show_slope_line = show_slope_analysis,  # 新增
-                        slope_line_info = slope_line_info  # 新增
+                            st.number_input(
+                                "目标中心点 Y",
+                                value=st.session_state.target_center_y,
+                                step=0.0001,
+                                format="%.4f",
+                                on_change=update_target_y,
+                                key="target_y_input"
+                            )
+                        target_center = (st.session_state.target_center_x, st.session_state.target_center_y)
+                        st.info(
+                            f"将根据目标中心点 ({target_center[0]:.4f}, {target_center[1]:.4f}) 计算补偿系数并移动数据点")
+                        st.info("注意：启用中心点移动后，仅数据点会移动，色区位置保持固定不变")
+                    graph.set_source('move_center', move_center)
+                    graph.set_source('target_center', target_center)
+                    # 1. 坐标轴范围设置（修改：新增固定比例选项）
+                    st.subheader("坐标轴范围设置")
+                    # 新增：比例选择器
+                    axis_scale_option = st.radio(
+                        "选择坐标轴比例",
+                        ["自动范围", "固定比例（x:0.0055/格, y:0.01/格）"],
+                        key="axis_scale_option",
+                        on_change=update_chart
                     )
-                    plot_time = time.time() - start_time
-
-                    # 显示图表和统计数据
-                    # 修改后
-                    # 获取所有上传的文件名（去除扩展名）
-                    file_names = [os.path.splitext(name)[0] for name in st.session_state.dataframes.keys()]
-                    # 拼接文件名（最多显示3个，避免过长）
-                    combined_name = "_".join(file_names[:3]) + ("..." if len(file_names) > 3 else "")
-                    # 配置下载文件名
-                    config = {
-                        'toImageButtonOptions': {
-                            'filename': f"CIE色点分布图_{combined_name}",
-                            'format': 'png',  # 可选项：'png'、'svg'、'jpeg'、'webp'
-                            'height': fig_height,
-                            'width': fig_width,
-                            'scale': 2  # 分辨率缩放
-                        }
-                    }
-                    st.plotly_chart(fig, config=config, use_container_width=True)
-
 
-                    # 显示统计数据
-                    st.subheader("基本统计数据")
-                    if not stats_df.empty:
-                        # 显示补偿系数（如果启用了中心点移动）
-                        if move_center and offsets != (0, 0):
-                            st.info(f"应用的补偿系数: X偏移 = {offsets[0]:.6f}, Y偏移 = {offsets[1]:.6f}")
-                        st.dataframe(stats_df.round(4))
+                    # 计算所有数据的范围（根据比例选项计算）
+                    graph.set_source('fixed_ratio_axis', axis_scale_option == "固定比例（x:0.0055/格, y:0.01/格）")
+                    axis_ranges = graph.get('axis_ranges')
+
+                    if axis_ranges is not None:
+                        x_range, y_range = axis_ranges
+
+                        # 手动调整（原有逻辑保留）
+                        if st.checkbox("手动调整范围", value=False, key="manual_range_checkbox", on_change=update_chart):
+                            col1, col2 = st.columns(2)
+                            with col1:
+                                x_min_custom = st.number_input("X轴最小值", value=round(x_range[0], 4), step=0.0001,
+                                                               format="%.4f", key="scatter_x_min")
+                                x_max_custom = st.number_input("X轴最大值", value=round(x_range[1], 4), step=0.0001,
+                                                               format="%.4f", key="scatter_x_max")
+                            with col2:
+                                y_min_custom = st.number_input("Y轴最小值", value=round(y_range[0], 4), step=0.0001,
+                                                               format="%.4f", key="scatter_y_min")
+                                y_max_custom = st.number_input("Y轴最大值", value=round(y_range[1], 4), step=0.0001,
+                                                               format="%.4f", key="scatter_y_max")
+                            x_range = [x_min_custom, x_max_custom]
+                            y_range = [y_min_custom, y_max_custom]
                     else:
-                        st.info("没有足够的数据生成统计信息")
-
-                    st.markdown("### 使用说明")
-                    st.markdown("- 鼠标悬停：查看点的详细数值")
-                    st.markdown("- 滚轮：缩放图表")
-                    st.markdown("- 拖动：平移图表")
-                    st.markdown("- 框选：局部放大")
-                    st.markdown("- 双击：重置视图")
-                    st.markdown("- 点击图例：显示/隐藏特定材料或色区")
-                    st.markdown("- 右键点击：下载图表为PNG/SVG")
-
-            # 2. 色区详细统计选项卡
-            with tab2:
-                st.header("色区详细统计")
-
-                # 添加统计依据选择
-                st.subheader("统计设置")
-                statistic_basis = st.radio(
-                    "选择统计依据:",
-                    ["原始数据", "移动后数据"],
-                    index=0 if st.session_state.statistic_basis == "original" else 1,
-                    key="statistic_basis_radio"
-                )
-                st.session_state.statistic_basis = "original" if statistic_basis == "原始数据" else "moved"
-                use_original_coords = (st.session_state.statistic_basis == "original")
-
-                # 生成色区统计
-                if st.button("生成色区详细统计", key="generate_zone_stats"):
-                    with st.spinner(f"正在计算{'原始' if use_original_coords else '移动后'}数据的色区统计..."):
-                        # 重新计算图表以获取最新的偏移值
-                        _, _, offsets = generate_interactive_cie_plot_with_zones(
-                            st.session_state.dataframes,
-                            selected_bin_codes,
-                            st.session_state.colors,
-                            "",  # 标题不重要
-                            800, 400,  # 尺寸不重要
-                            6, 0.8,  # 点大小和透明度不重要
-                            "ciex", "ciey", True,  # 轴标签和网格不重要
-                            [0, 1], [0, 1],  # 范围不重要
-                            selected_zones,
-                            color_zones,
-                            st.session_state.move_center,
-                            (st.session_state.target_center_x, st.session_state.target_center_y)
-                        )
-
-                        zone_stats, points_with_zones = calculate_zone_statistics(
-                            st.session_state.dataframes,
-                            selected_bin_codes,
-                            selected_zones,
-                            color_zones,
-                            st.session_state.move_center,
-                            offsets,
-                            use_original_coords  # 传递选择的统计依据
-                        )
+                        st.warning("没有足够的数据来计算坐标轴范围")
+                        x_range = [0, 0.044]  # 固定比例默认范围
+                        y_range = [0, 0.05]
+
+                    # 2. 新增：斜率分析设置（在“色区选择”前插入）
+                    st.subheader("斜率分析设置")
+                    show_slope_analysis = st.checkbox("显示理想斜率线", value=False, key="show_slope_analysis",
+                                                      on_change=update_chart)
+                    slope_line_info = None  # 存储斜率线信息（方程+坐标）
+
+                    if show_slope_analysis:
+                        # 理想中心点设置（默认0.2771, 0.26）
+                        st.markdown("#### 理想中心点")
+                        col1, col2 = st.columns(2)
+                        with col1:
+                            slope_center_x = st.number_input(
+                                "X坐标", value=0.2771, step=0.0001, format="%.4f", key="slope_center_x"
+                            )
+                        with col2:
+                            slope_center_y = st.number_input(
+                                "Y坐标", value=0.26, step=0.0001, format="%.4f", key="slope_center_y"
+                            )
+                        slope_center = (slope_center_x, slope_center_y)
+
+                        # 找到包含中心点的色区
+                        zone_name, zone_coords = find_zone_containing_point(slope_center, color_zones)
+                        if zone_name and zone_coords:
+                            st.success(f"找到包含中心点的色区：{zone_name}")
+                            # 计算色区的正斜率
+                            positive_slope = get_zone_geometry(color_zones).positive_slope(zone_name)
+                            if positive_slope:
+                                st.info(f"色区正斜率：{positive_slope:.4f}")
+                                # 计算直线方程和坐标
+                                slope_line_info = get_slope_line_params(slope_center, positive_slope)
+                            else:
+                                st.warning("该色区无正斜率边，请选择其他包含中心点的色区")
+                        else:
+                            st.warning("理想中心点不在任何色区内，请调整中心点坐标")
 
-                        # 显示统计结果
-                        st.subheader(f"色区落Bin率统计（基于{statistic_basis}）")
 
-                        # 总占比色区选择
-                        st.subheader("总占比统计设置")
-                        # 过滤出当前色区预设中存在的默认总占比色区
+                    # 色区选择（默认值为当前预设中存在的已选色区，没有时选择所有色区）
+                    st.subheader("色区选择")
+                    selected_zones = st.multiselect(
+                        "选择要显示的色区:",
+                        list(color_zones.keys()),
+                        default=selected_zones,
+                        on_change=update_chart
+                    )
+                    st.session_state.selected_zones = selected_zones
+                    graph.set_source('selected_zones', selected_zones)
+
+                    # 绘制CIE散点图
+                    st.subheader("CIE色区分布图")
+                    with st.spinner("正在生成图表..."):
+                        start_time = time.time()
+                        graph.set_source('figure_settings', {
+                            'width': fig_width, 'height': fig_height, 'point_size': point_size, 'alpha': alpha,
+                            'x_label': x_label, 'y_label': y_label, 'show_grid': show_grid
+                        })
+                        graph.set_source('figure_title', title)
+                        graph.set_source('plot_ranges', (tuple(x_range), tuple(y_range)))
+                        graph.set_source('slope_line', slope_line_info if show_slope_analysis else None)
+                        fig = graph.get('cie_figure')
+                        stats_df = graph.get('center_stats_table')
+                        offsets = graph.get('offsets')
+                        plot_time = time.time() - start_time
+
+                        # 显示图表和统计数据
                         # 修改后
-                        if st.session_state.color_zone_preset == "CSP":
-                            # CSP类型：根据子类型自动选择默认色区
-                            sub_type = st.session_state.csp_sub_type
-                            if sub_type == "M":
-                                # 一次模压：默认所有带_M后缀的色区
-                                valid_default_zones = [zone for zone in color_zones.keys() if zone.endswith("_M")]
-                            else:  # C
-                                # 无水切割：默认所有带_C后缀的色区
-                                valid_default_zones = [zone for zone in color_zones.keys() if zone.endswith("_C")]
+                        # 获取所有上传的文件名（去除扩展名）
+                        file_names = [os.path.splitext(name)[0] for name in st.session_state.dataframes.keys()]
+                        # 拼接文件名（最多显示3个，避免过长）
+                        combined_name = "_".join(file_names[:3]) + ("..." if len(file_names) > 3 else "")
+                        # 配置下载文件名
+                        config = {
+                            'toImageButtonOptions': {
+                                'filename': f"CIE色点分布图_{combined_name}",
+                                'format': 'png',  # 可选项：'png'、'svg'、'jpeg'、'webp'
+                                'height': fig_height,
+                                'width': fig_width,
+                                'scale': 2  # 分辨率缩放
+                            }
+                        }
+                        st.plotly_chart(fig, config=config, use_container_width=True)
+
+
+                        # 显示统计数据
+                        st.subheader("基本统计数据")
+                        if not stats_df.empty:
+                            # 显示补偿系数（如果启用了中心点移动）
+                            if move_center and offsets != (0, 0):
+                                st.info(f"应用的补偿系数: X偏移 = {offsets[0]:.6f}, Y偏移 = {offsets[1]:.6f}")
+                            st.dataframe(stats_df.round(4))
+
+                            # 稳健统计（受异常点影响小）
+                            if st.checkbox("显示稳健统计（中位数/MAD/截尾均值）", value=False, key="show_robust_stats"):
+                                robust_trim = st.slider("截尾比例（每侧）", 0.0, 0.25, 0.1, step=0.01,
+                                                        key="robust_trim_ratio")
+                                graph.set_source('robust_trim', robust_trim)
+                                st.dataframe(graph.get('robust_stats_table').round(4))
                         else:
-                            # NCSP类型：保持原有逻辑
-                            valid_default_zones = [zone for zone in st.session_state.selected_total_zones if
-                                                   zone in color_zones]
-                        selected_total_zones = st.multiselect(
-                            "选择要计算总占比的色区组合:",
+                            st.info("没有足够的数据生成统计信息")
+
+                        # 各色区、各bin_code的拟合斜率与色区边斜率对比
+                        st.subheader("分组斜率与色区边斜率对比")
+                        if st.checkbox("按色区和bin_code拟合斜率（所有文件合并）", value=False,
+                                       key="show_grouped_slopes"):
+                            col1, col2 = st.columns(2)
+                            with col1:
+                                grouped_slope_method = st.radio("拟合方法", ["正交回归(TLS)", "最小二乘(OLS)"],
+                                                                key="grouped_slope_method", horizontal=True)
+                            with col2:
+                                angle_tolerance = st.number_input("角度偏差阈值(°)", value=5.0, min_value=0.1,
+                                                                  step=0.5, key="grouped_slope_tolerance")
+                            graph.set_source('grouped_slope_settings', {
+                                'method': "tls" if grouped_slope_method == "正交回归(TLS)" else "ols",
+                                'angle_tolerance': angle_tolerance
+                            })
+                            slope_table = graph.get('grouped_slope_table')
+                            if slope_table.empty:
+                                st.info("所选色区内没有足够的数据点进行斜率拟合")
+                            else:
+                                drifting = slope_table[slope_table['偏离色区边方向'] & (slope_table['bin_code'] != '全部')]
+                                if not drifting.empty:
+                                    st.warning(f"{len(drifting)} 个色区/bin_code组合的拟合方向偏离色区边超过 "
+                                               f"{angle_tolerance:.1f}°")
+                                st.dataframe(slope_table.round(4))
+
+                        st.markdown("### 使用说明")
+                        st.markdown("- 鼠标悬停：查看点的详细数值")
+                        st.markdown("- 滚轮：缩放图表")
+                        st.markdown("- 拖动：平移图表")
+                        st.markdown("- 框选：局部放大")
+                        st.markdown("- 双击：重置视图")
+                        st.markdown("- 点击图例：显示/隐藏特定材料或色区")
+                        st.markdown("- 右键点击：下载图表为PNG/SVG")
+
+            # 2. 色区详细统计选项卡
+            if tab_is_open(tab2):
+                with tab2:
+                    st.header("色区详细统计")
+
+                    # 添加统计依据选择
+                    st.subheader("统计设置")
+                    statistic_basis = st.radio(
+                        "选择统计依据:",
+                        ["原始数据", "移动后数据"],
+                        index=0 if st.session_state.statistic_basis == "original" else 1,
+                        key="statistic_basis_radio"
+                    )
+                    st.session_state.statistic_basis = "original" if statistic_basis == "原始数据" else "moved"
+                    use_original_coords = (st.session_state.statistic_basis == "original")
+                    graph.set_source('statistic_basis', st.session_state.statistic_basis)
+
+                    statistic_method = st.radio(
+                        "选择统计方式:",
+                        ["逐点精确统计", "直方图快速统计（大批量数据）"],
+                        key="statistic_method_radio",
+                        help="直方图模式按仪器分辨率(0.0001)分箱统计，不生成逐点色区数据，适合数百万点的批次"
+                    )
+                    use_histogram_stats = statistic_method != "逐点精确统计"
+                    if use_histogram_stats:
+                        histogram_exact_boundary = st.checkbox("色区边界单元格逐点精确修正", value=True,
+                                                               key="histogram_exact_boundary")
+                    col1, col2 = st.columns(2)
+                    with col1:
+                        regression_group = st.radio("线性回归分组:", ["按文件", "按文件和bin_code", "按文件和色区"],
+                                                    key="regression_group_radio", horizontal=True)
+                    with col2:
+                        regression_method = st.radio("回归方法:", ["最小二乘(OLS)", "正交回归(TLS)"],
+                                                     key="regression_method_radio", horizontal=True,
+                                                     help="正交回归同时考虑x、y两个方向的误差，更适合描述色坐标漂移方向")
+                    zone_stats_layout = st.radio("统计结果显示方式:", ["按文件分别显示", "多文件合并显示"],
+                                                 key="zone_stats_layout", horizontal=True,
+                                                 help="合并显示时所有文件使用一张表格和一张分组柱状图")
+                    graph.set_source('histogram_mode', {
+                        'enabled': use_histogram_stats,
+                        'exact_boundary': use_histogram_stats and histogram_exact_boundary
+                    })
+
+                    # 最优中心点偏移搜索
+                    with st.expander("最优中心点偏移搜索", expanded=False):
+                        st.markdown("在当前目标中心点附近搜索使所选色区总落入率最大的偏移量")
+                        optimizer_zones = st.multiselect(
+                            "优化目标色区组合:",
                             list(color_zones.keys()),
-                            default=valid_default_zones,
-                            key="total_zones_selector"
+                            default=get_default_total_zones(
+                                color_zones, st.session_state.color_zone_preset, st.session_state.csp_sub_type,
+                                st.session_state.selected_total_zones
+                            ),
+                            key="optimizer_zones_selector"
                         )
-                        st.session_state.selected_total_zones = selected_total_zones
-
-                        # 创建统计表格
-                        for file_name, stats in zone_stats.items():
-                            st.subheader(f"文件: {file_name}")
-                            st.text(f"总点数: {stats['total_points']}")
-
-                            # 创建数据框显示统计结果
-                            stats_data = []
-                            for zone_name, zone_stats in stats['zones'].items():
-                                stats_data.append({
-                                    '色区': zone_name,
-                                    '点数': zone_stats['count'],
-                                    '占比(%)': round(zone_stats['percentage'], 2)
-                                })
-
-                            stats_df = pd.DataFrame(stats_data)
-                            st.dataframe(stats_df)
-
-                            # 原“生成色区详细统计”按钮及相关逻辑删除，替换为以下代码：
-                            st.subheader(f"文件: {file_name}")
-                            st.text(f"总点数: {stats['total_points']}")
-
-                            # 生成对应图表
-                            stats_data = []
-                            for zone_name, zone_stats in stats['zones'].items():
-                                stats_data.append({
-                                    '色区': zone_name,
-                                    '点数': zone_stats['count'],
-                                    '占比(%)': round(zone_stats['percentage'], 2)
-                                })
-                            stats_df = pd.DataFrame(stats_data)
-                            st.dataframe(stats_df)
-
-                            # 生成柱状图（默认）
-                            stats_data = []
-                            for zone_name, zone_stats in stats['zones'].items():
-                                stats_data.append({
-                                    '色区': zone_name,
-                                    '点数': zone_stats['count'],
-                                    '占比(%)': round(zone_stats['percentage'], 2)
-                                })
-                            stats_df = pd.DataFrame(stats_data)
-                            st.dataframe(stats_df)
-
-                            # 直接生成柱状图
-                            fig = px.bar(
-                                stats_df,
-                                x='色区',
-                                y='占比(%)',
-                                title=f'{file_name} 各色区占比（基于{statistic_basis}）',
-                                text='占比(%)',
-                                color='色区',
-                                color_discrete_sequence=color_list,
-                                hover_data=['点数', '占比(%)']
-                            )
-                            fig.update_traces(
-                                hovertemplate='色区: %{x}<br>数量: %{customdata[0]}<br>占比: %{customdata[1]:.2f}%<extra></extra>'
-                            )
-                            fig.update_layout(
-                                yaxis=dict(title='占比(%)', range=[0, 100]),
-                                showlegend=False
-                            )
-                            st.plotly_chart(fig, use_container_width=True)
+                        col1, col2 = st.columns(2)
+                        with col1:
+                            optimizer_mode = st.radio("优化方式", ["所有文件合并", "逐文件"], key="optimizer_mode",
+                                                      horizontal=True)
+                        with col2:
+                            search_radius = st.number_input("搜索半径", value=0.01, min_value=0.0005, step=0.001,
+                                                            format="%.4f", key="optimizer_search_radius")
 
+                        if st.button("搜索最优偏移", key="run_offset_optimizer"):
+                            if not optimizer_zones:
+                                st.warning("请至少选择一个目标色区")
+                            else:
+                                with st.spinner("正在搜索最优偏移..."):
+                                    start_time = time.time()
+                                    st.session_state.offset_optimization = optimize_center_offsets(
+                                        st.session_state.dataframes,
+                                        selected_bin_codes,
+                                        color_zones,
+                                        optimizer_zones,
+                                        (st.session_state.target_center_x, st.session_state.target_center_y),
+                                        pooled=(optimizer_mode == "所有文件合并"),
+                                        search_radius=search_radius
+                                    )
+                                    st.success(f"搜索完成，耗时 {time.time() - start_time:.2f} 秒")
+
+                        optimization_result = st.session_state.get('offset_optimization')
+                        if optimization_result is not None and not optimization_result.empty:
+                            st.dataframe(optimization_result.round(6))
+                            if len(optimization_result) == 1:
+                                st.button("应用最优目标中心点", key="apply_optimized_center",
+                                          on_click=apply_optimized_center)
+                            else:
+                                st.info("逐文件结果仅供参考，中心点移动对所有文件使用同一偏移，请使用合并方式后应用")
 
-                            # 计算并显示总占比
-                            if selected_total_zones and stats['total_points'] > 0:
-                                total_count = 0
-                                for zone in selected_total_zones:
-                                    if zone in stats['zones']:
-                                        total_count += stats['zones'][zone]['count']
-
-                                total_percentage = round((total_count / stats['total_points']) * 100, 2)
-
-                                st.subheader(f"所选色区总占比统计（基于{statistic_basis}）")
-                                total_stats_df = pd.DataFrame([{
-                                    '所选色区': ', '.join(selected_total_zones),
-                                    '总点数': total_count,
-                                    '总占比(%)': total_percentage
-                                }])
-                                st.dataframe(total_stats_df)
-
-                                # 创建总占比可视化
-                                fig_total = px.pie(
-                                    names=['所选色区总和', '其他'],
-                                    values=[total_percentage, 100 - total_percentage],
-                                    title=f'{file_name} 所选色区总占比（基于{statistic_basis}）',
-                                    color_discrete_sequence=['#2ca02c', '#d62728']
-                                )
-                                fig_total.update_traces(textinfo='label+percent')
-                                st.plotly_chart(fig_total, use_container_width=True)
-
-                        # 显示带有色区信息的数据样本
-                        st.subheader(f"色区数据样本（基于{statistic_basis}）")
-                        if not points_with_zones.empty:
-                            st.dataframe(
-                                points_with_zones[
-                                    ['文件名', 'PosX_Map' if 'PosX_Map' in points_with_zones.columns else 'pos_x',
-                                     'PosY_Map' if 'PosY_Map' in points_with_zones.columns else 'pos_y',
-                                     'ciex', 'ciey', 'bin_code', '所属色区']].head(
-                                    100))
-                        else:
-                            st.info("没有数据可显示")
-
-                        # 计算并显示线性回归分析
-                        st.subheader(f"CIE色坐标线性回归分析（基于{statistic_basis}）")
-                        regression_results = calculate_linear_regression(
-                            st.session_state.dataframes,
-                            selected_bin_codes,
-                            st.session_state.move_center,
-                            offsets
+                    # 落入率-偏移响应面
+                    with st.expander("落入率-偏移响应面", expanded=False):
+                        st.markdown("显示当前目标中心点附近不同偏移下所选色区的总落入率（所有文件合并）")
+                        surface_zones = st.multiselect(
+                            "统计色区组合:",
+                            list(color_zones.keys()),
+                            default=get_default_total_zones(
+                                color_zones, st.session_state.color_zone_preset, st.session_state.csp_sub_type,
+                                st.session_state.selected_total_zones
+                            ),
+                            key="surface_zones_selector"
                         )
+                        col1, col2 = st.columns(2)
+                        with col1:
+                            surface_radius = st.number_input("偏移范围 (±)", value=0.005, min_value=0.0005,
+                                                             max_value=0.05, step=0.001, format="%.4f",
+                                                             key="surface_radius")
+                        with col2:
+                            surface_resolution = st.selectbox("偏移步长", [0.0001, 0.0002, 0.0005], index=0,
+                                                              format_func=lambda v: f"{v:.4f}",
+                                                              key="surface_resolution")
 
-                        if regression_results:
-                            for file_name, results in regression_results.items():
-                                st.markdown(f"#### {file_name} 的线性回归结果")
-                                results_df = pd.DataFrame([results])
-                                st.dataframe(results_df.round(6))
-
-                                # 可视化线性回归结果
-                                filtered_df = st.session_state.dataframes[file_name]
-                                filtered_df = filtered_df[filtered_df['bin_code'].isin(selected_bin_codes)]
-
-                                if not filtered_df.empty:
-                                    # 应用中心点移动（如果启用）
-                                    if st.session_state.move_center and not use_original_coords:
-                                        x = filtered_df['ciex'] + offsets[0]
-                                        y = filtered_df['ciey'] + offsets[1]
-                                    else:
-                                        x = filtered_df['ciex']
-                                        y = filtered_df['ciey']
-
-                                    # 创建散点图和回归线
-                                    fig = px.scatter(
-                                        x=x,
-                                        y=y,
-                                        title=f'{file_name} 的CIE色坐标线性回归（基于{statistic_basis}）',
-                                        labels={'x': 'ciex', 'y': 'ciey'},
-                                        color_discrete_sequence=[st.session_state.colors[file_name]]
+                        if st.button("生成响应面", key="generate_yield_surface"):
+                            if not surface_zones:
+                                st.warning("请至少选择一个色区")
+                            else:
+                                with st.spinner("正在计算响应面..."):
+                                    frames = [df[df['bin_code'].isin(selected_bin_codes)]
+                                              for df in st.session_state.dataframes.values()]
+                                    pooled_ciex = np.concatenate([f['ciex'].to_numpy(dtype=float) for f in frames])
+                                    pooled_ciey = np.concatenate([f['ciey'].to_numpy(dtype=float) for f in frames])
+                                    current_offsets = graph.get('offsets')
+                                    offsets_x, offsets_y, yield_surface = calculate_yield_response_surface(
+                                        pooled_ciex, pooled_ciey, color_zones, surface_zones, current_offsets,
+                                        surface_radius, surface_resolution
                                     )
 
-                                    # 添加回归线
-                                    slope = results['斜率']
-                                    intercept = results['截距']
-                                    x_range_reg = [x.min(), x.max()]
-                                    y_range_reg = [slope * x_range_reg[0] + intercept,
-                                                   slope * x_range_reg[1] + intercept]
-
-                                    fig.add_trace(
-                                        go.Scatter(
-                                            x=x_range_reg,
-                                            y=y_range_reg,
-                                            mode='lines',
-                                            line=dict(color='red', width=2),
-                                            name=f'回归线 (y = {slope:.6f}x + {intercept:.6f})'
-                                        )
+                                if len(pooled_ciex) == 0:
+                                    st.info("没有数据可显示")
+                                else:
+                                    best_j, best_i = np.unravel_index(np.argmax(yield_surface), yield_surface.shape)
+                                    fig = go.Figure(go.Heatmap(
+                                        x=offsets_x,
+                                        y=offsets_y,
+                                        z=yield_surface,
+                                        colorscale='Viridis',
+                                        colorbar=dict(title='落入率(%)'),
+                                        hovertemplate='X偏移: %{x:.4f}<br>Y偏移: %{y:.4f}<br>落入率: %{z:.2f}%<extra></extra>'
+                                    ))
+                                    fig.add_trace(go.Scatter(
+                                        x=[current_offsets[0]], y=[current_offsets[1]], mode='markers',
+                                        marker=dict(size=12, color='white', symbol='x', line=dict(width=2, color='black')),
+                                        name='当前偏移'
+                                    ))
+                                    fig.add_trace(go.Scatter(
+                                        x=[offsets_x[best_i]], y=[offsets_y[best_j]], mode='markers',
+                                        marker=dict(size=14, color='red', symbol='star', line=dict(width=1, color='black')),
+                                        name='最大落入率'
+                                    ))
+                                    fig.update_layout(
+                                        title=f"所选色区总落入率响应面（最大 {yield_surface.max():.2f}%）",
+                                        xaxis_title='X偏移',
+                                        yaxis_title='Y偏移',
+                                        height=600
                                     )
-
                                     st.plotly_chart(fig, use_container_width=True)
-                        else:
-                            st.info("数据点不足，无法进行线性回归分析")
 
-            # 3. 产出分布统计选项卡
-            with tab3:
-                st.header("产出分布统计")
-                st.info(f"该统计基于{statistic_basis}的色区判断结果")
-
-                # 重置计算状态的按钮
-                if st.button("重置产出分布统计", key="reset_production_stats"):
-                    st.session_state.production_data = None
-                    st.session_state.production_calculated = False
-                    st.success("已重置产出分布统计数据")
-
-                # 生成产出分布统计
-                if st.button("生成产出分布统计",
-                             key="generate_production_stats") or st.session_state.production_calculated:
-                    # 如果数据已计算且不是首次点击，则直接使用缓存数据
-                    if not st.session_state.production_calculated or st.session_state.production_data is None:
-                        with st.spinner(f"正在计算产出分布统计..."):
-                            # 重新计算图表以获取最新的偏移值
-                            _, _, offsets = generate_interactive_cie_plot_with_zones(
-                                st.session_state.dataframes,
-                                selected_bin_codes,
-                                st.session_state.colors,
-                                "",  # 标题不重要
-                                800, 400,  # 尺寸不重要
-                                6, 0.8,  # 点大小和透明度不重要
-                                "ciex", "ciey", True,  # 轴标签和网格不重要
-                                [0, 1], [0, 1],  # 范围不重要
-                                selected_zones,
-                                color_zones,
-                                st.session_state.move_center,
-                                (st.session_state.target_center_x, st.session_state.target_center_y)
+                    # 生成色区统计
+                    if st.button("生成色区详细统计", key="generate_zone_stats") or st.session_state.get(
+                            'zone_stats_calculated', False):
+                        st.session_state.zone_stats_calculated = True
+                        with st.spinner(f"正在计算{'原始' if use_original_coords else '移动后'}数据的色区统计..."):
+                            # 获取最新的偏移值（只依赖各文件中心点，无需重新生成图表）
+                            offsets = graph.get('offsets')
+                            # 统计依据、统计方式或输入数据未变化时直接复用上次的统计结果
+                            zone_stats, points_with_zones = graph.get('zone_statistics')
+
+                            # 显示统计结果
+                            st.subheader(f"色区落Bin率统计（基于{statistic_basis}）")
+
+                            # 总占比色区选择
+                            st.subheader("总占比统计设置")
+                            # 过滤出当前色区预设中存在的默认总占比色区
+                            valid_default_zones = get_default_total_zones(
+                                color_zones, st.session_state.color_zone_preset, st.session_state.csp_sub_type,
+                                st.session_state.selected_total_zones
                             )
-
-                            # 获取色区统计依据
-                            use_original_coords = (st.session_state.statistic_basis == "original")
-
-                            # 计算产出分布统计
-                            production_data = calculate_production_statistics(
-                                st.session_state.dataframes,
-                                selected_bin_codes,
-                                color_zones,
-                                st.session_state.move_center,
-                                offsets,
-                                use_original_coords
+                            selected_total_zones = st.multiselect(
+                                "选择要计算总占比的色区组合:",
+                                list(color_zones.keys()),
+                                default=valid_default_zones,
+                                key="total_zones_selector"
                             )
+                            st.session_state.selected_total_zones = selected_total_zones
+
+                            # 各文件的统计结果只整理一次：一张长表，按显示方式生成表格和图表
+                            zone_summary = build_zone_summary_table(zone_stats)
+                            zone_totals = build_zone_total_table(zone_stats, selected_total_zones)
+
+                            if zone_stats_layout == "多文件合并显示":
+                                # 合并表格：每个色区一行，各文件的点数/占比为列
+                                count_table = zone_summary.pivot(index='色区', columns='文件名', values='点数')
+                                percent_table = zone_summary.pivot(index='色区', columns='文件名', values='占比(%)')
+                                combined_df = pd.concat({
+                                    f"{file_name} {label}": table[file_name]
+                                    for file_name in zone_stats
+                                    for label, table in (('点数', count_table), ('占比(%)', percent_table))
+                                }, axis=1).reindex(zone_summary['色区'].drop_duplicates())
+                                st.dataframe(combined_df)
+
+                                # 分组柱状图
+                                fig = px.bar(
+                                    zone_summary,
+                                    x='色区',
+                                    y='占比(%)',
+                                    color='文件名',
+                                    barmode='group',
+                                    title=f'各文件色区占比（基于{statistic_basis}）',
+                                    color_discrete_map=st.session_state.colors,
+                                    hover_data=['点数', '占比(%)']
+                                )
+                                fig.update_layout(yaxis=dict(title='占比(%)', range=[0, 100]))
+                                st.plotly_chart(fig, use_container_width=True)
 
-                            # 存储计算结果到会话状态
-                            st.session_state.production_data = production_data
-                            st.session_state.production_calculated = True
-                    else:
-                        production_data = st.session_state.production_data
-
-                    if production_data.empty:
-                        st.warning("没有足够的数据生成产出分布统计")
-                        return
-
-                    # 按文件分别统计
-                    for file_idx, file_name in enumerate(st.session_state.dataframes.keys()):
-                        st.subheader(f"文件: {file_name}")
-                        file_data = production_data[production_data['文件名'] == file_name]
-                        total_points = len(file_data)
-                        st.text(f"总样本数: {total_points}")
-
-                        if total_points == 0:
-                            st.info("该文件没有符合筛选条件的数据")
-                            continue
-
-                        # 1. 峰值波长分布
-                        st.subheader("1. 峰值波长分布")
-                        wavelength_config = PRODUCTION_BINS["Wavelength"]
-
-                        # 统计数据
-                        wavelength_counts = file_data['Wavelength_Bin'].value_counts().reindex(
-                            wavelength_config['order'], fill_value=0
-                        )
-                        wavelength_percent = [round((count / total_points * 100), 2) for count in
-                                              wavelength_counts.values]
-
-                        # 创建数据框
-                        wavelength_stats = pd.DataFrame({
-                            'Bin区': wavelength_counts.index,
-                            f'范围({wavelength_config["units"]})': [
-                                f"{wavelength_config['bins'][bin][0]}-{wavelength_config['bins'][bin][1]}"
-                                for bin in wavelength_counts.index
-                            ],
-                            '数量': wavelength_counts.values,
-                            '占比(%)': wavelength_percent
-                        })
-                        st.dataframe(wavelength_stats)
-
-                        # 创建可视化图表
-                        fig = px.bar(
-                            wavelength_stats,
-                            x='Bin区',
-                            y='占比(%)',
-                            title=f'{file_name} 峰值波长分布',
-                            color='Bin区',
-                            color_discrete_sequence=color_list[:len(wavelength_config['order'])],
-                            hover_data=['数量', '占比(%)', f'范围({wavelength_config["units"]})']
-                        )
-                        fig.update_traces(
-                            hovertemplate='Bin区: %{x}<br>范围: %{customdata[2]}<br>数量: %{customdata[0]}<br>占比: %{customdata[1]:.2f}%<extra></extra>'
-                        )
-                        fig.update_layout(
-                            yaxis=dict(title='占比(%)', range=[0, 100]),
-                            showlegend=False
-                        )
-                        st.plotly_chart(fig, use_container_width=True)
-
-                        # 2. 亮度分布
-                        st.subheader("2. 亮度分布")
-                        brightness_config = PRODUCTION_BINS["Brightness"]
+                                if selected_total_zones:
+                                    st.subheader(f"所选色区总占比统计（基于{statistic_basis}）")
+                                    st.dataframe(zone_totals)
+                            else:
+                                for file_name, stats in zone_stats.items():
+                                    st.subheader(f"文件: {file_name}")
+                                    st.text(f"总点数: {stats['total_points']}")
+
+                                    stats_df = zone_summary[zone_summary['文件名'] == file_name].drop(columns='文件名')
+                                    st.dataframe(stats_df.reset_index(drop=True))
+
+                                    # 直接生成柱状图
+                                    fig = px.bar(
+                                        stats_df,
+                                        x='色区',
+                                        y='占比(%)',
+                                        title=f'{file_name} 各色区占比（基于{statistic_basis}）',
+                                        text='占比(%)',
+                                        color='色区',
+                                        color_discrete_sequence=color_list,
+                                        hover_data=['点数', '占比(%)']
+                                    )
+                                    fig.update_traces(
+                                        hovertemplate='色区: %{x}<br>数量: %{customdata[0]}<br>占比: %{customdata[1]:.2f}%<extra></extra>'
+                                    )
+                                    fig.update_layout(
+                                        yaxis=dict(title='占比(%)', range=[0, 100]),
+                                        showlegend=False
+                                    )
+                                    st.plotly_chart(fig, use_container_width=True)
 
-                        # 统计数据
-                        brightness_counts = file_data['Brightness_Bin'].value_counts().reindex(
-                            brightness_config['order'], fill_value=0
-                        )
-                        brightness_percent = [round((count / total_points * 100), 2) for count in
-                                              brightness_counts.values]
-
-                        # 创建数据框
-                        brightness_stats = pd.DataFrame({
-                            'Bin区': brightness_counts.index,
-                            f'范围({brightness_config["units"]})': [
-                                f"{brightness_config['bins'][bin][0]}-{brightness_config['bins'][bin][1]}"
-                                for bin in brightness_counts.index
-                            ],
-                            '数量': brightness_counts.values,
-                            '占比(%)': brightness_percent
-                        })
-                        st.dataframe(brightness_stats)
-
-                        # 创建可视化图表
-                        fig = px.bar(
-                            brightness_stats,
-                            x='Bin区',
-                            y='占比(%)',
-                            title=f'{file_name} 亮度分布',
-                            color='Bin区',
-                            color_discrete_sequence=color_list[:len(brightness_config['order'])],
-                            hover_data=['数量', '占比(%)', f'范围({brightness_config["units"]})']
-                        )
-                        fig.update_traces(
-                            hovertemplate='Bin区: %{x}<br>范围: %{customdata[2]}<br>数量: %{customdata[0]}<br>占比: %{customdata[1]:.2f}%<extra></extra>'
-                        )
-                        fig.update_layout(
-                            yaxis=dict(title='占比(%)', range=[0, 100]),
-                            showlegend=False
-                        )
-                        st.plotly_chart(fig, use_container_width=True)
+                                    # 显示总占比
+                                    if selected_total_zones and stats['total_points'] > 0:
+                                        total_row = zone_totals[zone_totals['文件名'] == file_name].iloc[0]
+                                        total_percentage = total_row['总占比(%)']
 
-                        # 3. 电压分布
-                        st.subheader("3. 电压分布")
-                        voltage_config = PRODUCTION_BINS["Voltage"]
+                                        st.subheader(f"所选色区总占比统计（基于{statistic_basis}）")
+                                        st.dataframe(pd.DataFrame([total_row.drop('文件名')]).reset_index(drop=True))
 
-                        # 统计数据
-                        voltage_counts = file_data['Voltage_Bin'].value_counts().reindex(
-                            voltage_config['order'], fill_value=0
-                        )
-                        voltage_percent = [round((count / total_points * 100), 2) for count in voltage_counts.values]
-
-                        # 创建数据框
-                        voltage_stats = pd.DataFrame({
-                            'Bin区': voltage_counts.index,
-                            f'范围({voltage_config["units"]})': [
-                                f"{voltage_config['bins'][bin][0]}-{voltage_config['bins'][bin][1]}"
-                                for bin in voltage_counts.index
-                            ],
-                            '数量': voltage_counts.values,
-                            '占比(%)': voltage_percent
-                        })
-                        st.dataframe(voltage_stats)
-
-                        # 创建可视化图表
-                        fig = px.bar(
-                            voltage_stats,
-                            x='Bin区',
-                            y='占比(%)',
-                            title=f'{file_name} 电压分布',
-                            color='Bin区',
-                            color_discrete_sequence=color_list[:len(voltage_config['order'])],
-                            hover_data=['数量', '占比(%)', f'范围({voltage_config["units"]})']
-                        )
-                        fig.update_traces(
-                            hovertemplate='Bin区: %{x}<br>范围: %{customdata[2]}<br>数量: %{customdata[0]}<br>占比: %{customdata[1]:.2f}%<extra></extra>'
-                        )
-                        fig.update_layout(
-                            yaxis=dict(title='占比(%)', range=[0, 100]),
-                            showlegend=False
-                        )
-                        st.plotly_chart(fig, use_container_width=True)
+                                        # 创建总占比可视化
+                                        fig_total = px.pie(
+                                            names=['所选色区总和', '其他'],
+                                            values=[total_percentage, 100 - total_percentage],
+                                            title=f'{file_name} 所选色区总占比（基于{statistic_basis}）',
+                                            color_discrete_sequence=['#2ca02c', '#d62728']
+                                        )
+                                        fig_total.update_traces(textinfo='label+percent')
+                                        st.plotly_chart(fig_total, use_container_width=True)
+
+                            # 显示带有色区信息的数据样本
+                            st.subheader(f"色区数据明细（基于{statistic_basis}）")
+                            if not points_with_zones.empty:
+                                render_paginated_table(
+                                    points_with_zones,
+                                    key="zone_sample_view",
+                                    columns=['文件名', 'PosX_Map' if 'PosX_Map' in points_with_zones.columns else 'pos_x',
+                                             'PosY_Map' if 'PosY_Map' in points_with_zones.columns else 'pos_y',
+                                             'ciex', 'ciey', 'bin_code', '所属色区']
+                                )
+                            elif use_histogram_stats:
+                                st.info("直方图统计模式不生成逐点色区数据")
+                            else:
+                                st.info("没有数据可显示")
+
+                            # 计算并显示线性回归分析
+                            st.subheader(f"CIE色坐标线性回归分析（基于{statistic_basis}）")
+                            regression_method_code = "tls" if regression_method == "正交回归(TLS)" else "ols"
+                            if regression_group == "按文件":
+                                regression_results = calculate_linear_regression(
+                                    st.session_state.dataframes,
+                                    selected_bin_codes,
+                                    st.session_state.move_center,
+                                    offsets,
+                                    method=regression_method_code
+                                )
+                            else:
+                                # 分组回归：所有分组一次计算，以汇总表显示
+                                grouped_regression = calculate_batched_regression(
+                                    st.session_state.dataframes,
+                                    selected_bin_codes,
+                                    st.session_state.move_center,
+                                    offsets,
+                                    group_by="bin_code" if regression_group == "按文件和bin_code" else "zone",
+                                    method=regression_method_code,
+                                    color_zones=color_zones,
+                                    zone_names=selected_zones
+                                )
+                                if not grouped_regression.empty:
+                                    st.dataframe(grouped_regression.round(6))
+                                else:
+                                    st.info("数据点不足，无法进行线性回归分析")
+                                regression_results = None
+
+                            if regression_results:
+                                for file_name, results in regression_results.items():
+                                    st.markdown(f"#### {file_name} 的线性回归结果")
+                                    results_df = pd.DataFrame([results])
+                                    st.dataframe(results_df.round(6))
+
+                                    # 可视化线性回归结果
+                                    filtered_df = st.session_state.dataframes[file_name]
+                                    filtered_df = filtered_df[filtered_df['bin_code'].isin(selected_bin_codes)]
+
+                                    if not filtered_df.empty:
+                                        # 应用中心点移动（如果启用）
+                                        if st.session_state.move_center and not use_original_coords:
+                                            x = filtered_df['ciex'] + offsets[0]
+                                            y = filtered_df['ciey'] + offsets[1]
+                                        else:
+                                            x = filtered_df['ciex']
+                                            y = filtered_df['ciey']
+
+                                        # 创建散点图和回归线
+                                        fig = px.scatter(
+                                            x=x,
+                                            y=y,
+                                            title=f'{file_name} 的CIE色坐标线性回归（基于{statistic_basis}）',
+                                            labels={'x': 'ciex', 'y': 'ciey'},
+                                            color_discrete_sequence=[st.session_state.colors[file_name]]
+                                        )
 
-                        # 4. 色区与参数的交叉分析
-                        st.subheader("4. 色区与参数的交叉分析")
+                                        # 添加回归线
+                                        slope = results['斜率']
+                                        intercept = results['截距']
+                                        x_range_reg = [x.min(), x.max()]
+                                        y_range_reg = [slope * x_range_reg[0] + intercept,
+                                                       slope * x_range_reg[1] + intercept]
+
+                                        fig.add_trace(
+                                            go.Scatter(
+                                                x=x_range_reg,
+                                                y=y_range_reg,
+                                                mode='lines',
+                                                line=dict(color='red', width=2),
+                                                name=f'回归线 (y = {slope:.6f}x + {intercept:.6f})'
+                                            )
+                                        )
 
-                        # 使用文件索引确保key的唯一性
-                        param_to_analyze = st.selectbox(
-                            "选择要与色区进行交叉分析的参数:",
-                            ["峰值波长", "亮度", "电压"],
-                            key=f"param_selector_{file_idx}_{file_name}"
-                        )
+                                        st.plotly_chart(fig, use_container_width=True)
+                            elif regression_results is not None:
+                                st.info("数据点不足，无法进行线性回归分析")
 
-                        # 映射参数到对应的列名
-                        param_mapping = {
-                            "峰值波长": "Wavelength_Bin",
-                            "亮度": "Brightness_Bin",
-                            "电压": "Voltage_Bin"
-                        }
-                        param_bin_column = param_mapping[param_to_analyze]
-
-                        # 获取参数配置
-                        if param_to_analyze == "峰值波长":
-                            param_config = PRODUCTION_BINS["Wavelength"]
-                        elif param_to_analyze == "亮度":
-                            param_config = PRODUCTION_BINS["Brightness"]
-                        else:  # 电压
-                            param_config = PRODUCTION_BINS["Voltage"]
-
-                        try:
-                            # 创建交叉表
-                            cross_df = pd.crosstab(
-                                file_data['所属色区'],
-                                file_data[param_bin_column],
-                                margins=True,
-                                margins_name='总计'
-                            )
+            # 3. 产出分布统计选项卡
+            if tab_is_open(tab3):
+                with tab3:
+                    st.header("产出分布统计")
+                    st.info(f"该统计基于{statistic_basis}的色区判断结果")
+
+                    # 导入参数Bin表（替换内置的峰值波长/亮度/电压分档）
+                    with st.expander("导入参数Bin表（CSV / JSON / Excel）", expanded=False):
+                        st.markdown("表格格式：每行一个Bin区，包含列 参数, 列名, Bin区, 下限, 上限，"
+                                    "可选列 名称, 单位, 产品类型；Bin区按 [下限, 上限) 划分，行顺序即显示顺序。"
+                                    "JSON格式与内置配置相同：{参数: {column, name, units, bins, order}}，"
+                                    "可外包一层 {产品类型: {...}}")
+                        bins_file = st.file_uploader("上传参数Bin表文件", type=["csv", "json", "xlsx", "xls"],
+                                                     key="production_bins_uploader")
+                        if bins_file is not None:
+                            bins_preset = load_production_bins_file(bins_file.getvalue(), bins_file.name)
+                            for error in bins_preset['errors']:
+                                st.error(error)
+                            for warning in bins_preset['warnings'][:20]:
+                                st.warning(warning)
+                            if not bins_preset['errors']:
+                                st.session_state.production_bins_config = bins_preset['presets']
+                                active_bins = get_production_bins(bins_preset['presets'],
+                                                                  st.session_state.product_type)
+                                graph.set_source('production_bins', active_bins)
+                                st.success(f"已导入参数Bin表：{', '.join(active_bins.keys())}")
+                        if st.session_state.get('production_bins_config') and st.button(
+                                "恢复内置参数Bin表", key="reset_production_bins"):
+                            st.session_state.production_bins_config = {}
+                            active_bins = PRODUCTION_BINS
+                            graph.set_source('production_bins', active_bins)
+
+                    # 重置计算状态的按钮
+                    if st.button("重置产出分布统计", key="reset_production_stats"):
+                        st.session_state.production_data = None
+                        st.session_state.dataflow_cache.pop('production_data', None)
+                        st.session_state.production_calculated = False
+                        st.success("已重置产出分布统计数据")
+
+                    # 生成产出分布统计
+                    if st.button("生成产出分布统计",
+                                 key="generate_production_stats") or st.session_state.production_calculated:
+                        # 数据流图按输入指纹缓存：筛选条件、中心点或统计依据变化时才重新计算
+                        with st.spinner(f"正在计算产出分布统计..."):
+                            production_data = graph.get('production_data')
+                            production_cubes = graph.get('production_cubes')
 
-                            # 按顺序重新排列列
-                            ordered_columns = param_config['order'] + ['总计']
-                            cross_df = cross_df.reindex(columns=ordered_columns, fill_value=0)
+                        # 存储计算结果到会话状态
+                        st.session_state.production_data = production_data
+                        st.session_state.production_calculated = True
 
-                            # 显示交叉表
-                            st.dataframe(cross_df)
+                        if production_data.empty:
+                            st.warning("没有足够的数据生成产出分布统计")
+                            return
 
-                            # 创建交叉分析热图（排除总计行和列）
-                            if len(cross_df) > 1 and len(cross_df.columns) > 1:
-                                heatmap_data = cross_df.drop('总计').drop(columns='总计')
+                        # 只显示数据中存在对应列的参数
+                        active_bin_params = {param: config for param, config in active_bins.items()
+                                             if f"{param}_Bin" in production_data.columns}
 
-                                fig = px.imshow(
-                                    heatmap_data,
-                                    text_auto=True,
-                                    title=f'{file_name} 色区与{param_to_analyze}的交叉分布',
-                                    color_continuous_scale='YlOrRd'
+                        # 按文件分别统计
+                        for file_idx, file_name in enumerate(st.session_state.dataframes.keys()):
+                            st.subheader(f"文件: {file_name}")
+                            cube = production_cubes.get(file_name)
+                            total_points = cube.total if cube is not None else 0
+                            st.text(f"总样本数: {total_points}")
+
+                            if total_points == 0:
+                                st.info("该文件没有符合筛选条件的数据")
+                                continue
+
+                            # 各参数的Bin区分布（按参数Bin表逐个显示）
+                            param_distributions = {}
+                            for section_number, (param, param_config) in enumerate(active_bin_params.items(), 1):
+                                st.subheader(f"{section_number}. {param_config['name']}分布")
+
+                                # 统计数据
+                                param_counts = cube.marginal(param).reindex(param_config['order'], fill_value=0)
+                                param_percent = [round((count / total_points * 100), 2) for count in
+                                                 param_counts.values]
+                                param_distributions[param] = (param_counts, param_percent)
+
+                                # 创建数据框
+                                param_stats = pd.DataFrame({
+                                    'Bin区': param_counts.index,
+                                    f'范围({param_config["units"]})': [
+                                        f"{param_config['bins'][bin][0]}-{param_config['bins'][bin][1]}"
+                                        for bin in param_counts.index
+                                    ],
+                                    '数量': param_counts.values,
+                                    '占比(%)': param_percent
+                                })
+                                st.dataframe(param_stats)
+
+                                # 创建可视化图表
+                                fig = px.bar(
+                                    param_stats,
+                                    x='Bin区',
+                                    y='占比(%)',
+                                    title=f'{file_name} {param_config["name"]}分布',
+                                    color='Bin区',
+                                    color_discrete_sequence=color_list[:len(param_config['order'])],
+                                    hover_data=['数量', '占比(%)', f'范围({param_config["units"]})']
+                                )
+                                fig.update_traces(
+                                    hovertemplate='Bin区: %{x}<br>范围: %{customdata[2]}<br>数量: %{customdata[0]}<br>占比: %{customdata[1]:.2f}%<extra></extra>'
                                 )
                                 fig.update_layout(
-                                    xaxis_title=param_to_analyze,
-                                    yaxis_title='色区'
+                                    yaxis=dict(title='占比(%)', range=[0, 100]),
+                                    showlegend=False
                                 )
                                 st.plotly_chart(fig, use_container_width=True)
-                            else:
-                                st.info("数据量不足，无法生成交叉分析热图")
-                        except Exception as e:
-                            st.error(f"生成交叉分析时出错: {str(e)}")
 
-                        # 5. bin产出分布统计（新增）
-                        st.subheader("5. bin产出分布统计 (1-80排序)")
+                            # 色区与参数的交叉分析
+                            section_number = len(active_bin_params) + 1
+                            st.subheader(f"{section_number}. 色区与参数的交叉分析")
+
+                            # 使用文件索引确保key的唯一性
+                            param_names = {config['name']: param for param, config in active_bin_params.items()}
+                            param_to_analyze = st.selectbox(
+                                "选择要与色区进行交叉分析的参数:",
+                                list(param_names.keys()),
+                                key=f"param_selector_{file_idx}_{file_name}"
+                            )
 
-                        # 定义1到80的bin号
-                        bins_1_to_80 = list(range(1, 81))  # 生成1-80的列表
+                            # 参数对应的配置
+                            param_config = active_bin_params[param_names[param_to_analyze]]
 
-                        # 1. 定义需要统计的bin号范围（1-80）
-                        bins_1_to_80 = list(range(1, 81))  # 生成[1,2,...,80]的列表
+                            try:
+                                # 从联合计数立方体切出交叉表，并添加总计行列
+                                cross_df = cube.crosstab('所属色区', param_names[param_to_analyze])
+                                cross_df['总计'] = cross_df.sum(axis=1)
+                                cross_df.loc['总计'] = cross_df.sum()
 
-                        # 2. 统计bin列，并按1-80的范围对齐，缺失的bin号计数填充为0
-                        bin_counts = df['bin'].value_counts().reindex(bins_1_to_80, fill_value=0)
-                        bin_percent = [round((count / total_points * 100), 2) for count in bin_counts.values]
+                                # 按顺序重新排列列
+                                ordered_columns = param_config['order'] + ['总计']
+                                cross_df = cross_df.reindex(columns=ordered_columns, fill_value=0)
 
-                        # 创建统计表格（只包含bin号、计数、占比）
-                        bin_stats = pd.DataFrame({
-                            'bin号': bins_1_to_80,
-                            '计数': bin_counts.values,
-                            '占比(%)': bin_percent
-                        })
-                        # 按bin号升序排列（确保1-80顺序）
-                        bin_stats = bin_stats.sort_values('bin号').reset_index(drop=True)
-                        st.dataframe(bin_stats)  # 显示表格
-
-                        # 生成柱状图展示bin分布
-                        fig = px.bar(
-                            bin_stats,
-                            x='bin号',
-                            y='计数',
-                            title=f'{file_name} bin产出分布 (1-80)',
-                            color='计数',
-                            color_continuous_scale='Viridis',
-                            hover_data=['bin号', '计数', '占比(%)']
-                        )
-                        fig.update_layout(
-                            xaxis=dict(tickmode='linear', dtick=5),  # 每5个bin号显示一个刻度
-                            xaxis_title='bin号',
-                            yaxis_title='计数'
-                        )
-                        st.plotly_chart(fig, use_container_width=True)
-
-                        # 生成饼图（仅显示有数据的bin，避免80个类别拥挤）
-                        filtered_bin_stats = bin_stats[bin_stats['计数'] > 0]
-                        if not filtered_bin_stats.empty:
-                            fig = px.pie(
-                                filtered_bin_stats,
-                                values='计数',
-                                names='bin号',
-                                title=f'{file_name} bin产出分布（仅显示有数据的bin）',
-                                color='bin号',
-                                color_discrete_sequence=color_list  # 使用预设颜色列表
-                            )
-                            # 饼图悬停信息：包含计数、占比
-                            fig.update_traces(
-                                hovertemplate='bin号: %{label}<br>计数: %{value}<br>占比: %{percent}<extra></extra>',
-                                customdata=list(zip(filtered_bin_stats['占比(%)']))
-                            )
-                            st.plotly_chart(fig, use_container_width=True)
-                        else:
-                            st.info("当前筛选条件下没有bin数据")
-
-
-                        # 6. 产出分布综合分析
-                        st.subheader("6. 产出分布综合分析")
-
-                        # 计算各参数的主要分布区域
-                        try:
-                            # 峰值波长主要分布区
-                            wavelength_main_bin = wavelength_counts.idxmax()
-                            wavelength_main_percent = wavelength_percent[
-                                wavelength_counts.index.get_loc(wavelength_main_bin)]
-
-                            # 亮度主要分布区
-                            brightness_main_bin = brightness_counts.idxmax()
-                            brightness_main_percent = brightness_percent[
-                                brightness_counts.index.get_loc(brightness_main_bin)]
-
-                            # 电压主要分布区
-                            voltage_main_bin = voltage_counts.idxmax()
-                            voltage_main_percent = voltage_percent[voltage_counts.index.get_loc(voltage_main_bin)]
-
-                            # 主要色区
-                            color_zone_counts = file_data['所属色区'].value_counts()
-                            main_color_zone = color_zone_counts.index[0]
-                            main_color_percent = round((color_zone_counts[0] / total_points * 100), 2)
-
-                            # 显示综合分析结果
-                            st.markdown(f"**主要分布区域分析**")
-                            st.markdown(f"- 主要峰值波长Bin区: {wavelength_main_bin} "
-                                        f"({wavelength_config['bins'][wavelength_main_bin][0]}-"
-                                        f"{wavelength_config['bins'][wavelength_main_bin][1]} {wavelength_config['units']})，"
-                                        f"占比 {wavelength_main_percent}%")
-                            st.markdown(f"- 主要亮度Bin区: {brightness_main_bin} "
-                                        f"({brightness_config['bins'][brightness_main_bin][0]}-"
-                                        f"{brightness_config['bins'][brightness_main_bin][1]} {brightness_config['units']})，"
-                                        f"占比 {brightness_main_percent}%")
-                            st.markdown(f"- 主要电压Bin区: {voltage_main_bin} "
-                                        f"({voltage_config['bins'][voltage_main_bin][0]}-"
-                                        f"{voltage_config['bins'][voltage_main_bin][1]} {voltage_config['units']})，"
-                                        f"占比 {voltage_main_percent}%")
-                            st.markdown(f"- 主要色区: {main_color_zone}，占比 {main_color_percent}%")
-
-                            # 生成综合分布雷达图
-                            radar_data = []
-                            for param in ["Wavelength", "Brightness", "Voltage"]:
-                                config = PRODUCTION_BINS[param]
-                                bin_column = f"{param}_Bin"
-                                counts = file_data[bin_column].value_counts().reindex(config['order'], fill_value=0)
-                                for bin_code, count in counts.items():
-                                    radar_data.append({
-                                        '参数': config['name'],
-                                        'Bin区': bin_code,
-                                        '占比(%)': round((count / total_points * 100), 2)
-                                    })
-
-                            radar_df = pd.DataFrame(radar_data)
-
-                            fig = px.line_polar(
-                                radar_df,
-                                r='占比(%)',
-                                theta='Bin区',
-                                color='参数',
-                                line_close=True,
-                                title=f'{file_name} 各参数Bin区分布雷达图'
+                                # 显示交叉表
+                                st.dataframe(cross_df)
+
+                                # 创建交叉分析热图（排除总计行和列）
+                                if len(cross_df) > 1 and len(cross_df.columns) > 1:
+                                    heatmap_data = cross_df.drop('总计').drop(columns='总计')
+
+                                    fig = px.imshow(
+                                        heatmap_data,
+                                        text_auto=True,
+                                        title=f'{file_name} 色区与{param_to_analyze}的交叉分布',
+                                        color_continuous_scale='YlOrRd'
+                                    )
+                                    fig.update_layout(
+                                        xaxis_title=param_to_analyze,
+                                        yaxis_title='色区'
+                                    )
+                                    st.plotly_chart(fig, use_container_width=True)
+                                else:
+                                    st.info("数据量不足，无法生成交叉分析热图")
+                            except Exception as e:
+                                st.error(f"生成交叉分析时出错: {str(e)}")
+
+                            # bin产出分布统计（新增）
+                            st.subheader(f"{section_number + 1}. bin产出分布统计 (1-80排序)")
+
+                            # 从加载时预计算的直方图按当前bin_code筛选条件取出1-80的计数（已按bin号排序）
+                            bin_histogram = st.session_state.get('bin_histograms', {}).get(file_name)
+                            if bin_histogram is None:
+                                bin_histogram = build_bin_histogram(st.session_state.dataframes[file_name])
+                            if bin_histogram is None:
+                                st.info("该文件没有bin列，无法统计bin产出分布")
+                                bin_counts = np.zeros(80, dtype=int)
+                            else:
+                                bin_counts = select_bin_histogram(bin_histogram, selected_bin_codes)
+
+                            # 创建统计表格（只包含bin号、计数、占比）
+                            bin_stats = pd.DataFrame({
+                                'bin号': np.arange(1, 81),
+                                '计数': bin_counts,
+                                '占比(%)': np.round(bin_counts / total_points * 100, 2)
+                            })
+                            st.dataframe(bin_stats)  # 显示表格
+
+                            # 生成柱状图展示bin分布
+                            fig = px.bar(
+                                bin_stats,
+                                x='bin号',
+                                y='计数',
+                                title=f'{file_name} bin产出分布 (1-80)',
+                                color='计数',
+                                color_continuous_scale='Viridis',
+                                hover_data=['bin号', '计数', '占比(%)']
                             )
                             fig.update_layout(
-                                polar=dict(radialaxis=dict(visible=True, range=[0, 100]))
+                                xaxis=dict(tickmode='linear', dtick=5),  # 每5个bin号显示一个刻度
+                                xaxis_title='bin号',
+                                yaxis_title='计数'
                             )
                             st.plotly_chart(fig, use_container_width=True)
-                        except Exception as e:
-                            st.error(f"生成综合分析时出错: {str(e)}")
-
-                # 显示数据样本
-                if st.session_state.production_data is not None and not st.session_state.production_data.empty:
-                    st.subheader("产出分布数据样本")
-                    display_columns = ['文件名', 'bin_code', '所属色区',
-                                       'peak_wavelength1_nm', 'Wavelength_Bin',
-                                       'LuminousFlux_lm', 'Brightness_Bin',
-                                       'forward_voltage1_V', 'Voltage_Bin']
-                    st.dataframe(st.session_state.production_data[display_columns].head(100))
 
-            # 4. Mapping图分析选项卡
-            with tab4:
-                st.header("Mapping图分析")
+                            # 生成饼图（仅显示有数据的bin，避免80个类别拥挤）
+                            filtered_bin_stats = bin_stats[bin_stats['计数'] > 0]
+                            if not filtered_bin_stats.empty:
+                                fig = px.pie(
+                                    filtered_bin_stats,
+                                    values='计数',
+                                    names='bin号',
+                                    title=f'{file_name} bin产出分布（仅显示有数据的bin）',
+                                    color='bin号',
+                                    color_discrete_sequence=color_list  # 使用预设颜色列表
+                                )
+                                # 饼图悬停信息：包含计数、占比
+                                fig.update_traces(
+                                    hovertemplate='bin号: %{label}<br>计数: %{value}<br>占比: %{percent}<extra></extra>',
+                                    customdata=list(zip(filtered_bin_stats['占比(%)']))
+                                )
+                                st.plotly_chart(fig, use_container_width=True)
+                            else:
+                                st.info("当前筛选条件下没有bin数据")
+
+
+                            # 产出分布综合分析
+                            st.subheader(f"{section_number + 2}. 产出分布综合分析")
+
+                            # 计算各参数的主要分布区域
+                            try:
+                                # 主要色区
+                                color_zone_counts = cube.marginal('所属色区')
+                                main_color_zone = color_zone_counts.idxmax()
+                                main_color_percent = round((color_zone_counts.max() / total_points * 100), 2)
+
+                                # 显示综合分析结果
+                                st.markdown(f"**主要分布区域分析**")
+                                for param, (param_counts, param_percent) in param_distributions.items():
+                                    config = active_bin_params[param]
+                                    main_bin = param_counts.idxmax()
+                                    main_percent = param_percent[param_counts.index.get_loc(main_bin)]
+                                    st.markdown(f"- 主要{config['name']}Bin区: {main_bin} "
+                                                f"({config['bins'][main_bin][0]}-"
+                                                f"{config['bins'][main_bin][1]} {config['units']})，"
+                                                f"占比 {main_percent}%")
+                                st.markdown(f"- 主要色区: {main_color_zone}，占比 {main_color_percent}%")
+
+                                # 生成综合分布雷达图
+                                radar_data = []
+                                for param, (param_counts, _) in param_distributions.items():
+                                    config = active_bin_params[param]
+                                    for bin_code, count in param_counts.items():
+                                        radar_data.append({
+                                            '参数': config['name'],
+                                            'Bin区': bin_code,
+                                            '占比(%)': round((count / total_points * 100), 2)
+                                        })
+
+                                radar_df = pd.DataFrame(radar_data)
+
+                                fig = px.line_polar(
+                                    radar_df,
+                                    r='占比(%)',
+                                    theta='Bin区',
+                                    color='参数',
+                                    line_close=True,
+                                    title=f'{file_name} 各参数Bin区分布雷达图'
+                                )
+                                fig.update_layout(
+                                    polar=dict(radialaxis=dict(visible=True, range=[0, 100]))
+                                )
+                                st.plotly_chart(fig, use_container_width=True)
+                            except Exception as e:
+                                st.error(f"生成综合分析时出错: {str(e)}")
+
+                    # 显示数据样本
+                    if st.session_state.production_data is not None and not st.session_state.production_data.empty:
+                        st.subheader("产出分布数据明细")
+                        display_columns = ['文件名', 'bin_code', '所属色区']
+                        for param, config in active_bins.items():
+                            if f"{param}_Bin" in st.session_state.production_data.columns:
+                                display_columns += [config['column'], f"{param}_Bin"]
+                        render_paginated_table(st.session_state.production_data, key="production_sample_view",
+                                               columns=display_columns)
+
+                        # SQL查询（可选的DuckDB引擎，多线程执行，结果按查询文本和数据指纹缓存）
+                        with st.expander("SQL查询（DuckDB）", expanded=False):
+                            query_layer = get_query_layer()
+                            if query_layer is None:
+                                st.info("未安装duckdb，安装后（pip install duckdb）可使用SQL查询")
+                            else:
+                                file_names = list(st.session_state.dataframes.keys())
+                                raw_tables = [f"lot_{i}" for i in range(len(file_names))]
+                                for table_name, file_name in zip(raw_tables, file_names):
+                                    query_layer.register(table_name, st.session_state.dataframes[file_name],
+                                                         repr((st.session_state.data_fingerprint, file_name)))
+                                query_layer.register_union('raw_data', raw_tables, labels=file_names)
+                                query_layer.register('production', st.session_state.production_data,
+                                                     graph.fingerprint('production_data'))
+                                st.caption("可用的表：production（产出分布数据，含所属色区与各参数Bin区）、"
+                                           "raw_data（全部原始数据，含文件名列）")
+
+                                sql_queries = build_production_sql_queries(active_bins)
+                                query_name = st.selectbox("预定义查询", list(sql_queries) + ["自定义SQL"],
+                                                          key="sql_query_selector")
+                                sql = st.text_area("SQL", value=sql_queries.get(
+                                    query_name, "SELECT * FROM production LIMIT 1000").strip(),
+                                                   height=200, key=f"sql_text_{query_name}")
+                                if st.button("执行查询", key="run_sql_query"):
+                                    st.session_state.sql_query_text = sql
+
+                                if st.session_state.get('sql_query_text'):
+                                    try:
+                                        start_time = time.time()
+                                        sql_result = query_layer.query(st.session_state.sql_query_text)
+                                        st.caption(f"查询耗时 {time.time() - start_time:.3f} 秒")
+                                        render_paginated_table(sql_result, key="sql_result_view")
+                                    except duckdb.Error as e:
+                                        st.error(f"SQL执行出错: {e}")
 
-                if len(st.session_state.dataframes) > 0:
-                    # 优化布局
-                    st.markdown("### Mapping图设置")
+            # 4. Mapping图分析选项卡
+            if tab_is_open(tab4):
+                with tab4:
+                    st.header("Mapping图分析")
 
-                    # 左侧控制面板，右侧图表
-                    col1, col2 = st.columns([1, 3])
+                    if len(st.session_state.dataframes) > 0:
+                        # 优化布局
+                        st.markdown("### Mapping图设置")
 
-                    with col1:
-                        # 选择要分析的材料
-                        material_file = st.selectbox(
-                            "选择要分析的材料:",
-                            list(st.session_state.dataframes.keys()),
-                            key="mapping_material_selector"
-                        )
+                        # 左侧控制面板，右侧图表
+                        col1, col2 = st.columns([1, 3])
 
-                        # 产品类型选择
-                        product_type_mapping = st.selectbox(
-                            "产品类型",
-                            ["NCSP", "CSP"],
-                            index=0 if st.session_state.product_type == "NCSP" else 1,
-                            key="mapping_product_type"
-                        )
+                        with col1:
+                            # 选择要分析的材料
+                            material_file = st.selectbox(
+                                "选择要分析的材料:",
+                                list(st.session_state.dataframes.keys()),
+                                key="mapping_material_selector"
+                            )
 
-                        # 针对NCSP产品添加区域选择
-                        if product_type_mapping == "NCSP":
-                            ncsp_region = st.radio(
-                                "选择显示区域",
-                                ["全部区域", "区域1", "区域2"],
-                                index=0 if st.session_state.ncsp_region is None else st.session_state.ncsp_region,
-                                key="ncsp_region_selector"
+                            # 产品类型选择
+                            product_type_mapping = st.selectbox(
+                                "产品类型",
+                                ["NCSP", "CSP"],
+                                index=0 if st.session_state.product_type == "NCSP" else 1,
+                                key="mapping_product_type"
                             )
 
-                            if ncsp_region == "全部区域":
+                            # 针对NCSP产品添加区域选择
+                            if product_type_mapping == "NCSP":
+                                ncsp_region = st.radio(
+                                    "选择显示区域",
+                                    ["全部区域", "区域1", "区域2"],
+                                    index=0 if st.session_state.ncsp_region is None else st.session_state.ncsp_region,
+                                    key="ncsp_region_selector"
+                                )
+
+                                if ncsp_region == "全部区域":
+                                    st.session_state.ncsp_region = None
+                                elif ncsp_region == "区域1":
+                                    st.session_state.ncsp_region = 1
+                                else:
+                                    st.session_state.ncsp_region = 2
+                            else:
                                 st.session_state.ncsp_region = None
-                            elif ncsp_region == "区域1":
-                                st.session_state.ncsp_region = 1
+                                st.info("CSP产品将使用pos_x和pos_y列，并自动归一化坐标从1开始")
+
+                            # 色阶颜色选择
+                            color_scale_name = st.selectbox(
+                                "选择色阶方案",
+                                list(color_scales.keys()),
+                                key="color_scale_name_mapping",
+                                format_func=lambda x: x
+                            )
+                            st.session_state.color_scale = color_scales[color_scale_name]
+
+                            # 图表尺寸设置
+                            st.subheader("图表尺寸")
+                            map_width = st.slider("图表宽度 (像素)", 800, 2200, 2000, key="map_width")
+                            map_height = st.slider("图表高度 (像素)", 500, 1500, 600, key="map_height")
+
+                            # 异常点过滤
+                            st.subheader("异常点过滤")
+                            filter_outliers = st.checkbox("启用异常点过滤", True, key="filter_outliers")
+
+                            if filter_outliers:
+                                ciex_min = st.number_input("ciex 最小值", value=0.2, step=0.001, format="%.3f",
+                                                           key="ciex_min")
+                                ciex_max = st.number_input("ciex 最大值", value=0.4, step=0.001, format="%.3f",
+                                                           key="ciex_max")
+                                ciey_min = st.number_input("ciey 最小值", value=0.2, step=0.001, format="%.3f",
+                                                           key="ciey_min")
+                                ciey_max = st.number_input("ciey 最大值", value=0.4, step=0.001, format="%.3f",
+                                                           key="ciey_max")
+
+                                ciex_range = [ciex_min, ciex_max]
+                                ciey_range = [ciey_min, ciey_max]
                             else:
-                                st.session_state.ncsp_region = 2
-                        else:
-                            st.session_state.ncsp_region = None
-                            st.info("CSP产品将使用pos_x和pos_y列，并自动归一化坐标从1开始")
-
-                        # 色阶颜色选择
-                        color_scale_name = st.selectbox(
-                            "选择色阶方案",
-                            list(color_scales.keys()),
-                            key="color_scale_name_mapping",
-                            format_func=lambda x: x
-                        )
-                        st.session_state.color_scale = color_scales[color_scale_name]
-
-                        # 图表尺寸设置
-                        st.subheader("图表尺寸")
-                        map_width = st.slider("图表宽度 (像素)", 800, 2200, 2000, key="map_width")
-                        map_height = st.slider("图表高度 (像素)", 500, 1500, 600, key="map_height")
-
-                        # 异常点过滤
-                        st.subheader("异常点过滤")
-                        filter_outliers = st.checkbox("启用异常点过滤", True, key="filter_outliers")
-
-                        if filter_outliers:
-                            ciex_min = st.number_input("ciex 最小值", value=0.2, step=0.001, format="%.3f",
-                                                       key="ciex_min")
-                            ciex_max = st.number_input("ciex 最大值", value=0.4, step=0.001, format="%.3f",
-                                                       key="ciex_max")
-                            ciey_min = st.number_input("ciey 最小值", value=0.2, step=0.001, format="%.3f",
-                                                       key="ciey_min")
-                            ciey_max = st.number_input("ciey 最大值", value=0.4, step=0.001, format="%.3f",
-                                                       key="ciey_max")
-
-                            ciex_range = [ciex_min, ciex_max]
-                            ciey_range = [ciey_min, ciey_max]
-                        else:
-                            ciex_range = None
-                            ciey_range = None
-
-                        # # 选择映射值
-                        # value_column = st.selectbox(
-                        #     "选择映射值",
-                        #     ['ciex', 'ciey'],
-                        #     key="value_column"
-                        # )
-
-                        # 颜色范围设置
-                        st.subheader("颜色映射设置")
-                        custom_color_range = st.checkbox("自定义颜色范围", False, key="custom_color_range")
-                        if custom_color_range:
-                            # 分别获取ciex和ciey的原始数据范围（未过滤bin_code）
-                            material_df = st.session_state.dataframes[material_file]
-                            ciex_min = float(material_df['ciex'].min())
-                            ciex_max = float(material_df['ciex'].max())
-                            ciey_min = float(material_df['ciey'].min())
-                            ciey_max = float(material_df['ciey'].max())
-
-                            st.markdown("#### CIE X 颜色范围")
-                            col_ciex1, col_ciex2 = st.columns(2)
-                            with col_ciex1:
-                                ciex_color_min = st.number_input(
-                                    "CIE X 最小值",
-                                    value=ciex_min,
-                                    step=0.0001,
-                                    format="%.4f",
-                                    key="ciex_color_min"
-                                )
-                            with col_ciex2:
-                                ciex_color_max = st.number_input(
-                                    "CIE X 最大值",
-                                    value=ciex_max,
-                                    step=0.0001,
-                                    format="%.4f",
-                                    key="ciex_color_max"
-                                )
+                                ciex_range = None
+                                ciey_range = None
+
+                            # # 选择映射值
+                            # value_column = st.selectbox(
+                            #     "选择映射值",
+                            #     ['ciex', 'ciey'],
+                            #     key="value_column"
+                            # )
+
+                            # 颜色范围设置
+                            st.subheader("颜色映射设置")
+                            custom_color_range = st.checkbox("自定义颜色范围", False, key="custom_color_range")
+                            if custom_color_range:
+                                # 分别获取ciex和ciey的原始数据范围（未过滤bin_code）
+                                material_df = st.session_state.dataframes[material_file]
+                                ciex_min = float(material_df['ciex'].min())
+                                ciex_max = float(material_df['ciex'].max())
+                                ciey_min = float(material_df['ciey'].min())
+                                ciey_max = float(material_df['ciey'].max())
+
+                                st.markdown("#### CIE X 颜色范围")
+                                col_ciex1, col_ciex2 = st.columns(2)
+                                with col_ciex1:
+                                    ciex_color_min = st.number_input(
+                                        "CIE X 最小值",
+                                        value=ciex_min,
+                                        step=0.0001,
+                                        format="%.4f",
+                                        key="ciex_color_min"
+                                    )
+                                with col_ciex2:
+                                    ciex_color_max = st.number_input(
+                                        "CIE X 最大值",
+                                        value=ciex_max,
+                                        step=0.0001,
+                                        format="%.4f",
+                                        key="ciex_color_max"
+                                    )
 
-                            st.markdown("#### CIE Y 颜色范围")
-                            col_ciey1, col_ciey2 = st.columns(2)
-                            with col_ciey1:
-                                ciey_color_min = st.number_input(
-                                    "CIE Y 最小值",
-                                    value=ciey_min,
-                                    step=0.0001,
-                                    format="%.4f",
-                                    key="ciey_color_min"
-                                )
-                            with col_ciey2:
-                                ciey_color_max = st.number_input(
-                                    "CIE Y 最大值",
-                                    value=ciey_max,
-                                    step=0.0001,
-                                    format="%.4f",
-                                    key="ciey_color_max"
-                                )
+                                st.markdown("#### CIE Y 颜色范围")
+                                col_ciey1, col_ciey2 = st.columns(2)
+                                with col_ciey1:
+                                    ciey_color_min = st.number_input(
+                                        "CIE Y 最小值",
+                                        value=ciey_min,
+                                        step=0.0001,
+                                        format="%.4f",
+                                        key="ciey_color_min"
+                                    )
+                                with col_ciey2:
+                                    ciey_color_max = st.number_input(
+                                        "CIE Y 最大值",
+                                        value=ciey_max,
+                                        step=0.0001,
+                                        format="%.4f",
+                                        key="ciey_color_max"
+                                    )
 
-                            color_ranges = {
-                                'ciex': [ciex_color_min, ciex_color_max],
-                                'ciey': [ciey_color_min, ciey_color_max]
-                            }
-                        else:
-                            color_ranges = {
-                                'ciex': None,
-                                'ciey': None
-                            }
+                                color_ranges = {
+                                    'ciex': [ciex_color_min, ciex_color_max],
+                                    'ciey': [ciey_color_min, ciey_color_max]
+                                }
+                            else:
+                                color_ranges = {
+                                    'ciex': None,
+                                    'ciey': None
+                                }
 
-                        # 数据聚类与点大小优化
-                        cluster_density = st.checkbox("根据密度调整点大小", False, key="cluster_density")
+                            # 数据聚类与点大小优化
+                            cluster_density = st.checkbox("根据密度调整点大小", False, key="cluster_density")
 
-                        # 网格细分控制
-                        show_grid_subdivisions = st.checkbox("显示细分网格", True, key="show_grid_subdivisions")
+                            # 网格细分控制
+                            show_grid_subdivisions = st.checkbox("显示细分网格", True, key="show_grid_subdivisions")
 
-                        # 特殊标记设置
-                        st.subheader("特殊标记设置")
+                            # 特殊标记设置
+                            st.subheader("特殊标记设置")
 
-                        # 创建一个容器来保存特殊标记设置
-                        marker_container = st.container()
+                            # 创建一个容器来保存特殊标记设置
+                            marker_container = st.container()
 
-                        with marker_container:
-                            add_marker = st.button("添加特殊标记", key="add_marker")
+                            with marker_container:
+                                add_marker = st.button("添加特殊标记", key="add_marker")
 
-                            if st.button("重置所有标记", key="reset_markers"):
-                                st.session_state.special_markers = []
+                                if st.button("重置所有标记", key="reset_markers"):
+                                    st.session_state.special_markers = []
 
-                        if add_marker:
-                            st.session_state.special_markers.append({
-                                'condition': 'ciex > 0.3 and ciey > 0.325',
-                                'color': '#FF0000',
-                                'label': f'特殊点_{len(st.session_state.special_markers) + 1}'
-                            })
+                            if add_marker:
+                                st.session_state.special_markers.append({
+                                    'condition': 'ciex > 0.3 and ciey > 0.325',
+                                    'color': '#FF0000',
+                                    'label': f'特殊点_{len(st.session_state.special_markers) + 1}'
+                                })
 
-                        # 显示已添加的特殊标记
-                        if st.session_state.special_markers:
-                            st.markdown("#### 当前特殊标记:")
-                            for i, marker in enumerate(st.session_state.special_markers):
-                                with st.expander(f"标记 {i + 1}: {marker['label']}"):
-                                    col3, col4 = st.columns(2)
-                                    with col3:
-                                        condition = st.text_input(
-                                            f"条件表达式",
-                                            marker['condition'],
-                                            key=f"condition_{i}",
-                                            help="使用pandas查询语法，例如: 'ciex > 0.3 and ciey > 0.325'"
-                                        )
-                                    with col4:
-                                        color = st.color_picker(
-                                            f"标记颜色",
-                                            marker['color'],
-                                            key=f"marker_color_{i}"
+                            # 显示已添加的特殊标记
+                            if st.session_state.special_markers:
+                                st.markdown("#### 当前特殊标记:")
+                                for i, marker in enumerate(st.session_state.special_markers):
+                                    with st.expander(f"标记 {i + 1}: {marker['label']}"):
+                                        col3, col4 = st.columns(2)
+                                        with col3:
+                                            condition = st.text_input(
+                                                f"条件表达式",
+                                                marker['condition'],
+                                                key=f"condition_{i}",
+                                                help="使用pandas查询语法，例如: 'ciex > 0.3 and ciey > 0.325'"
+                                            )
+                                        with col4:
+                                            color = st.color_picker(
+                                                f"标记颜色",
+                                                marker['color'],
+                                                key=f"marker_color_{i}"
+                                            )
+
+                                        label = st.text_input(
+                                            f"标记标签",
+                                            marker['label'],
+                                            key=f"label_{i}"
                                         )
 
-                                    label = st.text_input(
-                                        f"标记标签",
-                                        marker['label'],
-                                        key=f"label_{i}"
-                                    )
+                                        col5, col6 = st.columns(2)
+                                        with col5:
+                                            if st.button(f"保存标记 {i + 1}", key=f"save_{i}"):
+                                                st.session_state.special_markers[i] = {
+                                                    'condition': condition,
+                                                    'color': color,
+                                                    'label': label
+                                                }
+                                                st.success(f"标记 {i + 1} 已保存")
+                                        with col6:
+                                            if st.button(f"删除标记 {i + 1}", key=f"delete_{i}"):
+                                                st.session_state.special_markers.pop(i)
+                                                st.success(f"标记 {i + 1} 已删除")
+
+                            # 添加单元格大小控制
+                            st.subheader("单元格大小控制")
+                            cell_size = st.slider(
+                                "单元格大小比例",
+                                min_value=0.5,
+                                max_value=2.0,
+                                value=st.session_state.get("cell_size", 0.9),
+                                step=0.1,
+                                key="cell_size_slider",
+                                on_change=update_cell_size
+                            )
 
-                                    col5, col6 = st.columns(2)
-                                    with col5:
-                                        if st.button(f"保存标记 {i + 1}", key=f"save_{i}"):
-                                            st.session_state.special_markers[i] = {
-                                                'condition': condition,
-                                                'color': color,
-                                                'label': label
-                                            }
-                                            st.success(f"标记 {i + 1} 已保存")
-                                    with col6:
-                                        if st.button(f"删除标记 {i + 1}", key=f"delete_{i}"):
-                                            st.session_state.special_markers.pop(i)
-                                            st.success(f"标记 {i + 1} 已删除")
-
-                        # 添加单元格大小控制
-                        st.subheader("单元格大小控制")
-                        cell_size = st.slider(
-                            "单元格大小比例",
-                            min_value=0.5,
-                            max_value=2.0,
-                            value=st.session_state.get("cell_size", 0.9),
-                            step=0.1,
-                            key="cell_size_slider",
-                            on_change=update_cell_size
-                        )
+                        with col2:
+                            # 获取所选材料的数据
+                            material_df = st.session_state.dataframes[material_file]
+                            filtered_material_df = material_df[material_df['bin_code'].isin(selected_bin_codes)]
 
-                    with col2:
-                        # 获取所选材料的数据
-                        material_df = st.session_state.dataframes[material_file]
-                        filtered_material_df = material_df[material_df['bin_code'].isin(selected_bin_codes)]
+                            # 检查是否有数据
+                            if filtered_material_df.empty:
+                                st.warning("筛选后没有剩余数据点，请调整筛选条件")
+                            else:
+                                st.write(f"筛选后数据点数量: {len(filtered_material_df)}")
 
-                        # 检查是否有数据
-                        if filtered_material_df.empty:
-                            st.warning("筛选后没有剩余数据点，请调整筛选条件")
-                        else:
-                            st.write(f"筛选后数据点数量: {len(filtered_material_df)}")
+                            # 生成mapping图
+                                if st.button("生成交互Mapping图", key="generate_map_button"):
+                                    # 先检查筛选后的数据是否为空
+                                    if filtered_material_df.empty:
+                                        st.warning("无法生成Mapping图，可能是筛选后没有剩余数据点")
+                                    else:
+                                        with st.spinner("正在生成Mapping图..."):
+                                            # CIE X Mapping图（上）
+                                            title_x = f'{material_file} - ciex Mapping图 ({product_type_mapping})'
+                                            fig_x = generate_interactive_mapping_plot(
+                                                filtered_material_df,
+                                                'ciex',
+                                                title_x,  # 传入标题，用于后续文件名
+                                                map_width,
+                                                map_height,
+                                                filter_outliers,
+                                                ciex_range,
+                                                ciey_range,
+                                                st.session_state.special_markers,
+                                                st.session_state.color_scale,
+                                                product_type_mapping,
+                                                st.session_state.ncsp_region,
+                                                st.session_state.cell_size,
+                                                color_range=color_ranges['ciex'],
+                                                cluster_density=cluster_density,
+                                                show_grid_subdivisions=show_grid_subdivisions
+                                            )
+                                            st.plotly_chart(fig_x, use_container_width=True)
+
+                                            # CIE Y Mapping图（下）
+                                            title_y = f'{material_file} - ciey Mapping图 ({product_type_mapping})'
+                                            fig_y = generate_interactive_mapping_plot(
+                                                filtered_material_df,
+                                                'ciey',
+                                                title_y,  # 传入标题，用于后续文件名
+                                                map_width,
+                                                map_height,
+                                                filter_outliers,
+                                                ciex_range,
+                                                ciey_range,
+                                                st.session_state.special_markers,
+                                                st.session_state.color_scale,
+                                                product_type_mapping,
+                                                st.session_state.ncsp_region,
+                                                st.session_state.cell_size,
+                                                color_range=color_ranges['ciey'],
+                                                cluster_density=cluster_density,
+                                                show_grid_subdivisions=show_grid_subdivisions
+                                            )
+                                            st.plotly_chart(fig_y, use_container_width=True)
 
-                        # 生成mapping图
-                            if st.button("生成交互Mapping图", key="generate_map_button"):
-                                # 先检查筛选后的数据是否为空
-                                if filtered_material_df.empty:
-                                    st.warning("无法生成Mapping图，可能是筛选后没有剩余数据点")
-                                else:
                                     with st.spinner("正在生成Mapping图..."):
                                         # CIE X Mapping图（上）
                                         title_x = f'{material_file} - ciex Mapping图 ({product_type_mapping})'
-                                        fig_x = generate_interactive_mapping_plot(
-                                            filtered_material_df,
-                                            'ciex',
-                                            title_x,  # 传入标题，用于后续文件名
-                                            map_width,
-                                            map_height,
-                                            filter_outliers,
-                                            ciex_range,
-                                            ciey_range,
-                                            st.session_state.special_markers,
-                                            st.session_state.color_scale,
-                                            product_type_mapping,
-                                            st.session_state.ncsp_region,
-                                            st.session_state.cell_size,
-                                            color_range=color_ranges['ciex'],
-                                            cluster_density=cluster_density,
-                                            show_grid_subdivisions=show_grid_subdivisions
-                                        )
+                                        fig_x = generate_interactive_mapping_plot(...)
                                         st.plotly_chart(fig_x, use_container_width=True)
 
                                         # CIE Y Mapping图（下）
                                         title_y = f'{material_file} - ciey Mapping图 ({product_type_mapping})'
-                                        fig_y = generate_interactive_mapping_plot(
-                                            filtered_material_df,
-                                            'ciey',
-                                            title_y,  # 传入标题，用于后续文件名
-                                            map_width,
-                                            map_height,
-                                            filter_outliers,
-                                            ciex_range,
-                                            ciey_range,
-                                            st.session_state.special_markers,
-                                            st.session_state.color_scale,
-                                            product_type_mapping,
-                                            st.session_state.ncsp_region,
-                                            st.session_state.cell_size,
-                                            color_range=color_ranges['ciey'],
-                                            cluster_density=cluster_density,
-                                            show_grid_subdivisions=show_grid_subdivisions
-                                        )
+                                        fig_y = generate_interactive_mapping_plot(...)
                                         st.plotly_chart(fig_y, use_container_width=True)
 
-                                with st.spinner("正在生成Mapping图..."):
-                                    # CIE X Mapping图（上）
-                                    title_x = f'{material_file} - ciex Mapping图 ({product_type_mapping})'
-                                    fig_x = generate_interactive_mapping_plot(...)
-                                    st.plotly_chart(fig_x, use_container_width=True)
+                    else:
+                        st.info("请上传材料文件以进行Mapping图分析")
+
+            # 5. 历史批次选项卡
+            if tab_is_open(tab5):
+                with tab5:
+                    st.header("历史批次")
+                    history_store = LotHistoryStore()
+                    st.caption(f"历史批次库: {history_store.path}")
+
+                    # 写入当前批次（按文件内容判断，同一文件只写入一次）
+                    st.subheader("写入当前批次")
+                    lot_date = st.date_input("批次日期", value=datetime.date.today(), key="history_lot_date")
+                    lot_ids = st.session_state.get('lot_ids', {})
+                    pending = [file_name for file_name in st.session_state.dataframes
+                               if file_name in lot_ids and not history_store.has_lot(lot_ids[file_name])]
+                    pending_status = st.empty()
+                    pending_status.text(f"当前已加载 {len(st.session_state.dataframes)} 个文件，"
+                                        f"其中 {len(pending)} 个尚未写入历史批次库")
+                    if pending and st.button("写入历史批次库", key="append_history_lots"):
+                        with st.spinner("正在写入历史批次库..."):
+                            for file_name in pending:
+                                points = prepare_lot_points(st.session_state.dataframes[file_name], color_zones,
+                                                            active_bins)
+                                history_store.append_lot(lot_ids[file_name], {
+                                    '材料': file_name,
+                                    '产品类型': st.session_state.product_type,
+                                    '色区预设': preset_name,
+                                    '批次日期': lot_date.isoformat()
+                                }, points)
+                        pending_status.text(f"当前已加载 {len(st.session_state.dataframes)} 个文件，全部已写入历史批次库")
+                        st.success(f"已写入 {len(pending)} 个批次")
+
+                    lots = history_store.lots()
+                    if lots.empty:
+                        st.info("历史批次库中还没有数据")
+                    else:
+                        st.subheader("已入库批次")
+                        render_paginated_table(lots, key="history_lots_view")
 
-                                    # CIE Y Mapping图（下）
-                                    title_y = f'{material_file} - ciey Mapping图 ({product_type_mapping})'
-                                    fig_y = generate_interactive_mapping_plot(...)
-                                    st.plotly_chart(fig_y, use_container_width=True)
+                        # 趋势分析（只读取写入时预先计算的批次汇总，不扫描逐点数据）
+                        st.subheader("趋势分析")
+                        rebuilt = history_store.rebuild_missing_rollups()
+                        if rebuilt:
+                            st.info(f"已为 {rebuilt} 个早期批次补算汇总")
+                        rollups = history_store.rollups()
 
-                else:
-                    st.info("请上传材料文件以进行Mapping图分析")
+                        col1, col2, col3 = st.columns(3)
+                        with col1:
+                            product_filter = st.selectbox("产品类型",
+                                                          ["全部"] + sorted(rollups['产品类型'].dropna().unique()),
+                                                          key="history_product_filter")
+                        with col2:
+                            trend_period = st.radio("汇总周期", ["按批次", "按周", "按月"], horizontal=True,
+                                                    key="history_trend_period")
+                        with col3:
+                            trend_by_material = st.checkbox("按材料分别显示", key="history_by_material")
+                        if product_filter != "全部":
+                            rollups = rollups[rollups['产品类型'] == product_filter]
+
+                        yield_zones = st.multiselect(
+                            "选择计算落入率的色区组合:", list(color_zones.keys()),
+                            default=[zone for zone in st.session_state.selected_total_zones if zone in color_zones],
+                            key="history_zones_selector"
+                        )
+                        trends = summarize_lot_trends(rollups, yield_zones,
+                                                      {"按批次": None, "按周": 'W', "按月": 'M'}[trend_period],
+                                                      trend_by_material)
+                        if trends.empty:
+                            st.info("没有符合条件的批次")
+                        else:
+                            color_column = '材料' if trend_by_material else None
+                            for axis in ('ciex', 'ciey'):
+                                fig = px.line(trends, x='时间', y=f'{axis}均值', color=color_column,
+                                              error_y=f'{axis}标准差', markers=True,
+                                              hover_data=['批次数', '点数'], title=f'{axis}中心点漂移（误差线为标准差）')
+                                fig.update_layout(yaxis=dict(tickformat='.4f'))
+                                st.plotly_chart(fig, use_container_width=True)
+
+                            if yield_zones:
+                                fig = px.line(trends, x='时间', y='落入率(%)', color=color_column, markers=True,
+                                              hover_data=['批次数', '点数'],
+                                              title=f"所选色区落入率趋势（{', '.join(yield_zones)}）")
+                                fig.update_layout(yaxis=dict(range=[0, 100]))
+                                st.plotly_chart(fig, use_container_width=True)
+                            st.dataframe(trends.round(dict.fromkeys(['ciex均值', 'ciey均值', 'ciex标准差', 'ciey标准差'], 5)))
 
     else:
         st.info("请上传分光数据文件开始分析")
 
 
 if __name__ == "__main__":
-    main()
+    # streamlit run 启动时运行网页界面，直接用python运行时作为命令行批处理工具
+    if st.runtime.exists():
+        main()
+    else:
+        sys.exit(batch_main())
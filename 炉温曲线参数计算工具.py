@@ -1,21 +1,17 @@
+import os
+import sys
+import json
+import time
+import hashlib
+import importlib.util
+import argparse
+import logging
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import streamlit as st
 import pandas as pd
-import matplotlib.pyplot as plt
 import numpy as np
-from io import StringIO
+from io import StringIO, BytesIO
 import plotly.graph_objects as go
-from plotly.subplots import make_subplots
-
-# 设置matplotlib中文字体
-plt.rcParams['font.sans-serif'] = ['SimHei', 'DejaVu Sans']
-plt.rcParams['axes.unicode_minus'] = False
-
-# 设置页面
-st.set_page_config(page_title="炉温曲线分析系统", page_icon="📊", layout="wide")
-
-# 标题
-st.title("🔥 无铅锡膏炉温曲线分析系统")
-st.markdown("根据实测炉温曲线判断是否符合供应商推荐参数范围")
 
 # 根据图片内容设置默认参数
 DEFAULT_PARAMS = {
@@ -49,144 +45,8 @@ DEFAULT_PARAMS = {
     'tp_time_max': 90
 }
 
-# 初始化session state
-if 'saved_params' not in st.session_state:
-    st.session_state.saved_params = DEFAULT_PARAMS.copy()
-
-if 'data' not in st.session_state:
-    st.session_state.data = None
-
-if 'analysis_results' not in st.session_state:
-    st.session_state.analysis_results = None
-
-if 'calculation_details' not in st.session_state:
-    st.session_state.calculation_details = {}
-
-# 侧边栏 - 参数配置
-st.sidebar.header("⚙️ 标准参数配置")
-
-# 1. 基本温度参数
-st.sidebar.subheader("基本温度参数")
-t_smn = st.sidebar.number_input("恒温阶段最低预热温度 T_SMN (℃)",
-                                value=st.session_state.saved_params.get('t_smn', 150),
-                                key="t_smn")
-t_smax = st.sidebar.number_input("恒温阶段最高预热温度 T_SMAX (℃)",
-                                 value=st.session_state.saved_params.get('t_smax', 210),
-                                 key="t_smax")
-t_l = st.sidebar.number_input("锡膏液相线温度 TL (℃)",
-                              value=st.session_state.saved_params.get('t_l', 217),
-                              key="t_l")
-tp_min = st.sidebar.number_input("峰值温度 TP 最小值 (℃)",
-                                 value=st.session_state.saved_params.get('tp_min', 235),
-                                 key="tp_min")
-tp_max = st.sidebar.number_input("峰值温度 TP 最大值 (℃)",
-                                 value=st.session_state.saved_params.get('tp_max', 255),
-                                 key="tp_max")
-
-# 2. 详细参数标准
-st.sidebar.subheader("详细工艺参数标准")
-
-col1, col2 = st.sidebar.columns(2)
-
-with col1:
-    st.markdown("**预热阶段**")
-    preheat_slope_min = st.number_input("预热斜率最小值 (℃/s)",
-                                        value=st.session_state.saved_params.get('preheat_slope_min', 1.0),
-                                        key="preheat_slope_min")
-    preheat_slope_max = st.number_input("预热斜率最大值 (℃/s)",
-                                        value=st.session_state.saved_params.get('preheat_slope_max', 2.5),
-                                        key="preheat_slope_max")
-    preheat_time_min = st.number_input("预热时间最小值 (s)",
-                                       value=st.session_state.saved_params.get('preheat_time_min', 30),
-                                       key="preheat_time_min")
-    preheat_time_max = st.number_input("预热时间最大值 (s)",
-                                       value=st.session_state.saved_params.get('preheat_time_max', 60),
-                                       key="preheat_time_max")
-
-    st.markdown("**恒温阶段**")
-    soak_slope_min = st.number_input("恒温斜率最小值 (℃/s)",
-                                     value=st.session_state.saved_params.get('soak_slope_min', 0.5),
-                                     key="soak_slope_min")
-    soak_slope_max = st.number_input("恒温斜率最大值 (℃/s)",
-                                     value=st.session_state.saved_params.get('soak_slope_max', 1.0),
-                                     key="soak_slope_max")
-    soak_time_min = st.number_input("恒温时间最小值 (s)",
-                                    value=st.session_state.saved_params.get('soak_time_min', 60),
-                                    key="soak_time_min")
-    soak_time_max = st.number_input("恒温时间最大值 (s)",
-                                    value=st.session_state.saved_params.get('soak_time_max', 90),
-                                    key="soak_time_max")
-
-with col2:
-    st.markdown("**熔融阶段**")
-    tl_to_tp_slope_min = st.number_input("TL到TP上升速率最小值 (℃/s)",
-                                         value=st.session_state.saved_params.get('tl_to_tp_slope_min', 1.0),
-                                         key="tl_to_tp_slope_min")
-    tl_to_tp_slope_max = st.number_input("TL到TP上升速率最大值 (℃/s)",
-                                         value=st.session_state.saved_params.get('tl_to_tp_slope_max', 2.0),
-                                         key="tl_to_tp_slope_max")
-    tl_time_min = st.number_input("TL以上时间最小值 (s)",
-                                  value=st.session_state.saved_params.get('tl_time_min', 40),
-                                  key="tl_time_min")
-    tl_time_max = st.number_input("TL以上时间最大值 (s)",
-                                  value=st.session_state.saved_params.get('tl_time_max', 70),
-                                  key="tl_time_max")
-
-    st.markdown("**冷却阶段**")
-    tp_to_tl_slope_min = st.number_input("TP到TL下降速率最小值 (℃/s)",
-                                         value=st.session_state.saved_params.get('tp_to_tl_slope_min', 1.5),
-                                         key="tp_to_tl_slope_min")
-    tp_to_tl_slope_max = st.number_input("TP到TL下降速率最大值 (℃/s)",
-                                         value=st.session_state.saved_params.get('tp_to_tl_slope_max', 3.0),
-                                         key="tp_to_tl_slope_max")
-    tp_time_max = st.number_input("TP±5℃内时间最大值 (s)",
-                                  value=st.session_state.saved_params.get('tp_time_max', 90),
-                                  key="tp_time_max")
-
-# 保存参数按钮
-if st.sidebar.button("💾 保存当前参数配置"):
-    st.session_state.saved_params = {
-        't_smn': t_smn, 't_smax': t_smax, 't_l': t_l,
-        'tp_min': tp_min, 'tp_max': tp_max,
-        'preheat_slope_min': preheat_slope_min,
-        'preheat_slope_max': preheat_slope_max,
-        'preheat_time_min': preheat_time_min,
-        'preheat_time_max': preheat_time_max,
-        'soak_slope_min': soak_slope_min,
-        'soak_slope_max': soak_slope_max,
-        'soak_time_min': soak_time_min,
-        'soak_time_max': soak_time_max,
-        'tl_to_tp_slope_min': tl_to_tp_slope_min,
-        'tl_to_tp_slope_max': tl_to_tp_slope_max,
-        'tl_time_min': tl_time_min,
-        'tl_time_max': tl_time_max,
-        'tp_to_tl_slope_min': tp_to_tl_slope_min,
-        'tp_to_tl_slope_max': tp_to_tl_slope_max,
-        'tp_time_max': tp_time_max
-    }
-    st.sidebar.success("参数配置已保存！")
-
-# 重置为默认参数按钮
-if st.sidebar.button("🔄 重置为默认参数"):
-    st.session_state.saved_params = DEFAULT_PARAMS.copy()
-    st.sidebar.success("已重置为默认参数！")
-    st.rerun()
-
-# 主界面
-tab1, tab2, tab3 = st.tabs(["📊 数据输入", "📈 曲线分析", "✅ 结果报告"])
-
-with tab1:
-    st.header("数据输入")
-
-    # 数据输入方式选择
-    input_method = st.radio("选择数据输入方式:",
-                            ["使用示例数据", "粘贴数据", "上传文件"])
-
-    data = None
-
-    if input_method == "使用示例数据":
-        # 提供示例数据
-        example_data = """秒	TC1	TC2	TC3	TC4	TC5	TC6	TC7
+# 示例炉温曲线（制表符分隔，采样间隔2秒）
+EXAMPLE_PROFILE_DATA = """秒	TC1	TC2	TC3	TC4	TC5	TC6	TC7
 0	73.73	28.51	28.4	29.62	29.84	29.56	29.34
 2	82.28	29.01	28.9	30.28	30.4	30.06	29.78
 4	96.4	29.62	29.56	31.01	31.06	30.67	30.23
@@ -364,289 +224,1023 @@ with tab1:
 348	48.06	104.78	99.56	101.56	108.62	106.73	111.01
 350	47.73	101.45	96.34	98.95	105.73	103.9	107.67"""
 
-        try:
-            data = pd.read_csv(StringIO(example_data), sep='\t')
-            st.session_state.data = data
-            st.success("已加载示例数据！")
-        except Exception as e:
-            st.error(f"示例数据格式错误: {e}")
 
-    elif input_method == "粘贴数据":
-        pasted_data = st.text_area("粘贴炉温曲线数据 (制表符分隔):", height=300)
-        if pasted_data:
-            try:
-                data = pd.read_csv(StringIO(pasted_data), sep='\t')
-                st.session_state.data = data
-                st.success(f"成功加载数据，共{len(data)}行")
-            except Exception as e:
-                st.error(f"数据格式错误: {e}")
+# 整理曲线分析的输入：temps为 时间×感温线 的二维数组（一维时视为单条感温线），
+# time_values为共用的一维采样时间，或与temps同形状的各感温线采样时间；返回形状相同的 (times, temps)
+def profile_time_matrix(time_values, temps):
+    temps = np.asarray(temps, dtype=float)
+    if temps.ndim == 1:
+        temps = temps[:, None]
+    time_values = np.asarray(time_values, dtype=float)
+    times = np.broadcast_to(time_values.reshape(len(time_values), -1), temps.shape)
+    return times, temps
+
+
+# 矩阵化分析多条感温线（输入见profile_time_matrix），返回 {指标: 各感温线的取值数组}，未检测到的指标为NaN
+def analyze_temperature_matrix(time_values, temps, analysis_params=None):
+    analysis_params = analysis_params or DEFAULT_PARAMS
+    t_smn = analysis_params.get('t_smn', 150)
+    t_smax = analysis_params.get('t_smax', 210)
+    t_l = analysis_params.get('t_l', 217)
+    times, temps = profile_time_matrix(time_values, temps)
+    n_samples, n_channels = temps.shape
+    channel_index = np.arange(n_channels)
+
+    # 基本参数：峰值温度与峰值时间（全为NaN的感温线记为NaN）
+    has_data = ~np.isnan(temps).all(axis=0)
+    peak_index = np.where(np.isnan(temps), -np.inf, temps).argmax(axis=0)
+    peak_temp = np.where(has_data, temps[peak_index, channel_index], np.nan)
+    peak_time = np.where(has_data, times[peak_index, channel_index], np.nan)
+
+    # 各阶段的温度区间堆叠为 阶段×时间×感温线 的掩码，一次归约得到所有阶段的首末采样点
+    # 阶段顺序：预热(25℃到T_SMN)、恒温(T_SMN到T_SMAX)、TL以上、TP±5℃、峰值前TL以上、峰值后TL以上
+    above_tl = temps >= t_l
+    masks = np.stack([
+        (temps >= 25) & (temps <= t_smn),
+        (temps >= t_smn) & (temps <= t_smax),
+        above_tl,
+        (temps >= peak_temp - 5) & (temps <= peak_temp + 5),
+        above_tl & (times <= peak_time),
+        above_tl & (times >= peak_time)
+    ])
+    counts = masks.sum(axis=1)
+    first = masks.argmax(axis=1)
+    last = n_samples - 1 - masks[:, ::-1].argmax(axis=1)
+    durations = times[last, channel_index] - times[first, channel_index]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        slopes = (temps[last, channel_index] - temps[first, channel_index]) / durations
+
+    # 时长至少需要1个采样点，斜率至少需要2个采样点
+    has_span, has_slope = counts >= 1, counts > 1
+    return {
+        'preheat_slope': np.where(has_slope[0], slopes[0], np.nan),
+        'preheat_time': np.where(has_slope[0], durations[0], np.nan),
+        'soak_slope': np.where(has_slope[1], slopes[1], np.nan),
+        'soak_time': np.where(has_slope[1], durations[1], np.nan),
+        'tl_time': np.where(has_span[2], durations[2], np.nan),
+        'tp_time': np.where(has_span[3], durations[3], np.nan),
+        'tl_to_tp_slope': np.where(has_slope[4], slopes[4], np.nan),
+        'tp_to_tl_slope': np.where(has_slope[5], np.abs(slopes[5]), np.nan),
+        'peak_temp': peak_temp,
+        'peak_time': peak_time
+    }
 
-    else:  # 上传文件
-        uploaded_file = st.file_uploader("上传CSV或Excel文件", type=['csv', 'xlsx', 'xls'])
-        if uploaded_file:
-            try:
-                if uploaded_file.name.endswith('.csv'):
-                    data = pd.read_csv(uploaded_file)
-                else:
-                    data = pd.read_excel(uploaded_file)
-                st.session_state.data = data
-                st.success(f"成功加载数据，共{len(data)}行")
-            except Exception as e:
-                st.error(f"文件读取错误: {e}")
 
-    # 显示数据预览
-    if st.session_state.data is not None:
-        st.subheader("数据预览")
-        st.dataframe(st.session_state.data.head(10))
+# 插值求各阈值的穿越：times与temps为 时间×感温线 的数组，thresholds为 阈值×感温线 的数组，
+# 第i段为采样点i到i+1之间，返回 (上升穿越掩码, 下降穿越掩码, 穿越时间)，形状均为 阈值×段×感温线；含NaN的段不计穿越
+def find_threshold_crossings(times, temps, thresholds):
+    above = temps[None] >= thresholds[:, None, :]
+    valid = ~(np.isnan(temps[:-1]) | np.isnan(temps[1:]))
+    rising = ~above[:, :-1] & above[:, 1:] & valid
+    falling = above[:, :-1] & ~above[:, 1:] & valid
+    with np.errstate(divide='ignore', invalid='ignore'):
+        fraction = (thresholds[:, None, :] - temps[:-1]) / (temps[1:] - temps[:-1])
+    crossing_times = times[:-1] + np.clip(fraction, 0, 1) * np.diff(times, axis=0)
+    return rising, falling, crossing_times
+
+
+# 线性插值求各感温线在阈值以上的累计时间（曲线回落后再次超过阈值时分段累加），thresholds形状为 阈值×感温线
+def time_above_thresholds(times, temps, thresholds):
+    d0 = temps[:-1] - thresholds[:, None, :]
+    d1 = temps[1:] - thresholds[:, None, :]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        fraction = (np.maximum(d0, 0) + np.maximum(d1, 0)) / (np.abs(d0) + np.abs(d1))
+    fraction = np.where((d0 == 0) & (d1 == 0), 1.0, fraction)
+    fraction = np.where(np.isnan(fraction), 0.0, fraction)
+    return (fraction * np.diff(times, axis=0)).sum(axis=1)
+
+
+# 取每个阈值、每条感温线第一个（或最后一个）满足掩码的穿越时间，没有时为NaN
+def pick_crossing_time(mask, crossing_times, last=False):
+    index = (mask.shape[1] - 1 - mask[:, ::-1].argmax(axis=1)) if last else mask.argmax(axis=1)
+    times = np.take_along_axis(crossing_times, index[:, None, :], axis=1)[:, 0]
+    return np.where(mask.any(axis=1), times, np.nan)
+
+
+# 阈值穿越插值分析多条感温线：各阶段起止时间取相邻采样点之间线性插值的阈值穿越时刻，
+# 采样间隔较大时结果不随采样点量化；参数与返回值同analyze_temperature_matrix
+def analyze_temperature_crossings(time_values, temps, analysis_params=None):
+    analysis_params = analysis_params or DEFAULT_PARAMS
+    t_smn = analysis_params.get('t_smn', 150)
+    t_smax = analysis_params.get('t_smax', 210)
+    t_l = analysis_params.get('t_l', 217)
+    times, temps = profile_time_matrix(time_values, temps)
+    n_channels = temps.shape[1]
+    channel_index = np.arange(n_channels)
+
+    # 峰值温度与峰值时间（全为NaN的感温线记为NaN）
+    has_data = ~np.isnan(temps).all(axis=0)
+    peak_index = np.where(np.isnan(temps), -np.inf, temps).argmax(axis=0)
+    peak_temp = np.where(has_data, temps[peak_index, channel_index], np.nan)
+    peak_time = np.where(has_data, times[peak_index, channel_index], np.nan)
+
+    # 阈值顺序：25℃、T_SMN、T_SMAX、TL
+    thresholds = np.array([25, t_smn, t_smax, t_l], dtype=float)[:, None].repeat(n_channels, axis=1)
+    rising, falling, crossing_times = find_threshold_crossings(times, temps, thresholds)
+    first_rising = pick_crossing_time(rising, crossing_times)
+    t_25, t_smn_up, t_smax_up = first_rising[0], first_rising[1], first_rising[2]
+
+    # 预热起点：起始温度已在25℃以上时取第一个采样点，否则取25℃的上升穿越
+    first_valid = (~np.isnan(temps)).argmax(axis=0)
+    starts_warm = temps[first_valid, channel_index] >= 25
+    preheat_start_time = np.where(starts_warm, times[first_valid, channel_index], t_25)
+    preheat_start_temp = np.where(starts_warm, temps[first_valid, channel_index], 25.0)
+
+    # TL到TP取峰值前最后一次上升穿越TL，TP到TL取峰值后第一次下降穿越TL
+    segment_start = times[:-1]
+    tl_up = pick_crossing_time(rising[3:] & (segment_start < peak_time), crossing_times[3:], last=True)[0]
+    tl_down = pick_crossing_time(falling[3:] & (segment_start >= peak_time), crossing_times[3:])[0]
+
+    # TL以上时间与TP-5℃以上时间按插值累计
+    time_above = time_above_thresholds(times, temps, np.vstack([np.full(n_channels, float(t_l)), peak_temp - 5]))
+    tl_time = np.where((temps >= t_l).any(axis=0), time_above[0], np.nan)
+
+    preheat_time = t_smn_up - preheat_start_time
+    soak_time = t_smax_up - t_smn_up
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return {
+            'preheat_slope': (t_smn - preheat_start_temp) / preheat_time,
+            'preheat_time': preheat_time,
+            'soak_slope': (t_smax - t_smn) / soak_time,
+            'soak_time': soak_time,
+            'tl_time': tl_time,
+            'tp_time': np.where(has_data, time_above[1], np.nan),
+            'tl_to_tp_slope': (peak_temp - t_l) / (peak_time - tl_up),
+            'tp_to_tl_slope': (peak_temp - t_l) / (tl_down - peak_time),
+            'peak_temp': peak_temp,
+            'peak_time': peak_time
+        }
+
+
+# 阶段参数的计算方式：crossing-阈值穿越插值，samples-温度区间内首末采样点
+ANALYSIS_METHODS = {
+    'crossing': ('阈值穿越插值', analyze_temperature_crossings),
+    'samples': ('区间首末采样点', analyze_temperature_matrix)
+}
+
+
+# 分析单条炉温曲线的各阶段参数（不依赖界面），返回 {指标: 数值}，未检测到的指标不出现
+def analyze_temperature_curve(time_series, temp_series, analysis_params=None, method='crossing'):
+    metrics = ANALYSIS_METHODS[method][1](time_series, temp_series, analysis_params)
+    return {metric: values[0] for metric, values in metrics.items() if not np.isnan(values[0])}
 
-        # 检查必要的列
-        required_cols = ['秒', 'TC2', 'TC3', 'TC4', 'TC5', 'TC6', 'TC7']
-        if all(col in st.session_state.data.columns for col in required_cols):
-            st.success("✅ 数据格式正确，可进行分析")
-        else:
-            st.error("数据缺少必要的列，请确保包含: 秒, TC2, TC3, TC4, TC5, TC6, TC7")
 
-with tab2:
-    st.header("炉温曲线分析")
+# 炉温曲线数据的时间列与参与判定的感温线（TC1不参与分析）
+TIME_COLUMN = '秒'
+TC_COLUMNS = ['TC2', 'TC3', 'TC4', 'TC5', 'TC6', 'TC7']
 
-    if st.session_state.data is None:
-        st.warning("请先在'数据输入'标签页加载数据")
+# 判定项目：指标 -> (名称, 单位, 下限参数, 上限参数)，参数为None表示该侧不限
+PROFILE_CHECKS = {
+    'peak_temp': ('峰值温度', '℃', 'tp_min', 'tp_max'),
+    'preheat_slope': ('预热斜率', '℃/s', 'preheat_slope_min', 'preheat_slope_max'),
+    'preheat_time': ('预热时间', 's', 'preheat_time_min', 'preheat_time_max'),
+    'soak_slope': ('恒温斜率', '℃/s', 'soak_slope_min', 'soak_slope_max'),
+    'soak_time': ('恒温时间', 's', 'soak_time_min', 'soak_time_max'),
+    'tl_to_tp_slope': ('TL到TP上升速率', '℃/s', 'tl_to_tp_slope_min', 'tl_to_tp_slope_max'),
+    'tl_time': ('TL以上时间', 's', 'tl_time_min', 'tl_time_max'),
+    'tp_to_tl_slope': ('TP到TL下降速率', '℃/s', 'tp_to_tl_slope_min', 'tp_to_tl_slope_max'),
+    'tp_time': ('TP±5℃内时间', 's', None, 'tp_time_max')
+}
+
+# 批处理支持的炉温曲线文件类型（CSV/TXT自动识别逗号或制表符分隔）
+PROFILE_FILE_EXTENSIONS = ('.csv', '.txt', '.xlsx', '.xls')
+
+
+# 一次矩阵分析数据中的全部感温线，返回 {感温线: 结果字典}（网页与命令行批处理共用）
+def analyze_temperature_channels(data, analysis_params=None, channels=None, method='crossing'):
+    channels = [tc for tc in (channels or TC_COLUMNS) if tc in data.columns]
+    temps = data[channels].apply(pd.to_numeric, errors='coerce').to_numpy(dtype=float)
+    metrics = ANALYSIS_METHODS[method][1](pd.to_numeric(data[TIME_COLUMN], errors='coerce'), temps,
+                                          analysis_params)
+    return {tc: {metric: values[i] for metric, values in metrics.items() if not np.isnan(values[i])}
+            for i, tc in enumerate(channels)}
+
+
+# 按标准参数判定一条曲线的分析结果，返回各判定项目的明细（未检测到的指标判为不合格）
+def evaluate_profile_results(results, params=None):
+    params = params or DEFAULT_PARAMS
+    checks = []
+    for metric, (name, unit, low_key, high_key) in PROFILE_CHECKS.items():
+        value = results.get(metric)
+        low = params.get(low_key) if low_key else None
+        high = params.get(high_key) if high_key else None
+        if value is None or pd.isna(value):
+            value, passed = None, False
+        else:
+            value = float(value)
+            passed = (low is None or value >= low) and (high is None or value <= high)
+        checks.append({'metric': metric, 'name': name, 'unit': unit, 'value': value,
+                       'min': low, 'max': high, 'passed': passed})
+    return checks
+
+
+# 读取炉温曲线文件（文件路径或上传的文件对象），检查时间列与感温线列
+def read_profile_file(file, encoding='utf-8-sig'):
+    file_ext = os.path.splitext(getattr(file, 'name', file))[1].lower()
+    if file_ext in ('.xlsx', '.xls'):
+        data = pd.read_excel(file)
+    elif file_ext in ('.csv', '.txt'):
+        try:
+            data = pd.read_csv(file, sep=None, engine='python', encoding=encoding)
+        except UnicodeDecodeError:
+            if hasattr(file, 'seek'):
+                file.seek(0)
+            data = pd.read_csv(file, sep=None, engine='python', encoding='gbk')
     else:
-        data = st.session_state.data
-
-
-        # 分析参数计算函数
-        def analyze_temperature_curve(time_series, temp_series, analysis_params):
-            results = {}
-
-            # 基本参数
-            max_temp = temp_series.max()
-            max_time = time_series[temp_series.idxmax()]
-
-            # 1. 预热阶段 (25℃到T_SMN)
-            mask_preheat = (temp_series >= 25) & (temp_series <= analysis_params.get('t_smn', 150))
-            preheat_times = time_series[mask_preheat]
-            preheat_temps = temp_series[mask_preheat]
-            if len(preheat_times) > 1:
-                preheat_slope = (preheat_temps.iloc[-1] - preheat_temps.iloc[0]) / (
-                            preheat_times.iloc[-1] - preheat_times.iloc[0])
-                preheat_time = preheat_times.iloc[-1] - preheat_times.iloc[0]
-                results['preheat_slope'] = preheat_slope
-                results['preheat_time'] = preheat_time
-
-            # 2. 恒温阶段 (T_SMN到T_SMAX)
-            mask_soak = (temp_series >= analysis_params.get('t_smn', 150)) & (
-                        temp_series <= analysis_params.get('t_smax', 210))
-            soak_times = time_series[mask_soak]
-            soak_temps = temp_series[mask_soak]
-            if len(soak_times) > 1:
-                soak_slope = (soak_temps.iloc[-1] - soak_temps.iloc[0]) / (soak_times.iloc[-1] - soak_times.iloc[0])
-                soak_time = soak_times.iloc[-1] - soak_times.iloc[0]
-                results['soak_slope'] = soak_slope
-                results['soak_time'] = soak_time
-
-            # 3. TL以上时间
-            mask_above_tl = temp_series >= analysis_params.get('t_l', 217)
-            if mask_above_tl.any():
-                tl_times = time_series[mask_above_tl]
-                if len(tl_times) > 0:
-                    tl_time = tl_times.iloc[-1] - tl_times.iloc[0]
-                    results['tl_time'] = tl_time
-
-            # 4. TP±5℃内时间
-            mask_near_tp = (temp_series >= (max_temp - 5)) & (temp_series <= (max_temp + 5))
-            if mask_near_tp.any():
-                tp_times = time_series[mask_near_tp]
-                if len(tp_times) > 0:
-                    tp_time = tp_times.iloc[-1] - tp_times.iloc[0]
-                    results['tp_time'] = tp_time
-
-            # 5. TL到TP上升速率
-            mask_rising = (temp_series >= analysis_params.get('t_l', 217)) & (time_series <= max_time)
-            if mask_rising.any():
-                rising_times = time_series[mask_rising]
-                rising_temps = temp_series[mask_rising]
-                if len(rising_times) > 1:
-                    rise_slope = (rising_temps.iloc[-1] - rising_temps.iloc[0]) / (
-                                rising_times.iloc[-1] - rising_times.iloc[0])
-                    results['tl_to_tp_slope'] = rise_slope
-
-            # 6. TP到TL下降速率
-            mask_falling = (temp_series >= analysis_params.get('t_l', 217)) & (time_series >= max_time)
-            if mask_falling.any():
-                falling_times = time_series[mask_falling]
-                falling_temps = temp_series[mask_falling]
-                if len(falling_times) > 1:
-                    fall_slope = (falling_temps.iloc[-1] - falling_temps.iloc[0]) / (
-                                falling_times.iloc[-1] - falling_times.iloc[0])
-                    results['tp_to_tl_slope'] = abs(fall_slope)
-
-            results['peak_temp'] = max_temp
-            results['peak_time'] = max_time
-
-            return results
-
-
-        # 绘制曲线
-        fig, ax = plt.subplots(figsize=(14, 8))
-
-        # 定义区域颜色
-        zone_colors = {
-            'preheat': 'lightyellow',
-            'soak': 'lightblue',
-            'reflow': 'lightcoral',
-            'cooling': 'lightgreen'
-        }
+        raise ValueError(f"不支持的文件格式: {file_ext}")
+
+    data.columns = [str(col).strip() for col in data.columns]
+    if TIME_COLUMN not in data.columns:
+        raise ValueError(f"文件缺少时间列: {TIME_COLUMN}")
+    if not any(tc in data.columns for tc in TC_COLUMNS):
+        raise ValueError(f"文件缺少感温线列: {', '.join(TC_COLUMNS)}")
+    return data
+
+
+# 多板炉温曲线堆叠：temps为 板×采样点×感温线 的三维数组，times为 板×采样点 的采样时间，
+# 各板采样点数不同时温度以NaN补齐、时间重复最后时刻（补齐段时长为0，不影响各项指标）
+class ProfileStack:
+    def __init__(self, runs, channels, times, temps, lengths):
+        self.runs = list(runs)
+        self.channels = list(channels)
+        self.times = times
+        self.temps = temps
+        self.lengths = lengths
+
+    # 一次分析所有板的全部感温线：三维数组展开为 采样点×(板×感温线) 后调用矩阵分析，
+    # 返回 {指标: 板×感温线 的取值数组}
+    def analyze(self, analysis_params=None, method='crossing'):
+        n_runs, n_samples, n_channels = self.temps.shape
+        temps = self.temps.transpose(1, 0, 2).reshape(n_samples, n_runs * n_channels)
+        times = np.repeat(self.times.T, n_channels, axis=1)
+        metrics = ANALYSIS_METHODS[method][1](times, temps, analysis_params)
+        return {metric: values.reshape(n_runs, n_channels) for metric, values in metrics.items()}
+
+    # 各板的对齐基准时间：time-第一个采样点，tl-各感温线首次上升穿越TL时刻的平均值（未达到TL的板为NaN）
+    def reference_times(self, align='time', analysis_params=None):
+        if align == 'time':
+            return self.times[:, 0].copy()
+        t_l = (analysis_params or DEFAULT_PARAMS).get('t_l', 217)
+        n_runs, n_samples, n_channels = self.temps.shape
+        temps = self.temps.transpose(1, 0, 2).reshape(n_samples, n_runs * n_channels)
+        times = np.repeat(self.times.T, n_channels, axis=1)
+        rising, _, crossing_times = find_threshold_crossings(times, temps, np.full((1, temps.shape[1]), float(t_l)))
+        tl_up = pick_crossing_time(rising, crossing_times)[0].reshape(n_runs, n_channels)
+        counts = (~np.isnan(tl_up)).sum(axis=1)
+        return np.where(counts > 0, np.nansum(tl_up, axis=1) / np.maximum(counts, 1), np.nan)
+
+    # 把各板曲线按基准时间对齐后线性插值到共同的时间网格，返回 (网格时间, 板×网格×感温线 的温度)，
+    # 超出该板采样范围或无法对齐的板为NaN；所有板的插值位置通过一次searchsorted求得
+    def align(self, align='time', step=None, analysis_params=None):
+        n_runs = len(self.runs)
+        reference = self.reference_times(align, analysis_params)
+        aligned_runs = ~np.isnan(reference)
+        shifted = self.times - np.where(aligned_runs, reference, self.times[:, 0])[:, None]
+        sample_mask = np.arange(self.times.shape[1]) < self.lengths[:, None]
+        if step is None:
+            intervals = np.diff(self.times, axis=1)[sample_mask[:, 1:]]
+            step = float(np.median(intervals)) if intervals.size else 1.0
+        first_shift = shifted[:, 0]
+        last_shift = shifted[np.arange(n_runs), self.lengths - 1]
+        grid = np.arange(first_shift[aligned_runs].min(), last_shift[aligned_runs].max() + step / 2, step) \
+            if aligned_runs.any() else np.array([])
+
+        # 每板的时间加上 板号×跨度 后首尾相接成一个递增序列，一次searchsorted定位所有板的网格点
+        origin = shifted[sample_mask].min()
+        span = shifted[sample_mask].max() - origin + step + 1
+        keys = (shifted - origin + np.arange(n_runs)[:, None] * span)[sample_mask]
+        values = self.temps[sample_mask]
+        row_start = np.concatenate([[0], np.cumsum(self.lengths)[:-1]])
+        queries = grid[None, :] - origin + np.arange(n_runs)[:, None] * span
+        index = np.searchsorted(keys, queries, side='right') - 1
+        index = np.clip(index, row_start[:, None], (row_start + self.lengths - 2)[:, None])
+        with np.errstate(divide='ignore', invalid='ignore'):
+            weight = ((queries - keys[index]) / (keys[index + 1] - keys[index]))[..., None]
+        aligned = values[index] * (1 - weight) + values[index + 1] * weight
+        inside = (grid[None, :] >= first_shift[:, None]) & (grid[None, :] <= last_shift[:, None]) \
+            & aligned_runs[:, None]
+        return grid, np.where(inside[..., None], aligned, np.nan)
+
+
+# 多板对比的曲线对齐方式
+PROFILE_ALIGN_MODES = {'time': '按采样起点', 'tl': '按TL穿越时刻'}
+
+
+# 读取多个上传的炉温曲线文件（(文件名, 内容) 元组），返回 ({文件名: 数据}, [错误信息])
+@st.cache_data
+def load_profile_files(files):
+    profiles, errors = {}, []
+    for name, content in files:
+        buffer = BytesIO(content)
+        buffer.name = name
+        try:
+            profiles[name] = read_profile_file(buffer)
+        except Exception as e:
+            errors.append(f"{name}: {e}")
+    return profiles, errors
+
+
+# 把多条炉温曲线（{板/批次名: 数据}）堆叠为ProfileStack，时间排序并去除重复采样，缺少的感温线为NaN
+def build_profile_stack(profiles, channels=None):
+    channels = [tc for tc in (channels or TC_COLUMNS) if any(tc in data.columns for data in profiles.values())]
+    cleaned = {}
+    for name, data in profiles.items():
+        frame = pd.DataFrame({TIME_COLUMN: pd.to_numeric(data[TIME_COLUMN], errors='coerce')})
+        for tc in channels:
+            frame[tc] = pd.to_numeric(data[tc], errors='coerce') if tc in data.columns else np.nan
+        frame = frame.dropna(subset=[TIME_COLUMN]).drop_duplicates(TIME_COLUMN).sort_values(TIME_COLUMN)
+        if len(frame) < 2:
+            raise ValueError(f"{name}: 有效采样点少于2个")
+        cleaned[name] = frame
+    lengths = np.array([len(frame) for frame in cleaned.values()])
+    n_samples = lengths.max()
+    times = np.empty((len(cleaned), n_samples))
+    temps = np.full((len(cleaned), n_samples, len(channels)), np.nan)
+    for i, frame in enumerate(cleaned.values()):
+        times[i, :lengths[i]] = frame[TIME_COLUMN].to_numpy()
+        times[i, lengths[i]:] = times[i, lengths[i] - 1]
+        temps[i, :lengths[i]] = frame[channels].to_numpy()
+    return ProfileStack(cleaned.keys(), channels, times, temps, lengths)
+
+
+# 过程能力：按判定项目的规格限统计各指标在所有板上的分布与Cpk（单侧规格只按该侧计算），
+# by_channel为True时按感温线分别统计；未检测到的指标计为不合格
+def summarize_profile_capability(metrics, channels, params=None, by_channel=False):
+    params = params or DEFAULT_PARAMS
+    measured = ~np.isnan(metrics['peak_temp'])
+    groups = [(tc, [i]) for i, tc in enumerate(channels)] if by_channel else [('全部', list(range(len(channels))))]
+    rows = []
+    for metric, (name, unit, low_key, high_key) in PROFILE_CHECKS.items():
+        low = params.get(low_key) if low_key else None
+        high = params.get(high_key) if high_key else None
+        for group, columns in groups:
+            values = metrics[metric][:, columns][measured[:, columns]]
+            detected = values[np.isfinite(values)]
+            passed = (detected >= (-np.inf if low is None else low)) & (detected <= (np.inf if high is None else high))
+            mean = detected.mean() if detected.size else np.nan
+            std = detected.std(ddof=1) if detected.size > 1 else np.nan
+            capability = []
+            if std > 0:
+                if high is not None:
+                    capability.append((high - mean) / (3 * std))
+                if low is not None:
+                    capability.append((mean - low) / (3 * std))
+            rows.append({
+                '指标': f"{name}({unit})", '感温线': group, '样本数': int(values.size),
+                '未检测到': int(values.size - detected.size), '均值': mean, '标准差': std,
+                '最小值': detected.min() if detected.size else np.nan,
+                '最大值': detected.max() if detected.size else np.nan,
+                '下限': low, '上限': high,
+                '合格率(%)': passed.sum() / values.size * 100 if values.size else np.nan,
+                'Cpk': min(capability) if capability else np.nan
+            })
+    return pd.DataFrame(rows)
+
+
+# 分析一个炉温曲线文件的全部感温线并逐项判定，返回 {'summary': 文件汇总, 'channels': {感温线: 结果与判定明细}}
+def analyze_profile_file(path, params=None, method='crossing'):
+    params = {**DEFAULT_PARAMS, **(params or {})}
+    summary = {'文件名': os.path.basename(path), '状态': '成功', '判定': '', '错误': '', '感温线数': 0,
+               '不合格项': ''}
+    channels = {}
+    try:
+        data = read_profile_file(path)
+        for tc, results in analyze_temperature_channels(data, params, method=method).items():
+            channels[tc] = {
+                'results': {key: None if pd.isna(value) else float(value) for key, value in results.items()},
+                'checks': evaluate_profile_results(results, params)
+            }
+        failed = [f"{tc} {check['name']}" for tc, channel in channels.items()
+                  for check in channel['checks'] if not check['passed']]
+        summary.update({'判定': '不合格' if failed else '合格', '感温线数': len(channels),
+                        '不合格项': '; '.join(failed)})
+    except Exception as e:
+        summary.update({'状态': '失败', '错误': f"{type(e).__name__}: {e}"})
+    return {'summary': summary, 'channels': channels}
+
+
+# 把各文件的判定结果展开为 文件×感温线 的明细表
+def build_profile_detail_table(reports):
+    rows = []
+    for report in reports:
+        for tc, channel in report['channels'].items():
+            row = {'文件名': report['summary']['文件名'], '感温线': tc}
+            for check in channel['checks']:
+                row[f"{check['name']}({check['unit']})"] = check['value']
+            failed = [check['name'] for check in channel['checks'] if not check['passed']]
+            row['判定'] = '不合格' if failed else '合格'
+            row['不合格项'] = '; '.join(failed)
+            rows.append(row)
+    return pd.DataFrame(rows)
+
+
+# 并行分析目录下的所有炉温曲线文件，写入判定汇总/明细（CSV）和完整报告（JSON），返回汇总表
+def run_profile_batch(input_dir, output_dir, params=None, workers=None, logger=None, method='crossing'):
+    logger = logger or logging.getLogger(__name__)
+    params = {**DEFAULT_PARAMS, **(params or {})}
+    paths = sorted(
+        os.path.join(input_dir, name) for name in os.listdir(input_dir)
+        if name.lower().endswith(PROFILE_FILE_EXTENSIONS) and not name.startswith('~$')
+    )
+    os.makedirs(output_dir, exist_ok=True)
+    if not paths:
+        logger.warning("目录 %s 中没有可分析的炉温曲线文件", input_dir)
+        return pd.DataFrame()
+
+    start_time = time.time()
+    reports = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(analyze_profile_file, path, params, method): path for path in paths}
+        for future in as_completed(futures):
+            report = future.result()
+            reports.append(report)
+            summary = report['summary']
+            if summary['状态'] != '成功':
+                logger.error("%s: 分析失败 - %s", summary['文件名'], summary['错误'])
+            elif summary['判定'] == '不合格':
+                logger.warning("%s: 不合格 - %s", summary['文件名'], summary['不合格项'])
+            else:
+                logger.info("%s: 合格（%d 条感温线）", summary['文件名'], summary['感温线数'])
+    reports.sort(key=lambda report: report['summary']['文件名'])
+
+    summary_df = pd.DataFrame([report['summary'] for report in reports])
+    summary_df.to_csv(os.path.join(output_dir, '炉温曲线判定汇总.csv'), index=False, encoding='utf-8-sig')
+    build_profile_detail_table(reports).to_csv(os.path.join(output_dir, '炉温曲线判定明细.csv'), index=False,
+                                               encoding='utf-8-sig')
+    with open(os.path.join(output_dir, '炉温曲线判定报告.json'), 'w', encoding='utf-8') as f:
+        json.dump({'generated_at': pd.Timestamp.now().strftime('%Y-%m-%d %H:%M:%S'), 'params': params,
+                   'method': method, 'files': reports}, f, ensure_ascii=False, indent=2)
+    logger.info("共 %d 个文件：合格 %d 个，不合格 %d 个，失败 %d 个，总耗时 %.2f 秒", len(summary_df),
+                int((summary_df['判定'] == '合格').sum()), int((summary_df['判定'] == '不合格').sum()),
+                int((summary_df['状态'] != '成功').sum()), time.time() - start_time)
+    return summary_df
+
+
+# 读取标准参数JSON文件：须为 {参数名: 数值} 形式的对象，键须为DEFAULT_PARAMS中的参数，格式不符时抛出ValueError
+def load_params_file(path):
+    try:
+        with open(path, encoding='utf-8') as f:
+            custom_params = json.load(f)
+    except OSError as e:
+        raise ValueError(f"无法读取参数文件: {e}") from e
+    except (json.JSONDecodeError, UnicodeDecodeError) as e:
+        raise ValueError(f"参数文件不是有效的JSON: {e}") from e
+    if not isinstance(custom_params, dict):
+        raise ValueError("参数文件应为 {参数名: 数值} 形式的JSON对象")
+    unknown = sorted(set(custom_params) - set(DEFAULT_PARAMS))
+    if unknown:
+        raise ValueError(f"参数文件包含未知参数: {', '.join(unknown)}")
+    non_numeric = [key for key, value in custom_params.items()
+                   if isinstance(value, bool) or not isinstance(value, (int, float))]
+    if non_numeric:
+        raise ValueError(f"参数文件中以下参数的值不是数值: {', '.join(non_numeric)}")
+    return custom_params
+
+
+# 命令行入口：python 炉温曲线参数计算工具.py 输入目录 -o 输出目录 [选项]
+def batch_main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="炉温曲线批处理判定：并行分析目录下的所有炉温曲线文件，输出合格/不合格报告。"
+                    "退出码：0-全部合格，1-有文件分析失败，2-命令行参数或参数文件错误，3-有曲线不合格")
+    parser.add_argument('input_dir', help="炉温曲线文件目录（CSV/TXT/XLSX/XLS，需包含秒与TC2-TC7列）")
+    parser.add_argument('-o', '--output-dir', default='reflow_batch_output', help="输出目录")
+    parser.add_argument('-j', '--workers', type=int, default=None, help="并行进程数（默认为CPU核数）")
+    parser.add_argument('--params', default=None,
+                        help="标准参数JSON文件，键与DEFAULT_PARAMS相同，未给出的键使用默认值")
+    parser.add_argument('--method', choices=list(ANALYSIS_METHODS), default='crossing',
+                        help="阶段参数计算方式：crossing-阈值穿越插值（默认），samples-温度区间内首末采样点")
+    args = parser.parse_args(argv)
+
+    params = DEFAULT_PARAMS.copy()
+    if args.params:
+        try:
+            params.update(load_params_file(args.params))
+        except ValueError as e:
+            parser.error(str(e))
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    summary = run_profile_batch(args.input_dir, args.output_dir, params, args.workers,
+                                logging.getLogger("reflow_batch"), args.method)
+    if summary.empty or (summary['状态'] != '成功').any():
+        return 1
+    return 3 if (summary['判定'] == '不合格').any() else 0
+
+
+# 曲线图的感温线颜色与标准区域颜色（交互式与静态图共用）
+TC_COLORS = ['blue', 'green', 'red', 'purple', 'brown', 'pink']
+ZONE_COLORS = {
+    'preheat': 'lightyellow',
+    'soak': 'lightblue',
+    'reflow': 'lightcoral',
+    'cooling': 'lightgreen'
+}
+
+# 曲线图的绘制方式
+CURVE_RENDERERS = {'plotly': '交互式 (WebGL)', 'matplotlib': '静态图 (matplotlib)'}
+
+
+# 按需导入matplotlib（只有静态图使用，不在启动时导入），并设置中文字体
+def get_pyplot():
+    import matplotlib.pyplot as plt
+    plt.rcParams['font.sans-serif'] = ['SimHei', 'DejaVu Sans']
+    plt.rcParams['axes.unicode_minus'] = False
+    return plt
 
-        # 绘制标准区域 - 使用保存的参数
-        ax.axhspan(25, st.session_state.saved_params.get('t_smn', 150), alpha=0.3, color=zone_colors['preheat'],
-                   label='预热区')
-        ax.axhspan(st.session_state.saved_params.get('t_smn', 150), st.session_state.saved_params.get('t_smax', 210),
-                   alpha=0.3, color=zone_colors['soak'], label='浸润区')
-        ax.axhspan(st.session_state.saved_params.get('t_l', 217), st.session_state.saved_params.get('tp_max', 255),
-                   alpha=0.3, color=zone_colors['reflow'], label='熔融区')
 
-        # 绘制关键温度线
-        ax.axhline(y=st.session_state.saved_params.get('t_l', 217), color='red', linestyle='--', alpha=0.7,
-                   label=f'液相线 TL ({st.session_state.saved_params.get("t_l", 217)}℃)')
-        ax.axhline(y=st.session_state.saved_params.get('tp_min', 235), color='orange', linestyle='--', alpha=0.7,
-                   label=f'TP范围')
-        ax.axhline(y=st.session_state.saved_params.get('tp_max', 255), color='orange', linestyle='--', alpha=0.7)
+# 炉温曲线数据的指纹：时间列与感温线列的内容哈希
+def profile_fingerprint(data):
+    columns = [col for col in [TIME_COLUMN] + TC_COLUMNS if col in data.columns]
+    hashes = pd.util.hash_pandas_object(data[columns], index=False).to_numpy()
+    return hashlib.sha1(repr(columns).encode() + hashes.tobytes()).hexdigest()
 
-        # 绘制各TC曲线
-        tc_columns = ['TC2', 'TC3', 'TC4', 'TC5', 'TC6', 'TC7']
-        colors = ['blue', 'green', 'red', 'purple', 'brown', 'pink']
 
-        all_results = {}
+# 交互式曲线图的感温线轨迹（WebGL），按数据指纹缓存：修改标准参数时只重新叠加标准区域和关键温度线
+@st.cache_data(max_entries=8)
+def build_curve_base_figure(fingerprint, _data):
+    fig = go.Figure()
+    for color, tc in zip(TC_COLORS, TC_COLUMNS):
+        if tc in _data.columns:
+            fig.add_trace(go.Scattergl(x=_data[TIME_COLUMN], y=_data[tc], mode='lines', name=tc,
+                                       line=dict(color=color, width=2)))
+    fig.update_layout(title='炉温曲线分析', xaxis_title='时间 (秒)', yaxis_title='温度 (℃)',
+                      yaxis_range=[0, 300], height=650, hovermode='x unified')
+    return fig
 
-        for i, tc in enumerate(tc_columns):
-            if tc in data.columns:
-                ax.plot(data['秒'], data[tc], color=colors[i], label=tc, linewidth=2)
 
-                # 分析该曲线
-                results = analyze_temperature_curve(data['秒'], data[tc], st.session_state.saved_params)
-                all_results[tc] = results
+# 在曲线图上叠加标准区域与关键温度线
+def add_curve_spec_layers(fig, params):
+    t_smn, t_smax, t_l = params.get('t_smn', 150), params.get('t_smax', 210), params.get('t_l', 217)
+    tp_min, tp_max = params.get('tp_min', 235), params.get('tp_max', 255)
+    for y0, y1, zone, label in [(25, t_smn, 'preheat', '预热区'), (t_smn, t_smax, 'soak', '浸润区'),
+                                (t_l, tp_max, 'reflow', '熔融区')]:
+        fig.add_hrect(y0=y0, y1=y1, fillcolor=ZONE_COLORS[zone], opacity=0.3, line_width=0, layer='below',
+                      annotation_text=label, annotation_position='top left')
+    fig.add_hline(y=t_l, line_dash='dash', line_color='red', opacity=0.7, annotation_text=f"液相线 TL ({t_l}℃)")
+    fig.add_hline(y=tp_min, line_dash='dash', line_color='orange', opacity=0.7, annotation_text="TP范围")
+    fig.add_hline(y=tp_max, line_dash='dash', line_color='orange', opacity=0.7)
+    return fig
 
-        ax.set_xlabel('时间 (秒)')
-        ax.set_ylabel('温度 (℃)')
-        ax.set_title('炉温曲线分析')
-        ax.grid(True, alpha=0.3)
-        ax.legend()
-        ax.set_ylim(0, 300)
 
-        st.pyplot(fig)
+def main():
+    # 设置页面
+    st.set_page_config(page_title="炉温曲线分析系统", page_icon="📊", layout="wide")
 
-        # 保存分析结果
-        st.session_state.analysis_results = all_results
+    # 标题
+    st.title("🔥 无铅锡膏炉温曲线分析系统")
+    st.markdown("根据实测炉温曲线判断是否符合供应商推荐参数范围")
 
-with tab3:
-    st.header("分析结果报告")
+    # 初始化session state
+    if 'saved_params' not in st.session_state:
+        st.session_state.saved_params = DEFAULT_PARAMS.copy()
+
+    if 'data' not in st.session_state:
+        st.session_state.data = None
 
     if 'analysis_results' not in st.session_state:
-        st.warning("请先在'曲线分析'标签页进行分析")
-    else:
-        all_results = st.session_state.analysis_results
-        params = st.session_state.saved_params
-
-        # 总体统计
-        st.subheader("📈 总体统计")
-
-        summary_data = []
-        for tc, results in all_results.items():
-            summary_data.append({
-                '感温线': tc,
-                '峰值温度(℃)': f"{results.get('peak_temp', 0):.1f}",
-                '峰值时间(s)': f"{results.get('peak_time', 0):.1f}",
-                'TL以上时间(s)': f"{results.get('tl_time', 0):.1f}",
-                '预热斜率(℃/s)': f"{results.get('preheat_slope', 0):.2f}",
-                '恒温时间(s)': f"{results.get('soak_time', 0):.1f}"
-            })
+        st.session_state.analysis_results = None
+
+    if 'calculation_details' not in st.session_state:
+        st.session_state.calculation_details = {}
+
+    # 侧边栏 - 参数配置
+    st.sidebar.header("⚙️ 标准参数配置")
+
+    # 1. 基本温度参数
+    st.sidebar.subheader("基本温度参数")
+    t_smn = st.sidebar.number_input("恒温阶段最低预热温度 T_SMN (℃)",
+                                    value=st.session_state.saved_params.get('t_smn', 150),
+                                    key="t_smn")
+    t_smax = st.sidebar.number_input("恒温阶段最高预热温度 T_SMAX (℃)",
+                                     value=st.session_state.saved_params.get('t_smax', 210),
+                                     key="t_smax")
+    t_l = st.sidebar.number_input("锡膏液相线温度 TL (℃)",
+                                  value=st.session_state.saved_params.get('t_l', 217),
+                                  key="t_l")
+    tp_min = st.sidebar.number_input("峰值温度 TP 最小值 (℃)",
+                                     value=st.session_state.saved_params.get('tp_min', 235),
+                                     key="tp_min")
+    tp_max = st.sidebar.number_input("峰值温度 TP 最大值 (℃)",
+                                     value=st.session_state.saved_params.get('tp_max', 255),
+                                     key="tp_max")
+
+    # 2. 详细参数标准
+    st.sidebar.subheader("详细工艺参数标准")
+
+    col1, col2 = st.sidebar.columns(2)
+
+    with col1:
+        st.markdown("**预热阶段**")
+        preheat_slope_min = st.number_input("预热斜率最小值 (℃/s)",
+                                            value=st.session_state.saved_params.get('preheat_slope_min', 1.0),
+                                            key="preheat_slope_min")
+        preheat_slope_max = st.number_input("预热斜率最大值 (℃/s)",
+                                            value=st.session_state.saved_params.get('preheat_slope_max', 2.5),
+                                            key="preheat_slope_max")
+        preheat_time_min = st.number_input("预热时间最小值 (s)",
+                                           value=st.session_state.saved_params.get('preheat_time_min', 30),
+                                           key="preheat_time_min")
+        preheat_time_max = st.number_input("预热时间最大值 (s)",
+                                           value=st.session_state.saved_params.get('preheat_time_max', 60),
+                                           key="preheat_time_max")
+
+        st.markdown("**恒温阶段**")
+        soak_slope_min = st.number_input("恒温斜率最小值 (℃/s)",
+                                         value=st.session_state.saved_params.get('soak_slope_min', 0.5),
+                                         key="soak_slope_min")
+        soak_slope_max = st.number_input("恒温斜率最大值 (℃/s)",
+                                         value=st.session_state.saved_params.get('soak_slope_max', 1.0),
+                                         key="soak_slope_max")
+        soak_time_min = st.number_input("恒温时间最小值 (s)",
+                                        value=st.session_state.saved_params.get('soak_time_min', 60),
+                                        key="soak_time_min")
+        soak_time_max = st.number_input("恒温时间最大值 (s)",
+                                        value=st.session_state.saved_params.get('soak_time_max', 90),
+                                        key="soak_time_max")
+
+    with col2:
+        st.markdown("**熔融阶段**")
+        tl_to_tp_slope_min = st.number_input("TL到TP上升速率最小值 (℃/s)",
+                                             value=st.session_state.saved_params.get('tl_to_tp_slope_min', 1.0),
+                                             key="tl_to_tp_slope_min")
+        tl_to_tp_slope_max = st.number_input("TL到TP上升速率最大值 (℃/s)",
+                                             value=st.session_state.saved_params.get('tl_to_tp_slope_max', 2.0),
+                                             key="tl_to_tp_slope_max")
+        tl_time_min = st.number_input("TL以上时间最小值 (s)",
+                                      value=st.session_state.saved_params.get('tl_time_min', 40),
+                                      key="tl_time_min")
+        tl_time_max = st.number_input("TL以上时间最大值 (s)",
+                                      value=st.session_state.saved_params.get('tl_time_max', 70),
+                                      key="tl_time_max")
+
+        st.markdown("**冷却阶段**")
+        tp_to_tl_slope_min = st.number_input("TP到TL下降速率最小值 (℃/s)",
+                                             value=st.session_state.saved_params.get('tp_to_tl_slope_min', 1.5),
+                                             key="tp_to_tl_slope_min")
+        tp_to_tl_slope_max = st.number_input("TP到TL下降速率最大值 (℃/s)",
+                                             value=st.session_state.saved_params.get('tp_to_tl_slope_max', 3.0),
+                                             key="tp_to_tl_slope_max")
+        tp_time_max = st.number_input("TP±5℃内时间最大值 (s)",
+                                      value=st.session_state.saved_params.get('tp_time_max', 90),
+                                      key="tp_time_max")
+
+    # 保存参数按钮
+    if st.sidebar.button("💾 保存当前参数配置"):
+        st.session_state.saved_params = {
+            't_smn': t_smn, 't_smax': t_smax, 't_l': t_l,
+            'tp_min': tp_min, 'tp_max': tp_max,
+            'preheat_slope_min': preheat_slope_min,
+            'preheat_slope_max': preheat_slope_max,
+            'preheat_time_min': preheat_time_min,
+            'preheat_time_max': preheat_time_max,
+            'soak_slope_min': soak_slope_min,
+            'soak_slope_max': soak_slope_max,
+            'soak_time_min': soak_time_min,
+            'soak_time_max': soak_time_max,
+            'tl_to_tp_slope_min': tl_to_tp_slope_min,
+            'tl_to_tp_slope_max': tl_to_tp_slope_max,
+            'tl_time_min': tl_time_min,
+            'tl_time_max': tl_time_max,
+            'tp_to_tl_slope_min': tp_to_tl_slope_min,
+            'tp_to_tl_slope_max': tp_to_tl_slope_max,
+            'tp_time_max': tp_time_max
+        }
+        st.sidebar.success("参数配置已保存！")
 
-        st.dataframe(pd.DataFrame(summary_data))
+    # 重置为默认参数按钮
+    if st.sidebar.button("🔄 重置为默认参数"):
+        st.session_state.saved_params = DEFAULT_PARAMS.copy()
+        st.sidebar.success("已重置为默认参数！")
+        st.rerun()
 
-        # 详细分析
-        st.subheader("🔍 详细分析结果")
+    # 主界面
+    tab1, tab2, tab3, tab4 = st.tabs(["📊 数据输入", "📈 曲线分析", "✅ 结果报告", "📚 多板对比"])
 
-        for tc, results in all_results.items():
-            with st.expander(f"感温线 {tc} 分析结果"):
-                col1, col2 = st.columns(2)
+    with tab1:
+        st.header("数据输入")
 
-                with col1:
-                    # 峰值温度检查
-                    peak_temp = results.get('peak_temp', 0)
-                    tp_min = st.session_state.saved_params.get('tp_min', 235)
-                    tp_max = st.session_state.saved_params.get('tp_max', 255)
-                    if tp_min <= peak_temp <= tp_max:
-                        st.success(f"✅ 峰值温度: {peak_temp:.1f}℃ (符合 {tp_min}-{tp_max}℃)")
+        # 数据输入方式选择
+        input_method = st.radio("选择数据输入方式:",
+                                ["使用示例数据", "粘贴数据", "上传文件"])
+
+        data = None
+
+        if input_method == "使用示例数据":
+            # 提供示例数据
+            try:
+                data = pd.read_csv(StringIO(EXAMPLE_PROFILE_DATA), sep='\t')
+                st.session_state.data = data
+                st.success("已加载示例数据！")
+            except Exception as e:
+                st.error(f"示例数据格式错误: {e}")
+
+        elif input_method == "粘贴数据":
+            pasted_data = st.text_area("粘贴炉温曲线数据 (制表符分隔):", height=300)
+            if pasted_data:
+                try:
+                    data = pd.read_csv(StringIO(pasted_data), sep='\t')
+                    st.session_state.data = data
+                    st.success(f"成功加载数据，共{len(data)}行")
+                except Exception as e:
+                    st.error(f"数据格式错误: {e}")
+
+        else:  # 上传文件
+            uploaded_file = st.file_uploader("上传CSV或Excel文件", type=['csv', 'xlsx', 'xls'])
+            if uploaded_file:
+                try:
+                    if uploaded_file.name.endswith('.csv'):
+                        data = pd.read_csv(uploaded_file)
                     else:
-                        st.error(f"❌ 峰值温度: {peak_temp:.1f}℃ (超出 {tp_min}-{tp_max}℃)")
+                        data = pd.read_excel(uploaded_file)
+                    st.session_state.data = data
+                    st.success(f"成功加载数据，共{len(data)}行")
+                except Exception as e:
+                    st.error(f"文件读取错误: {e}")
+
+        # 显示数据预览
+        if st.session_state.data is not None:
+            st.subheader("数据预览")
+            st.dataframe(st.session_state.data.head(10))
+
+            # 检查必要的列
+            required_cols = ['秒', 'TC2', 'TC3', 'TC4', 'TC5', 'TC6', 'TC7']
+            if all(col in st.session_state.data.columns for col in required_cols):
+                st.success("✅ 数据格式正确，可进行分析")
+            else:
+                st.error("数据缺少必要的列，请确保包含: 秒, TC2, TC3, TC4, TC5, TC6, TC7")
+
+    with tab2:
+        st.header("炉温曲线分析")
+
+        if st.session_state.data is None:
+            st.warning("请先在'数据输入'标签页加载数据")
+        else:
+            data = st.session_state.data
+            analysis_method = st.radio(
+                "阶段参数计算方式:", list(ANALYSIS_METHODS),
+                format_func=lambda method: ANALYSIS_METHODS[method][0], horizontal=True, key="analysis_method",
+                help="阈值穿越插值在相邻采样点之间插值求T_SMN、T_SMAX、TL及TP-5℃的穿越时刻，采样间隔较大时更准确")
+            # 静态图需要matplotlib（可选依赖），未安装时只提供交互式绘图
+            renderers = [renderer for renderer in CURVE_RENDERERS
+                         if renderer != "matplotlib" or importlib.util.find_spec("matplotlib") is not None]
+            curve_renderer = st.radio("绘图方式:", renderers,
+                                      format_func=lambda renderer: CURVE_RENDERERS[renderer], horizontal=True,
+                                      key="curve_renderer")
+            params = st.session_state.saved_params
+
+            # 绘制曲线
+            if curve_renderer == "plotly":
+                # 感温线轨迹按数据指纹缓存，参数变化时只更新标准区域和关键温度线
+                fig = build_curve_base_figure(profile_fingerprint(data), data)
+                st.plotly_chart(add_curve_spec_layers(fig, params), use_container_width=True)
+            else:
+                plt = get_pyplot()
+                fig, ax = plt.subplots(figsize=(14, 8))
+
+                # 绘制标准区域 - 使用保存的参数
+                ax.axhspan(25, params.get('t_smn', 150), alpha=0.3, color=ZONE_COLORS['preheat'], label='预热区')
+                ax.axhspan(params.get('t_smn', 150), params.get('t_smax', 210), alpha=0.3, color=ZONE_COLORS['soak'],
+                           label='浸润区')
+                ax.axhspan(params.get('t_l', 217), params.get('tp_max', 255), alpha=0.3, color=ZONE_COLORS['reflow'],
+                           label='熔融区')
+
+                # 绘制关键温度线
+                ax.axhline(y=params.get('t_l', 217), color='red', linestyle='--', alpha=0.7,
+                           label=f'液相线 TL ({params.get("t_l", 217)}℃)')
+                ax.axhline(y=params.get('tp_min', 235), color='orange', linestyle='--', alpha=0.7, label='TP范围')
+                ax.axhline(y=params.get('tp_max', 255), color='orange', linestyle='--', alpha=0.7)
+
+                # 绘制各TC曲线
+                for color, tc in zip(TC_COLORS, TC_COLUMNS):
+                    if tc in data.columns:
+                        ax.plot(data['秒'], data[tc], color=color, label=tc, linewidth=2)
+
+                ax.set_xlabel('时间 (秒)')
+                ax.set_ylabel('温度 (℃)')
+                ax.set_title('炉温曲线分析')
+                ax.grid(True, alpha=0.3)
+                ax.legend()
+                ax.set_ylim(0, 300)
+
+                st.pyplot(fig)
+                plt.close(fig)
+
+            # 一次分析全部感温线
+            all_results = analyze_temperature_channels(data, params, method=analysis_method)
+
+            # 保存分析结果
+            st.session_state.analysis_results = all_results
+
+    with tab3:
+        st.header("分析结果报告")
+
+        if 'analysis_results' not in st.session_state:
+            st.warning("请先在'曲线分析'标签页进行分析")
+        else:
+            all_results = st.session_state.analysis_results
+            params = st.session_state.saved_params
+
+            # 总体统计
+            st.subheader("📈 总体统计")
+
+            summary_data = []
+            for tc, results in all_results.items():
+                summary_data.append({
+                    '感温线': tc,
+                    '峰值温度(℃)': f"{results.get('peak_temp', 0):.1f}",
+                    '峰值时间(s)': f"{results.get('peak_time', 0):.1f}",
+                    'TL以上时间(s)': f"{results.get('tl_time', 0):.1f}",
+                    '预热斜率(℃/s)': f"{results.get('preheat_slope', 0):.2f}",
+                    '恒温时间(s)': f"{results.get('soak_time', 0):.1f}"
+                })
+
+            st.dataframe(pd.DataFrame(summary_data))
+
+            # 详细分析
+            st.subheader("🔍 详细分析结果")
+
+            for tc, results in all_results.items():
+                with st.expander(f"感温线 {tc} 分析结果"):
+                    col1, col2 = st.columns(2)
+
+                    with col1:
+                        # 峰值温度检查
+                        peak_temp = results.get('peak_temp', 0)
+                        tp_min = st.session_state.saved_params.get('tp_min', 235)
+                        tp_max = st.session_state.saved_params.get('tp_max', 255)
+                        if tp_min <= peak_temp <= tp_max:
+                            st.success(f"✅ 峰值温度: {peak_temp:.1f}℃ (符合 {tp_min}-{tp_max}℃)")
+                        else:
+                            st.error(f"❌ 峰值温度: {peak_temp:.1f}℃ (超出 {tp_min}-{tp_max}℃)")
+
+                        # TL以上时间检查
+                        tl_time = results.get('tl_time', 0)
+                        tl_range = st.session_state.saved_params.get('tl_time', [40, 70])
+                        if tl_range[0] <= tl_time <= tl_range[1]:
+                            st.success(f"✅ TL以上时间: {tl_time:.1f}s (符合 {tl_range[0]}-{tl_range[1]}s)")
+                        else:
+                            st.error(f"❌ TL以上时间: {tl_time:.1f}s (超出 {tl_range[0]}-{tl_range[1]}s)")
+
+                    with col2:
+                        # 预热斜率检查
+                        preheat_slope = results.get('preheat_slope', 0)
+                        preheat_range = st.session_state.saved_params.get('preheat_slope', [1.0, 2.5])
+                        if preheat_range[0] <= preheat_slope <= preheat_range[1]:
+                            st.success(
+                                f"✅ 预热斜率: {preheat_slope:.2f}℃/s (符合 {preheat_range[0]}-{preheat_range[1]}℃/s)")
+                        else:
+                            st.error(f"❌ 预热斜率: {preheat_slope:.2f}℃/s (超出 {preheat_range[0]}-{preheat_range[1]}℃/s)")
+
+                    # 优化建议
+                    st.subheader("💡 优化建议")
+                    suggestions = []
+
+                    peak_temp = results.get('peak_temp', 0)
+                    if peak_temp < st.session_state.saved_params.get('tp_min', 235):
+                        suggestions.append("提高峰值温度，确保达到锡膏熔融要求")
+                    elif peak_temp > st.session_state.saved_params.get('tp_max', 255):
+                        suggestions.append("降低峰值温度，避免元件热损伤")
 
-                    # TL以上时间检查
                     tl_time = results.get('tl_time', 0)
-                    tl_range = st.session_state.saved_params.get('tl_time', [40, 70])
-                    if tl_range[0] <= tl_time <= tl_range[1]:
-                        st.success(f"✅ TL以上时间: {tl_time:.1f}s (符合 {tl_range[0]}-{tl_range[1]}s)")
-                    else:
-                        st.error(f"❌ TL以上时间: {tl_time:.1f}s (超出 {tl_range[0]}-{tl_range[1]}s)")
+                    if tl_time < st.session_state.saved_params.get('tl_time', [40, 70])[0]:
+                        suggestions.append("增加液相线以上时间，确保充分熔融")
+                    elif tl_time > st.session_state.saved_params.get('tl_time', [40, 70])[1]:
+                        suggestions.append("减少液相线以上时间，避免过度氧化")
 
-                with col2:
-                    # 预热斜率检查
                     preheat_slope = results.get('preheat_slope', 0)
-                    preheat_range = st.session_state.saved_params.get('preheat_slope', [1.0, 2.5])
-                    if preheat_range[0] <= preheat_slope <= preheat_range[1]:
-                        st.success(
-                            f"✅ 预热斜率: {preheat_slope:.2f}℃/s (符合 {preheat_range[0]}-{preheat_range[1]}℃/s)")
+                    if preheat_slope < st.session_state.saved_params.get('preheat_slope', [1.0, 2.5])[0]:
+                        suggestions.append("提高预热区升温速率")
+                    elif preheat_slope > st.session_state.saved_params.get('preheat_slope', [1.0, 2.5])[1]:
+                        suggestions.append("降低预热区升温速率，避免热冲击")
+
+                    if suggestions:
+                        for suggestion in suggestions:
+                            st.info(suggestion)
                     else:
-                        st.error(f"❌ 预热斜率: {preheat_slope:.2f}℃/s (超出 {preheat_range[0]}-{preheat_range[1]}℃/s)")
-
-                # 优化建议
-                st.subheader("💡 优化建议")
-                suggestions = []
-
-                peak_temp = results.get('peak_temp', 0)
-                if peak_temp < st.session_state.saved_params.get('tp_min', 235):
-                    suggestions.append("提高峰值温度，确保达到锡膏熔融要求")
-                elif peak_temp > st.session_state.saved_params.get('tp_max', 255):
-                    suggestions.append("降低峰值温度，避免元件热损伤")
-
-                tl_time = results.get('tl_time', 0)
-                if tl_time < st.session_state.saved_params.get('tl_time', [40, 70])[0]:
-                    suggestions.append("增加液相线以上时间，确保充分熔融")
-                elif tl_time > st.session_state.saved_params.get('tl_time', [40, 70])[1]:
-                    suggestions.append("减少液相线以上时间，避免过度氧化")
-
-                preheat_slope = results.get('preheat_slope', 0)
-                if preheat_slope < st.session_state.saved_params.get('preheat_slope', [1.0, 2.5])[0]:
-                    suggestions.append("提高预热区升温速率")
-                elif preheat_slope > st.session_state.saved_params.get('preheat_slope', [1.0, 2.5])[1]:
-                    suggestions.append("降低预热区升温速率，避免热冲击")
-
-                if suggestions:
-                    for suggestion in suggestions:
-                        st.info(suggestion)
-                else:
-                    st.success("✅ 曲线参数均在推荐范围内，工艺良好")
-
-        # 导出报告
-        st.subheader("📥 导出报告")
-        if st.button("生成详细分析报告"):
-            report_text = "无铅锡膏炉温曲线分析报告\n\n"
-            report_text += f"分析时间: {pd.Timestamp.now().strftime('%Y-%m-%d %H:%M:%S')}\n"
-            report_text += f"分析曲线数: {len(all_results)}\n\n"
+                        st.success("✅ 曲线参数均在推荐范围内，工艺良好")
+
+            # 导出报告
+            st.subheader("📥 导出报告")
+            if st.button("生成详细分析报告"):
+                report_text = "无铅锡膏炉温曲线分析报告\n\n"
+                report_text += f"分析时间: {pd.Timestamp.now().strftime('%Y-%m-%d %H:%M:%S')}\n"
+                report_text += f"分析曲线数: {len(all_results)}\n\n"
+
+                for tc, results in all_results.items():
+                    report_text += f"感温线 {tc}:\n"
+                    report_text += f"  峰值温度: {results.get('peak_temp', 0):.1f}℃\n"
+                    report_text += f"  TL以上时间: {results.get('tl_time', 0):.1f}s\n"
+                    report_text += f"  预热斜率: {results.get('preheat_slope', 0):.2f}℃/s\n\n"
+
+                st.download_button(
+                    label="下载分析报告",
+                    data=report_text,
+                    file_name="炉温曲线分析报告.txt",
+                    mime="text/plain"
+                )
+
+    with tab4:
+        st.header("多板炉温曲线对比")
+        uploaded_profiles = st.file_uploader("上传多个炉温曲线文件（每块板或每次测温一个文件）",
+                                             type=['csv', 'txt', 'xlsx', 'xls'], accept_multiple_files=True,
+                                             key="board_profile_uploader")
+
+        stack = None
+        if not uploaded_profiles:
+            st.info("上传多个炉温曲线文件后，按时间或TL穿越时刻对齐比较，并按标准参数计算各指标的分布与Cpk")
+        else:
+            profiles, errors = load_profile_files(tuple((f.name, f.getvalue()) for f in uploaded_profiles))
+            for error in errors:
+                st.error(f"文件读取错误: {error}")
+            try:
+                stack = build_profile_stack(profiles) if profiles else None
+            except ValueError as e:
+                st.error(f"曲线数据错误: {e}")
+
+        if stack is not None:
+            params = st.session_state.saved_params
+            method = st.session_state.get('analysis_method', 'crossing')
+            metrics = stack.analyze(params, method)
+            st.caption(f"共 {len(stack.runs)} 块板 × {stack.temps.shape[1]} 个采样点 × {len(stack.channels)} 条感温线，"
+                       f"阶段参数计算方式: {ANALYSIS_METHODS[method][0]}")
+
+            col1, col2 = st.columns(2)
+            with col1:
+                align_mode = st.radio("曲线对齐方式:", list(PROFILE_ALIGN_MODES),
+                                      format_func=lambda mode: PROFILE_ALIGN_MODES[mode], horizontal=True,
+                                      key="board_align_mode")
+            with col2:
+                channel = st.selectbox("显示感温线:", stack.channels, key="board_channel")
+
+            grid, aligned = stack.align(align_mode, analysis_params=params)
+            unaligned = [run for run, ref in zip(stack.runs, stack.reference_times(align_mode, params))
+                         if np.isnan(ref)]
+            if unaligned:
+                st.warning(f"以下曲线未达到TL，无法按TL对齐: {', '.join(unaligned)}")
+
+            # 对齐后的各板曲线与均值、包络
+            channel_temps = aligned[:, :, stack.channels.index(channel)]
+            fig = go.Figure()
+            for run, temps in zip(stack.runs, channel_temps):
+                fig.add_trace(go.Scattergl(x=grid, y=temps, mode='lines', name=run, opacity=0.5,
+                                           line=dict(width=1)))
+            counts = (~np.isnan(channel_temps)).sum(axis=0)
+            mean_temps = np.where(counts > 0, np.nansum(channel_temps, axis=0) / np.maximum(counts, 1), np.nan)
+            fig.add_trace(go.Scattergl(x=grid, y=np.fmax.reduce(channel_temps, axis=0), mode='lines', name='最大值',
+                                       line=dict(color='black', dash='dot')))
+            fig.add_trace(go.Scattergl(x=grid, y=np.fmin.reduce(channel_temps, axis=0), mode='lines', name='最小值',
+                                       line=dict(color='black', dash='dot')))
+            fig.add_trace(go.Scattergl(x=grid, y=mean_temps, mode='lines', name='均值',
+                                       line=dict(color='black', width=3)))
+            fig.add_hline(y=params.get('t_l', 217), line_dash='dash', line_color='red',
+                          annotation_text=f"TL ({params.get('t_l', 217)}℃)")
+            fig.add_hrect(y0=params.get('tp_min', 235), y1=params.get('tp_max', 255), fillcolor='orange',
+                          opacity=0.15, line_width=0)
+            fig.update_layout(title=f"{channel} 多板曲线对比", height=600,
+                              xaxis_title='时间 (秒)' if align_mode == 'time' else '相对TL穿越时刻 (秒)',
+                              yaxis_title='温度 (℃)')
+            st.plotly_chart(fig, use_container_width=True)
+
+            # 各指标的分布与过程能力
+            st.subheader("📊 指标分布与过程能力 (Cpk)")
+            by_channel = st.checkbox("按感温线分别统计", key="board_by_channel")
+            capability = summarize_profile_capability(metrics, stack.channels, params, by_channel)
+            st.dataframe(capability.round(3))
+
+            metric = st.selectbox("指标分布:", list(PROFILE_CHECKS),
+                                  format_func=lambda key: f"{PROFILE_CHECKS[key][0]}({PROFILE_CHECKS[key][1]})",
+                                  key="board_metric")
+            name, unit, low_key, high_key = PROFILE_CHECKS[metric]
+            box_fig = go.Figure()
+            for j, tc in enumerate(stack.channels):
+                box_fig.add_trace(go.Box(y=metrics[metric][:, j], name=tc, boxpoints='all', text=stack.runs))
+            for key in (low_key, high_key):
+                if key:
+                    box_fig.add_hline(y=params.get(key), line_dash='dash', line_color='red',
+                                      annotation_text=f"{params.get(key)}")
+            box_fig.update_layout(title=f"{name} 分布", yaxis_title=f"{name}({unit})", height=450)
+            st.plotly_chart(box_fig, use_container_width=True)
+
+            # 各板明细
+            detail = pd.DataFrame({
+                '曲线': np.repeat(stack.runs, len(stack.channels)),
+                '感温线': np.tile(stack.channels, len(stack.runs)),
+                **{f"{PROFILE_CHECKS[key][0]}({PROFILE_CHECKS[key][1]})": metrics[key].ravel()
+                   for key in PROFILE_CHECKS}
+            })
+            detail = detail[~np.isnan(metrics['peak_temp'].ravel())]
+            with st.expander("各板指标明细"):
+                st.dataframe(detail.round(3))
+            st.download_button("下载过程能力统计", capability.to_csv(index=False).encode('utf-8-sig'),
+                               file_name="炉温曲线过程能力.csv", mime="text/csv")
 
-            for tc, results in all_results.items():
-                report_text += f"感温线 {tc}:\n"
-                report_text += f"  峰值温度: {results.get('peak_temp', 0):.1f}℃\n"
-                report_text += f"  TL以上时间: {results.get('tl_time', 0):.1f}s\n"
-                report_text += f"  预热斜率: {results.get('preheat_slope', 0):.2f}℃/s\n\n"
-
-            st.download_button(
-                label="下载分析报告",
-                data=report_text,
-                file_name="炉温曲线分析报告.txt",
-                mime="text/plain"
-            )
-
-# 页脚
-st.markdown("---")
-st.markdown("**炉温曲线分析系统 v1.0** - 基于无铅锡膏供应商推荐参数")
+    # 页脚
+    st.markdown("---")
+    st.markdown("**炉温曲线分析系统 v1.0** - 基于无铅锡膏供应商推荐参数")
+
+
+if __name__ == "__main__":
+    # streamlit run 启动时运行网页界面，直接用python运行时作为命令行批处理工具
+    if st.runtime.exists():
+        main()
+    else:
+        sys.exit(batch_main())